@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Watch mode: process new recordings incrementally
+"""
+import sys
+from pathlib import Path
+
+# Add src to path for imports
+p = Path(__file__)
+print(p)
+project_root = p.parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+from video_watermark.watch import main
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -5,6 +5,8 @@ import logging
 from . import common
 from .core.ffmpeg_processor import FFmpegProcessor
 
+AUDIO_CONFIG = {'output': 'm4a'}
+
 def main():
     asyncio.run(gen_audio())
 
@@ -18,15 +20,13 @@ async def gen_audio():
     if len(all) == 0:
         logging.info(f"{video_dir} 目录下没有原视频文件,请检查VIDEO_DIR路径配置是否正确")
         return
-    processed_map = common.to_map(common.get_videos(target_audio_dir))
-    all_map = common.to_map(all)
-    difference = set(all_map.keys()) - set(processed_map.keys())
-    if len(difference) == 0:
+    # 原视频内容没有变化的跳过, 改名的原视频直接使用已有的音频
+    index = common.load_output_index()
+    videos = [v for v in all if not is_extracted(v, target_audio_dir, index)]
+    common.save_output_index(index)
+    if len(videos) == 0:
         logging.info(f"{video_dir} 目录下音视频已经处理过了")
         return
-    videos = []
-    for diff in difference:
-        videos.append(all_map[diff])
 
     # 创建FFmpeg处理器
     config = {}  # 可以根据需要添加配置
@@ -46,8 +46,27 @@ async def gen_audio():
         elif isinstance(result, Exception):
             logging.error(f"处理目录时出错: {result}")
 
+    record_outputs([v for v, result in zip(videos, results) if result is True], target_audio_dir)
     logging.info(f"共提取了{cnt}个音频文件")
 
 
+def is_extracted(video, target_audio_dir, index: dict = None) -> bool:
+    """原视频的音频是否已经提取过且原视频内容没有变化, 改名的原视频直接使用已有的音频"""
+    return common.check_output(video, _output(target_audio_dir, video), AUDIO_CONFIG, index=index)
+
+
+def record_outputs(videos, target_audio_dir):
+    """记录本次成功提取的音频的指纹"""
+    index = common.load_output_index()
+    for video in videos:
+        if _output(target_audio_dir, video).exists():
+            common.record_output(video, _output(target_audio_dir, video), AUDIO_CONFIG, index=index)
+    common.save_output_index(index)
+
+
+def _output(target_audio_dir, video):
+    return target_audio_dir.joinpath(f'{video.stem}.m4a')
+
+
 if __name__ == '__main__':
     main()
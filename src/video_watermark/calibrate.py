@@ -0,0 +1,31 @@
+import logging
+import sys
+from pathlib import Path
+
+from . import common
+from .core import encoder_profile
+
+
+def main():
+    """
+    测量本机libx264各preset和crf的编码速度、码率和SSIM/PSNR, 保存为encoder_profile.json
+    usage: python -m video_watermark.calibrate [有代表性的视频] [截取秒数]
+    """
+    common.init()
+    clip = Path(sys.argv[1]) if len(sys.argv) > 1 else None
+    if clip and not clip.exists():
+        logging.info(f"视频不存在: {clip}")
+        return
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    profile = encoder_profile.calibrate(clip, seconds)
+    if not profile:
+        return
+    for target in ('quality', 'throughput'):
+        chosen = encoder_profile.select(profile['results'], target, common.get_encoder_min_fps(),
+                                        common.get_encoder_min_ssim())
+        logging.info(f"ENCODER_TARGET={target}: {chosen}")
+    logging.info(f"编码参数profile已保存: {common.get_encoder_profile_file()}")
+
+
+if __name__ == '__main__':
+    main()
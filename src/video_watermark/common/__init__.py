@@ -6,6 +6,7 @@ from .file_operations import *
 from .environment import *
 from .logging_config import *
 from .person_management import *
+from .output_cache import *
 from .video_operations import *
 
 # Main initialization function
@@ -39,19 +39,24 @@ def get_person_video_stage_dir(person):
     return get_target_dir() / "stage1" / person
 
 
-def get_person_origin_dir():
-    """Get person's origin directory."""
-    return get_target_dir() / "stage2"
+def get_job_scratch_dir(person, video_stem):
+    """Get isolated scratch directory of one (person, video) job."""
+    return get_target_dir() / "scratch" / person / video_stem
 
 
-def get_frame_output_dir():
-    """Get frame output directory."""
-    return get_target_dir() / "frame_candidate"
+def get_person_origin_dir(person, video_stem):
+    """Get person's origin frames directory of one video job."""
+    return get_job_scratch_dir(person, video_stem) / "stage2"
 
 
-def get_frame_processed_dir():
-    """Get processed frame directory."""
-    return get_target_dir() / "frame_processed"
+def get_frame_output_dir(person, video_stem):
+    """Get frame output directory of one video job."""
+    return get_job_scratch_dir(person, video_stem) / "frame_candidate"
+
+
+def get_frame_processed_dir(person, video_stem):
+    """Get processed frame directory of one video job."""
+    return get_job_scratch_dir(person, video_stem) / "frame_processed"
 
 
 def get_recover_dir():
@@ -79,11 +84,56 @@ def get_audio_dir():
     return get_target_dir() / 'audio'
 
 
+def get_audio_cache_dir():
+    """Get directory of denoised audio tracks cached at concat."""
+    return get_target_dir() / 'audio_cache'
+
+
 def get_scale_dir():
     """Get scale directory."""
     return get_target_dir() / 'scale'
 
 
+def get_mezzanine_dir():
+    """Get mezzanine cache directory."""
+    return get_target_dir() / 'mezzanine'
+
+
+def get_course_intermediate_dir():
+    """Get directory of intermediate videos written by the course planner."""
+    return get_target_dir() / 'course'
+
+
+def get_segment_dir(process_id: str):
+    """Get checkpoint directory of a segment-parallel encoding job."""
+    return get_target_dir() / 'segments' / process_id
+
+
+def get_forensic_dir():
+    """Get A/B segment forensic watermark directory."""
+    return get_target_dir() / 'forensic'
+
+
+def get_forensic_video_dir(video_stem):
+    """Get A/B segments directory of one source video."""
+    return get_forensic_dir() / video_stem
+
+
+def get_forensic_ids_file():
+    """Get person -> forensic id mapping file."""
+    return get_forensic_dir() / 'forensic_ids.json'
+
+
+def get_probe_index_file():
+    """Get media probe catalog index file."""
+    return get_target_dir() / 'probe_index.json'
+
+
+def get_encoder_profile_file():
+    """Get encoder profile file measured by calibrate."""
+    return find_project_root() / 'encoder_profile.json'
+
+
 def get_logging_dir():
     """Get logging directory."""
     return find_project_root().joinpath("logs").resolve()
@@ -67,6 +67,11 @@ def keep_stage1_file():
     return __get_env('KEEP_STAGE1_VIDEO', '1') == '1'
 
 
+def is_single_encode_invisible():
+    """Check if invisible watermark videos are encoded once (no stage1 re-encode)."""
+    return __get_env('SINGLE_ENCODE_INVISIBLE', '0') == '1'
+
+
 def is_compress_audio():
     """Check if should compress audio files."""
     return __get_env('COMPRESS_AUDIO', '0') == '1'
@@ -106,6 +111,197 @@ def get_ffmpeg_concurrency():
     """Get ffmpeg concurrency number."""
     return int(__get_env('FFMPEG_CONCURRENCY', '2'))
 
+def get_invisible_concurrency():
+    """Get invisible watermark jobs concurrency number."""
+    return max(1, int(__get_env('INVISIBLE_CONCURRENCY', '1')))
+
+def get_frame_workers():
+    """Get process pool size for invisible watermark frame embedding, default is cpu count."""
+    return max(1, int(__get_env('FRAME_WORKERS', str(os.cpu_count() or 1))))
+
+def get_frame_extract_backend():
+    """Get sample frame extract backend, opencv or ffmpeg."""
+    return __get_env('FRAME_EXTRACT_BACKEND', 'opencv')
+
+def get_probe_concurrency():
+    """Get how many files are probed at the same time."""
+    return max(1, int(__get_env('PROBE_CONCURRENCY', '8')))
+
+def is_forensic_mode():
+    """Check if persons' videos are assembled from A/B segments instead of encoded one by one."""
+    return __get_env('FORENSIC_MODE', '0') == '1'
+
+def get_forensic_segment_seconds():
+    """Get A/B segment length in seconds."""
+    return int(__get_env('FORENSIC_SEGMENT_SECONDS', '10'))
+
+def get_forensic_variant_strength():
+    """Get brightness difference of A/B variants, A is -strength and B is +strength."""
+    return float(__get_env('FORENSIC_VARIANT_STRENGTH', '0.01'))
+
+def get_forensic_id_bits():
+    """Get person id bits of A/B pattern, rounded up to a multiple of 4."""
+    bits = int(__get_env('FORENSIC_ID_BITS', '16'))
+    return max(4, (bits + 3) // 4 * 4)
+
+def get_forensic_logo_segments():
+    """Get how many leading segments carry the person's logo, 0 means no logo."""
+    return int(__get_env('FORENSIC_LOGO_SEGMENTS', '0'))
+
+def get_fanout_batch_size():
+    """Get how many persons share one ffmpeg process for plain watermark videos, 1 means no fan-out."""
+    return max(1, int(__get_env('FANOUT_BATCH_SIZE', '1')))
+
+def is_use_mezzanine():
+    """Check if the person-independent crop/scale stage is cached as a mezzanine file."""
+    return __get_env('USE_MEZZANINE', '0') == '1'
+
+def get_mezzanine_cache_size():
+    """Get mezzanine cache size limit in bytes, default 50GB."""
+    return int(float(__get_env('MEZZANINE_CACHE_SIZE_GB', '50')) * 1024 ** 3)
+
+def get_mezzanine_crf():
+    """Get mezzanine crf, 0 means lossless."""
+    return int(__get_env('MEZZANINE_CRF', '0'))
+
+def get_mezzanine_preset():
+    """Get mezzanine x264 preset."""
+    return __get_env('MEZZANINE_PRESET', 'ultrafast')
+
+def get_segment_parallel_chunks():
+    """Get how many keyframe-aligned segments a long video is encoded in parallel, 0 or 1 means disabled."""
+    return int(__get_env('SEGMENT_PARALLEL_CHUNKS', '0'))
+
+def get_segment_parallel_min_duration():
+    """Get minimum duration in seconds of a video to use segment-parallel encoding."""
+    return float(__get_env('SEGMENT_PARALLEL_MIN_DURATION', '600'))
+
+def is_concat_stream_copy():
+    """Check if concat stream-copies the video when all inputs have the same codec parameters."""
+    return __get_env('CONCAT_STREAM_COPY', '0') == '1'
+
+def get_scale_renditions():
+    """
+    Get renditions of scale, e.g. '720p:17,540p:20,480p:23' (name:crf), empty means a single 1280x720 output.
+    :return: [{'name': '540p', 'width': 960, 'height': 540, 'crf': 20}, ...]
+    """
+    renditions = []
+    for item in __get_env('SCALE_RENDITIONS', '').split(','):
+        if not item.strip():
+            continue
+        name, _, crf = item.strip().partition(':')
+        height = int(name.rstrip('p'))
+        # 16:9, 宽度取偶数
+        width = (height * 16 // 9 + 1) // 2 * 2
+        renditions.append({'name': name, 'width': width, 'height': height, 'crf': int(crf or 17)})
+    return renditions
+
+def is_use_passthrough():
+    """Check if sources already meeting the target parameters are hardlinked or remuxed instead of re-encoded."""
+    return __get_env('USE_PASSTHROUGH', '1') == '1'
+
+def get_passthrough_max_bitrate():
+    """Get max video bitrate in kbps of a source that can be passed through without re-encoding."""
+    return int(__get_env('PASSTHROUGH_MAX_BITRATE', '5000'))
+
+def get_encoder_target():
+    """Get encoder profile target: quality, throughput, empty means use the configured preset/crf."""
+    return __get_env('ENCODER_TARGET', '')
+
+def get_encoder_min_fps():
+    """Get minimum encode fps of the throughput target."""
+    return float(__get_env('ENCODER_MIN_FPS', '60'))
+
+def get_encoder_min_ssim():
+    """Get minimum SSIM of the quality target."""
+    return float(__get_env('ENCODER_MIN_SSIM', '0.98'))
+
+def is_cpu_partition():
+    """Check if cores are split among running ffmpeg processes(-threads and CPU pinning)."""
+    return __get_env('CPU_PARTITION', '0') == '1'
+
+def is_ffmpeg_adaptive_concurrency():
+    """Check if ffmpeg concurrency is adjusted automatically from the aggregate speed= of running processes."""
+    return __get_env('FFMPEG_ADAPTIVE_CONCURRENCY', '0') == '1'
+
+def get_ffmpeg_min_concurrency():
+    """Get floor of adaptive ffmpeg concurrency."""
+    return int(__get_env('FFMPEG_MIN_CONCURRENCY', '1'))
+
+def get_ffmpeg_max_concurrency():
+    """Get ceiling of adaptive ffmpeg concurrency, default is half of the cpu count."""
+    return int(__get_env('FFMPEG_MAX_CONCURRENCY', str(max(1, (os.cpu_count() or 2) // 2))))
+
+def is_use_dag_scheduler():
+    """Check if all (person, video) jobs are scheduled as one DAG across resource pools."""
+    return __get_env('USE_DAG_SCHEDULER', '0') == '1'
+
+def get_pool_limits():
+    """
+    Get resource pool limits of the DAG scheduler, e.g. 'encode=2,embed=1,disk=2,network=3'.
+    encode and embed default to FFMPEG_CONCURRENCY and INVISIBLE_CONCURRENCY.
+    """
+    limits = {
+        'encode': get_ffmpeg_concurrency(),
+        'embed': get_invisible_concurrency(),
+        'disk': 2,
+        'network': 3
+    }
+    for item in __get_env('POOL_LIMITS', '').split(','):
+        name, _, limit = item.strip().partition('=')
+        if name and limit:
+            limits[name] = max(1, int(limit))
+    return limits
+
+def get_process_order():
+    """Get processing order: person(all videos of one person, then the next person) or video(all persons of one video, then the next video)."""
+    return __get_env('PROCESS_ORDER', 'person')
+
+def get_person_order():
+    """Get person processing order: file, priority(third column of 名单.txt) or sjf(shortest remaining work first)."""
+    return __get_env('PERSON_ORDER', 'file')
+
+def get_upload_speed():
+    """Get estimated upload speed in MB/s, used by shortest-job-first ordering."""
+    return float(__get_env('UPLOAD_SPEED_MBPS', '5'))
+
+def is_share_on_ready():
+    """Check if a person's share link is generated and sent as soon as all the person's videos are uploaded."""
+    return __get_env('SHARE_ON_READY', '0') == '1'
+
+def get_watch_stable_seconds():
+    """Get seconds a file's size must stay unchanged before watch mode treats it as finished."""
+    return int(__get_env('WATCH_STABLE_SECONDS', '30'))
+
+def get_watch_poll_interval():
+    """Get watch mode poll interval in seconds."""
+    return int(__get_env('WATCH_POLL_INTERVAL', '5'))
+
+def is_watch_use_inotify():
+    """Check if watch mode uses inotifywait when it is installed, otherwise polls mtime snapshots."""
+    return __get_env('WATCH_USE_INOTIFY', '1') == '1'
+
+def get_pipeline_concurrency():
+    """
+    Get worker count of each pipeline stage, e.g. 'concat=2,scale=1,watermark=1,upload=3,share=1'.
+    """
+    limits = {
+        'concat': 2,
+        'scale': 1,
+        'watermark': 1,
+        'upload': 3,
+        'share': 1
+    }
+    for item in __get_env('PIPELINE_CONCURRENCY', '').split(','):
+        name, _, limit = item.strip().partition('=')
+        if name and limit:
+            limits[name] = max(1, int(limit))
+    return limits
+
+def get_pipeline_queue_size():
+    """Get max number of items waiting between two pipeline stages."""
+    return int(__get_env('PIPELINE_QUEUE_SIZE', '2'))
+
 def __get_env(name, default_val):
     """Get environment variable with default value."""
     return os.getenv(name, default_val).strip()
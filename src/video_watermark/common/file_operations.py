@@ -171,23 +171,23 @@ def read_csv_to_dict(file_path):
         dict: 第一列作为键，第二列作为值（如果只有一列，则值为空字符串）
     """
     result = {}
+    for row in read_csv_rows(file_path):
+        key = row[0].strip()  # 第一列作为key
+        value = row[1].strip() if len(row) >= 2 else ""  # 第二列作为value（如果不存在则设为空）
+        result[key] = value
 
+    return result
+
+
+def read_csv_rows(file_path):
+    """读取CSV文件的所有行，跳过注释行（#开头）和空行"""
     with open(file_path, 'r', encoding='utf-8') as f:
         # 读取所有非注释行
         lines = [line for line in f if not line.strip().startswith('#')]
         content = ''.join(lines).replace('，', ',')  # 替换中文逗号为英文逗号
 
-        # 使用csv模块读取处理后的内容
-        reader = csv.reader(StringIO(content))
-
-        for row in reader:
-            if not row:  # 跳过空行
-                continue
-            key = row[0].strip()  # 第一列作为key
-            value = row[1].strip() if len(row) >= 2 else ""  # 第二列作为value（如果不存在则设为空）
-            result[key] = value
-
-    return result
+    # 使用csv模块读取处理后的内容
+    return [row for row in csv.reader(StringIO(content)) if row]
 
 
 def read_content(file_path):
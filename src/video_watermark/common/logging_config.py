@@ -25,6 +25,16 @@ def get_person_log():
     return get_logging_dir().joinpath("person.log")
 
 
+def get_shareable_log():
+    """Get file path of persons whose videos are all processed and uploaded."""
+    return get_logging_dir().joinpath("shareable.log")
+
+
+def get_output_cache_json():
+    """Get fingerprint index file of generated outputs."""
+    return get_logging_dir().joinpath("output_cache.json")
+
+
 def get_person_detail_json():
     """Get person detail JSON file path."""
     return get_logging_dir().joinpath("person_detail.json")
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""按原视频内容和生效参数计算的输出指纹"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from .directories import get_person_video_result_dir, get_person_metadata_result_dir
+from .environment import get_ffmpeg_options, get_scale_renditions, get_encoder_target, is_use_passthrough, \
+    get_passthrough_max_bitrate, is_single_encode_invisible, is_use_mezzanine, get_mezzanine_crf, \
+    get_mezzanine_preset, is_forensic_mode, get_forensic_segment_seconds, get_forensic_variant_strength, \
+    get_forensic_id_bits, get_forensic_logo_segments
+from .file_operations import read_json_file, write_json_to_file
+from .logging_config import get_output_cache_json
+from .person_management import get_person_videos, add_video_to_person_detail, remove_video_from_person_detail, \
+    unfinish
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def source_hash(video, index: dict = None) -> str:
+    """
+    原视频的快速内容哈希: 文件大小 + 开头、中间、结尾各1MB(blake2b)
+    结果按路径、大小和修改时间缓存在index中
+    """
+    p = Path(video).resolve()
+    stat = p.stat()
+    sources = index.setdefault('sources', {}) if index is not None else {}
+    cached = sources.get(str(p))
+    if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+        return cached['hash']
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(stat.st_size).encode('utf-8'))
+    with p.open('rb') as f:
+        for offset in sorted({0, max(0, stat.st_size // 2 - HASH_CHUNK_SIZE // 2),
+                              max(0, stat.st_size - HASH_CHUNK_SIZE)}):
+            f.seek(offset)
+            h.update(f.read(HASH_CHUNK_SIZE))
+    sources[str(p)] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': h.hexdigest()}
+    return h.hexdigest()
+
+
+def config_hash(config: dict) -> str:
+    """生效参数的哈希, 参数中需要包含影响输出的环境变量配置(见scale_settings, watermark_settings)"""
+    raw = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def fingerprint(video, config: dict, person: str = '', index: dict = None) -> str:
+    """输出的指纹: 原视频内容 + 生效参数 + 人"""
+    raw = f'{source_hash(video, index)}|{config_hash(config)}|{person}'
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def check_output(video, output: Path, config: dict, person: str = '', exists: bool = None,
+                 index: dict = None) -> bool:
+    """
+    检查输出对于原视频和参数是否是最新的
+    - 输出存在且指纹没有变化(或还没有指纹, 直接采用): True
+    - 输出存在但原视频或参数变化了: False, 在record_output之前输出一直标记为过期
+    - 输出不存在, 但有相同指纹的其他输出(原视频改名): 链接为该输出, 返回True
+    :param exists: 输出是否视为已生成, 默认为output.exists()
+    :param index: 已加载的index, 由调用方保存, 默认加载并保存index文件
+    """
+    own_index = index is None
+    if own_index:
+        index = load_output_index()
+    outputs = index.setdefault('outputs', {})
+    key = str(Path(output).resolve())
+    fp = fingerprint(video, config, person, index)
+    exists = Path(output).exists() if exists is None else exists
+
+    result = False
+    if exists:
+        entry = outputs.get(key)
+        if entry is None or entry['fingerprint'] == fp:
+            outputs[key] = {'fingerprint': fp, 'source': str(video), 'person': person}
+            result = True
+        else:
+            logging.info(f"原视频或处理参数已变化, 需要重新生成: {output}")
+            entry['fingerprint'] = ''
+    else:
+        old = next((k for k, entry in outputs.items()
+                    if entry['fingerprint'] == fp and k != key and Path(k).exists()), None)
+        if old:
+            _link(Path(old), Path(output))
+            logging.info(f"原视频内容和处理参数没有变化, 直接使用已有结果: {old} -> {output}")
+            outputs[key] = dict(outputs[old], source=str(video), relinked_from=old)
+            result = True
+
+    if own_index:
+        save_output_index(index)
+    return result
+
+
+def record_output(video, output: Path, config: dict, person: str = '', index: dict = None):
+    """记录新生成的输出的指纹"""
+    own_index = index is None
+    if own_index:
+        index = load_output_index()
+    outputs = index.setdefault('outputs', {})
+    outputs[str(Path(output).resolve())] = {'fingerprint': fingerprint(video, config, person, index),
+                                            'source': str(video), 'person': person}
+    if own_index:
+        save_output_index(index)
+
+
+def reconcile_person_videos(all_videos, persons, config: dict, invisible_videos=(), record: bool = False) -> int:
+    """
+    按输出指纹同步person_detail.json:
+    处理前, 原视频或参数变化了的已处理视频从记录中删除(会重新生成), 改名的原视频直接链接已有结果并记为已处理;
+    处理后(record=True), 记录所有已处理视频的指纹
+    :return: 变化的记录数
+    """
+    index = load_output_index()
+    invisible_set = {v.name for v in invisible_videos}
+    config = dict(config, **watermark_settings())
+    result_video_type = config.get('result_video_type')
+    changed = 0
+    for person in persons:
+        processed = get_person_videos(person)
+        for video in all_videos:
+            if not Path(video).exists():
+                continue
+            filename = f'{video.stem}{result_video_type}'
+            output = get_person_video_result_dir(person).joinpath(filename)
+            done = filename in processed
+            effective = dict(config, invisible=video.name in invisible_set)
+            if record:
+                if done:
+                    record_output(video, output, effective, person, index=index)
+                continue
+            fresh = check_output(video, output, effective, person, exists=done, index=index)
+            if done and not fresh:
+                remove_video_from_person_detail(filename, person)
+                unfinish(person)
+                changed += 1
+            elif not done and fresh:
+                _link_metadata(person, index['outputs'][str(output.resolve())], video)
+                add_video_to_person_detail(filename, person)
+                changed += 1
+    save_output_index(index)
+    if changed:
+        logging.info(f"按输出指纹更新了{changed}条处理记录")
+    return changed
+
+
+def scale_settings() -> dict:
+    """影响scale结果的环境变量配置, 参数中的preset/crf已经是ENCODER_TARGET选择后的值"""
+    return {
+        'ffmpeg_options': get_ffmpeg_options(),
+        'scale_renditions': get_scale_renditions(),
+        'encoder_target': get_encoder_target(),
+        'passthrough': is_use_passthrough() and get_passthrough_max_bitrate()
+    }
+
+
+def watermark_settings() -> dict:
+    """影响每个人的水印视频的环境变量配置, 只在对应功能开启时计入, 避免无关的配置变化使结果过期"""
+    settings = dict(scale_settings(), single_encode_invisible=is_single_encode_invisible())
+    settings.pop('scale_renditions')
+    if is_use_mezzanine():
+        settings['mezzanine'] = [get_mezzanine_crf(), get_mezzanine_preset()]
+    if is_forensic_mode():
+        settings['forensic'] = [get_forensic_segment_seconds(), get_forensic_variant_strength(),
+                                get_forensic_id_bits(), get_forensic_logo_segments()]
+    return settings
+
+
+def load_output_index() -> dict:
+    return read_json_file(get_output_cache_json())
+
+
+def save_output_index(index: dict):
+    write_json_to_file(index, get_output_cache_json())
+
+
+def _link_metadata(person, entry: dict, video):
+    """暗水印视频的metadata随结果一起使用"""
+    old = get_person_metadata_result_dir(person).joinpath(f"{Path(entry['relinked_from']).stem}.json")
+    if old.exists():
+        _link(old, get_person_metadata_result_dir(person).joinpath(f'{video.stem}.json'))
+
+
+def _link(src: Path, dst: Path):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
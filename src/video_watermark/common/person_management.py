@@ -3,8 +3,9 @@
 import logging
 from natsort import natsorted
 from .directories import get_video_dir
-from .file_operations import read_all_lines, write_lines_to_file, read_json_file, write_json_to_file, read_csv_to_dict
-from .logging_config import get_person_log, get_person_detail_json
+from .file_operations import read_all_lines, write_lines_to_file, read_json_file, write_json_to_file, read_csv_to_dict, \
+    read_csv_rows
+from .logging_config import get_person_log, get_person_detail_json, get_shareable_log
 from .environment import is_test
 from .video_operations import to_map
 
@@ -28,6 +29,35 @@ def get_person_name_mappings():
     return read_csv_to_dict(filepath)
 
 
+def get_person_priorities():
+    """
+    Get dict of person name to priority from the optional third column of 名单.txt, smaller is earlier.
+    :return: dict, eg: {'person1': 1}, persons without priority are not included
+    """
+    filepath = get_video_dir().joinpath("名单.txt").resolve().as_posix()
+    result = {}
+    for row in read_csv_rows(filepath):
+        if len(row) >= 3 and row[2].strip():
+            try:
+                result[row[0].strip()] = float(row[2].strip())
+            except ValueError:
+                logging.warning(f"invalid priority of person: {row[0].strip()}, priority: {row[2].strip()}")
+    return result
+
+
+def mark_shareable(person):
+    """Mark person as shareable: all videos are processed and uploaded."""
+    lines = set(read_all_lines(get_shareable_log()))
+    if person not in lines:
+        lines.add(person)
+        write_lines_to_file(get_shareable_log(), sorted(lines))
+
+
+def is_shareable(person):
+    """Check if person is shareable."""
+    return person in set(read_all_lines(get_shareable_log()))
+
+
 def finish(person):
     """Mark person as finished."""
     dataset = _get_person_dataset()
@@ -38,6 +68,18 @@ def finish(person):
         write_lines_to_file(get_person_log(), list(dataset))
 
 
+def unfinish(person):
+    """Mark person as not finished(and not shareable), e.g. some outputs need to be rebuilt."""
+    dataset = _get_person_dataset()
+    if person in dataset:
+        dataset.remove(person)
+        write_lines_to_file(get_person_log(), list(dataset))
+    lines = set(read_all_lines(get_shareable_log()))
+    if person in lines:
+        lines.remove(person)
+        write_lines_to_file(get_shareable_log(), sorted(lines))
+
+
 def is_finished(person):
     """Check if person is finished."""
     return person in _get_person_dataset()
@@ -60,6 +102,15 @@ def add_video_to_person_detail(video: str, person: str):
     logging.info(f"video: {video} is written to person: {person}")
 
 
+def remove_video_from_person_detail(video: str, person: str):
+    """Remove video from person detail, it will be processed again."""
+    videos = get_person_videos(person)
+    if video in videos:
+        videos.remove(video)
+        _update_person_videos(person, videos)
+        logging.info(f"video: {video} is removed from person: {person}")
+
+
 def add_videos_to_person_detail(to_add_videos, person):
     """Add processed videos to person detail."""
     if not to_add_videos:
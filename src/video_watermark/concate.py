@@ -1,6 +1,8 @@
 from pathlib import Path
 import logging
 import asyncio
+import os
+import shutil
 
 from . import common
 from .core.ffmpeg_processor import FFmpegProcessor
@@ -27,19 +29,12 @@ async def concate():
     config = {}  # 可以根据需要添加配置
     ffmpeg_processor = FFmpegProcessor(config)
 
-    video_format = "*" + common.get_video_format()
     cnt = 0
     tasks = []
     for d in last_layer_subdirs:
         logging.info(f'begin to process dir: {d}')
-        # create mylist.txt
-        video_files = sorted([f for f in d.rglob(video_format) if f.is_file()], key=lambda x: x.name)
-        if len(video_files) == 0:
+        if not write_list_file(d):
             continue
-        lines = []
-        for v in video_files:
-            lines.append(f"file '{v.name}'")
-        common.write_lines_to_file(d.joinpath('mylist.txt'), lines)
 
         # 添加异步任务
         task = process_directory(ffmpeg_processor, d)
@@ -58,6 +53,19 @@ async def concate():
     logging.info(f'本次共处理了{cnt}集视频')
 
 
+def write_list_file(d: Path) -> bool:
+    """生成目录的拼接列表mylist.txt, 目录中没有视频时返回False"""
+    video_format = "*" + common.get_video_format()
+    video_files = sorted([f for f in d.rglob(video_format) if f.is_file()], key=lambda x: x.name)
+    if len(video_files) == 0:
+        return False
+    lines = []
+    for v in video_files:
+        lines.append(f"file '{v.name}'")
+    common.write_lines_to_file(d.joinpath('mylist.txt'), lines)
+    return True
+
+
 async def process_directory(ffmpeg_processor: FFmpegProcessor, d: Path) -> str:
     """处理单个目录的视频合并"""
     try:
@@ -74,5 +82,20 @@ async def process_directory(ffmpeg_processor: FFmpegProcessor, d: Path) -> str:
         raise
 
 
+def publish(result_video: Path, video_dir: Path) -> Path:
+    """拼接结果硬链接(跨文件系统时复制)到VIDEO_DIR, 供后续scale和加水印使用, 重新拼接后替换复制的旧结果"""
+    target = video_dir.joinpath(result_video.name)
+    if target.exists() and not os.path.samefile(result_video, target) \
+            and result_video.stat().st_mtime > target.stat().st_mtime:
+        common.delete_file(target)
+    if not target.exists():
+        try:
+            os.link(result_video, target)
+        except OSError:
+            shutil.copy2(result_video, target)
+        logging.info(f"拼接结果放入VIDEO_DIR: {target}")
+    return target
+
+
 if __name__ == '__main__':
     main()
@@ -1,7 +1,7 @@
 """Core video processing functionality."""
 
 from .video_watermark_processor import VideoWatermarkProcessor
-from .core import encodewatermark_image, decodewatermark_image
+from .core import encodewatermark_image, decodewatermark_image, embed_frame
 from .pils import *
 
-__all__ = ['VideoWatermarkProcessor', 'encodewatermark_image', 'decodewatermark_image']
\ No newline at end of file
+__all__ = ['VideoWatermarkProcessor', 'encodewatermark_image', 'decodewatermark_image', 'embed_frame']
\ No newline at end of file
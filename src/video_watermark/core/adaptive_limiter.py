@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from .. import common
+
+
+class AdaptiveLimiter:
+    """
+    根据ffmpeg进度行中的speed=自动调整并发数的限流器, 用法与asyncio.Semaphore相同(async with)
+
+    每隔一段时间统计所有运行中进程的速度之和(总吞吐)、CPU使用率和负载:
+    - 有任务在等待、CPU还有空闲时尝试增加并发
+    - 增加并发后总吞吐提升时继续增加, 没有提升时退回, 退回后冷却几个间隔再尝试增加, 避免并发来回震荡
+    - 负载过高时降低并发
+    并发数始终在[minimum, maximum]之间, 每次调整都会记录日志
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, interval: float = 30, cooldown: int = 4):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.interval = interval
+        # 退回后至少等待cooldown个间隔才再次尝试增加
+        self.cooldown = cooldown
+        self._cooldown_until = 0.0
+        self._running = 0
+        self._waiters = 0
+        self._condition = asyncio.Condition()
+        self._speeds: Dict[str, float] = {}
+        self._last_decision = time.time()
+        self._last_throughput: Optional[float] = None
+        self._last_step = 0
+        self._last_cpu_times = _read_cpu_times()
+
+    async def __aenter__(self):
+        async with self._condition:
+            self._waiters += 1
+            try:
+                await self._condition.wait_for(lambda: self._running < self.limit)
+            finally:
+                self._waiters -= 1
+            self._running += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    def record_speed(self, process_id: str, speed: float):
+        """记录进程最新的速度(相对实时的倍数), 到达调整间隔时做一次决策"""
+        self._speeds[process_id] = speed
+        if time.time() - self._last_decision >= self.interval:
+            self._decide()
+
+    def finish(self, process_id: str):
+        """进程结束, 不再计入总吞吐"""
+        self._speeds.pop(process_id, None)
+
+    def _decide(self):
+        self._last_decision = time.time()
+        throughput = sum(self._speeds.values())
+        cpu_busy = self._cpu_busy()
+        load = os.getloadavg()[0] / (os.cpu_count() or 1) if hasattr(os, 'getloadavg') else cpu_busy
+        previous = self._last_throughput
+        self._last_throughput = throughput
+        stats = (f"throughput: {throughput:.2f}x, previous: {previous or 0:.2f}x, cpu: {cpu_busy:.0%}, "
+                 f"load: {load:.2f}, running: {self._running}, waiting: {self._waiters}")
+
+        if load > 1.5 and self.limit > self.minimum:
+            self._set_limit(self.limit - 1, -1, f"负载过高, 降低并发, {stats}")
+        elif self._last_step > 0 and previous is not None and throughput <= previous * 1.05:
+            self._cooldown_until = self._last_decision + self.interval * self.cooldown
+            self._set_limit(self.limit - 1, 0, f"增加并发后总吞吐没有提升, 退回, {stats}")
+        elif self._waiters and cpu_busy < 0.9 and self.limit < self.maximum \
+                and self._last_decision >= self._cooldown_until:
+            self._set_limit(self.limit + 1, 1, f"有任务等待且CPU有空闲, 增加并发, {stats}")
+        else:
+            self._last_step = 0
+            logging.debug(f"ffmpeg并发保持{self.limit}, {stats}")
+
+    def _set_limit(self, limit: int, step: int, reason: str):
+        limit = min(max(limit, self.minimum), self.maximum)
+        self._last_step = step
+        if limit == self.limit:
+            return
+        logging.info(f"ffmpeg并发: {self.limit} -> {limit}, {reason}")
+        self.limit = limit
+        asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    def _cpu_busy(self) -> float:
+        """距离上一次决策的CPU使用率, 不支持/proc/stat时用负载估算"""
+        current = _read_cpu_times()
+        previous, self._last_cpu_times = self._last_cpu_times, current
+        if not current or not previous:
+            if hasattr(os, 'getloadavg'):
+                return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+            return 0.0
+        total = current[0] - previous[0]
+        idle = current[1] - previous[1]
+        return 1 - idle / total if total > 0 else 0.0
+
+
+def _read_cpu_times():
+    """/proc/stat中的CPU时间: (总时间, 空闲时间)"""
+    try:
+        with open('/proc/stat') as f:
+            values = [int(v) for v in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # idle + iowait
+    return sum(values), values[3] + (values[4] if len(values) > 4 else 0)
+
+
+_limiter = None
+
+
+def get_limiter() -> Optional[AdaptiveLimiter]:
+    """全局共享的自适应限流器, 未开启时返回None"""
+    global _limiter
+    if _limiter is None and common.is_ffmpeg_adaptive_concurrency():
+        _limiter = AdaptiveLimiter(common.get_ffmpeg_concurrency(), common.get_ffmpeg_min_concurrency(),
+                                   common.get_ffmpeg_max_concurrency())
+    return _limiter
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+from .. import common
+from . import probe
+
+
+class AudioCache:
+    """
+    每个原视频一条音轨缓存, 所有人合成最终视频时直接复用, 不再为每个人提取一次音频
+
+    优先使用拼接时降噪后的音轨; 没有时从视频中提取一次, 音频已经是aac时直接复制, 否则转码为aac.
+    音轨按视频文件名(不含扩展名)保存, 时长与视频不一致时认为已失效
+    """
+
+    def __init__(self, cache_dir: Path = None):
+        self.cache_dir = Path(cache_dir or common.get_audio_cache_dir())
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def lock(self, video: Path) -> asyncio.Lock:
+        """同一个视频的音轨只提取一次"""
+        name = Path(video).stem
+        if name not in self._locks:
+            self._locks[name] = asyncio.Lock()
+        return self._locks[name]
+
+    def denoised_track_path(self, name: str) -> Path:
+        """拼接时降噪后的音轨, 按拼接结果的文件名(不含扩展名)保存"""
+        common.create_dir(self.cache_dir)
+        return self.cache_dir.joinpath(f'{name}.m4a')
+
+    def track_path(self, video: Path) -> Path:
+        """从视频中提取的音轨"""
+        common.create_dir(self.cache_dir)
+        return self.cache_dir.joinpath(f'{Path(video).stem}.source.m4a')
+
+    def find_denoised_track(self, video: Path) -> Optional[Path]:
+        """查找视频在拼接时缓存的降噪音轨"""
+        return self._valid(video, self.cache_dir.joinpath(f'{Path(video).stem}.m4a'))
+
+    def lookup(self, video: Path) -> Optional[Path]:
+        """查找视频可以直接使用的音轨: 先找拼接时的降噪音轨, 再找之前提取的音轨"""
+        return self.find_denoised_track(video) or self._valid(video, self.cache_dir.joinpath(f'{Path(video).stem}.source.m4a'))
+
+    @staticmethod
+    def _valid(video: Path, track: Path) -> Optional[Path]:
+        if not track.exists():
+            return None
+        video_info = probe.get_catalog().get(video)
+        track_info = probe.get_catalog().get(track)
+        if not video_info or not track_info or abs(video_info['duration'] - track_info['duration']) > 1:
+            logging.info(f"缓存的音轨与视频时长不一致, 不复用: {track}")
+            return None
+        return track
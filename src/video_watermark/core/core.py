@@ -3,6 +3,10 @@ from pathlib import Path
 from PIL import Image
 from algorithm.firekepper import Watermark as fwatermark
 
+# 进程池worker中按(水印图片, seed)缓存读取并打乱后的水印比特, 同一个人的所有采样帧共用
+_MAX_WATERMARK_BITS = 8
+_watermark_bits = {}
+
 
 def encodewatermark_image(frame_processed_dir:Path, image:Path, watermark_image:Path, seed):
     """
@@ -26,6 +30,30 @@ def encodewatermark_image(frame_processed_dir:Path, image:Path, watermark_image:
     return ren
 
 
+def embed_frame(frame_processed_dir: Path, image: Path, watermark_image: Path, seed):
+    """
+    进程池中执行的加暗水印函数, 与encodewatermark_image结果一致, worker内复用水印图片的读取和打乱结果
+    :return:水印尺寸
+    """
+    bwm = fwatermark(seed[0], seed[1], seed[2])
+    bwm.read_ori_img(image)
+    key = (str(watermark_image), tuple(seed))
+    cached = _watermark_bits.get(key)
+    if cached is None:
+        bwm.read_wm(watermark_image)
+        if len(_watermark_bits) >= _MAX_WATERMARK_BITS:
+            _watermark_bits.pop(next(iter(_watermark_bits)))
+        _watermark_bits[key] = (bwm.wm, bwm.wm_shape, bwm.wm_flatten)
+    else:
+        # 与read_wm相同, 块索引依赖原图尺寸, 每帧重新计算
+        bwm.wm, bwm.wm_shape, bwm.wm_flatten = cached
+        bwm.init_block_add_index(bwm.ha_Y.shape)
+    bwm.embed(f"{frame_processed_dir}/{Path(image).name}")
+
+    height, width = bwm.wm_shape
+    return [width, height]
+
+
 def decodewatermark_image(input,
                           recoverresult_dir,
                           shape,
@@ -0,0 +1,51 @@
+import logging
+from pathlib import Path
+from typing import List
+
+from natsort import natsorted
+
+from .. import common
+
+
+def find_episode_dirs(root: Path) -> List[Path]:
+    """MTS根目录下的每个最后一层目录是一集, 按名称自然排序"""
+    all_subdirs = [d for d in root.rglob('*') if d.is_dir() and d.name != 'target']
+    last_layer_subdirs = [d for d in all_subdirs if not any(sub.is_dir() for sub in d.iterdir())]
+    return natsorted(last_layer_subdirs, key=lambda d: d.name)
+
+
+def plan_course(episode_dirs: List[Path], persons: List[str], result_video_type: str) -> List[dict]:
+    """
+    为每一集生成编码计划, 从MTS原始片段直接编码到每个人的最终视频:
+    - 明水印集: 一个ffmpeg滤镜图完成拼接 + 降噪 + crop/scale + 每个人的logo, 不写中间文件
+    - 暗水印集: 暗水印需要可以解码抽帧的视频, 先用同一个滤镜图写一份拼接 + 降噪 + crop/scale后的中间文件,
+      再走已有的暗水印流程
+    已经处理过的人会被跳过, 所有人都处理过的集不会出现在计划中
+    :return: [{'name', 'dir', 'list_file', 'video', 'invisible', 'persons'}, ...]
+    """
+    video_format = "*" + common.get_video_format()
+    plans = []
+    for i, d in enumerate(episode_dirs):
+        video = Path(f'{d.name}{result_video_type}')
+        todo = [person for person in persons if not common.is_already_processed(video, person)]
+        if not todo:
+            continue
+        video_files = sorted([f for f in d.rglob(video_format) if f.is_file()], key=lambda x: x.name)
+        if not video_files:
+            continue
+        list_file = d.joinpath('mylist.txt')
+        common.write_lines_to_file(list_file, [f"file '{v.name}'" for v in video_files])
+        plans.append({
+            'name': d.name,
+            'dir': d,
+            'list_file': list_file,
+            'video': video,
+            'invisible': common.is_need_add_invisible_watermark(i),
+            'persons': todo
+        })
+
+    for plan in plans:
+        stages = 'concat+afftdn+scale -> intermediate -> logo -> invisible' if plan['invisible'] \
+            else 'concat+afftdn+scale+logo'
+        logging.info(f"编码计划: {plan['name']}, {stages}, persons: {len(plan['persons'])}")
+    return plans
@@ -0,0 +1,103 @@
+import itertools
+import logging
+import os
+import re
+from typing import Callable, Dict, List, Optional
+
+from .. import common
+from . import adaptive_limiter
+
+
+class CpuPartitioner:
+    """
+    在同时运行的ffmpeg进程之间平分CPU核心
+
+    线程数(-threads, -filter_threads)在进程启动后无法修改, 按预期的并发数(并发限制, 运行中的进程更多时按实际数量)分配,
+    批次中第一个启动的进程也不会占满所有核心; 每个进程绑定到各自的一组CPU核心,
+    有进程启动或结束时重新划分核心并重新绑定所有运行中的进程。
+    不支持设置CPU亲和性的系统上只限制线程数
+    """
+
+    def __init__(self, cpus: List[int] = None, concurrency: Callable[[], int] = None):
+        self.cpus = sorted(cpus or _available_cpus())
+        self._concurrency = concurrency or (lambda: 1)
+        self._jobs: Dict[int, Optional[int]] = {}  # job id -> pid
+        self._ids = itertools.count()
+
+    def acquire(self) -> int:
+        """登记一个即将启动的进程, 返回job id"""
+        job_id = next(self._ids)
+        self._jobs[job_id] = None
+        return job_id
+
+    def threads(self) -> int:
+        """每个进程的线程数: 核心数按预期并发数和运行中的进程数中较大的一个平分"""
+        return max(1, len(self.cpus) // max(1, self._concurrency(), len(self._jobs)))
+
+    def apply(self, cmd: str, threads: int) -> str:
+        """为ffmpeg命令加上线程数: 全局的-filter_threads, 每个输出的-threads"""
+        cmd = re.sub(r'^ffmpeg ', f'ffmpeg -filter_threads {threads} ', cmd)
+        return re.sub(r' -y ', f' -threads {threads} -y ', cmd)
+
+    def started(self, job_id: int, pid: int):
+        """进程已启动, 重新划分核心"""
+        if job_id in self._jobs:
+            self._jobs[job_id] = pid
+            self._repin()
+
+    def release(self, job_id: int):
+        """进程已结束, 重新划分核心"""
+        if self._jobs.pop(job_id, None) is not None:
+            self._repin()
+
+    def _repin(self):
+        if not hasattr(os, 'sched_setaffinity'):
+            return
+        running = [pid for pid in self._jobs.values() if pid]
+        if not running:
+            return
+        share = max(1, len(self.cpus) // len(running))
+        for i, pid in enumerate(running):
+            start = (i * share) % len(self.cpus)
+            # 最后一个进程分到剩余的核心
+            end = len(self.cpus) if i == len(running) - 1 and len(running) <= len(self.cpus) else start + share
+            cpus = set(self.cpus[start:end])
+            _set_affinity(pid, cpus)
+        logging.debug(f"重新划分CPU核心: {len(running)}个进程, 每个进程{share}个核心")
+
+
+def _available_cpus() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return list(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _set_affinity(pid: int, cpus: set):
+    """绑定进程的所有线程, 只绑定主线程时已经创建的编码线程不会迁移"""
+    try:
+        tids = [int(tid) for tid in os.listdir(f'/proc/{pid}/task')]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            # 线程或进程已经结束
+            pass
+
+
+def _expected_concurrency() -> int:
+    """通用ffmpeg的并发限制, 开启自适应并发时取当前的限制"""
+    limiter = adaptive_limiter.get_limiter()
+    return limiter.limit if limiter else common.get_ffmpeg_concurrency()
+
+
+_partitioner = None
+
+
+def get_partitioner() -> CpuPartitioner:
+    """全局共享的CPU划分器, 所有FFmpegProcessor共用"""
+    global _partitioner
+    if _partitioner is None:
+        _partitioner = CpuPartitioner(concurrency=_expected_concurrency)
+    return _partitioner
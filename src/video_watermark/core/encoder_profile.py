@@ -0,0 +1,145 @@
+import logging
+import os
+import re
+import subprocess
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from .. import common
+from . import probe
+
+PRESETS = ['ultrafast', 'veryfast', 'faster', 'fast', 'medium', 'slow']
+CRFS = [17, 20, 23]
+SSIM_RE = re.compile(r'SSIM .*All:(\d+(?:\.\d+)?)')
+PSNR_RE = re.compile(r'PSNR .*average:(\d+(?:\.\d+)?|inf)')
+
+
+def calibrate(clip: Optional[Path] = None, seconds: int = 20, presets: List[str] = None,
+              crfs: List[int] = None) -> Optional[dict]:
+    """
+    在本机上测量libx264各preset和crf的编码速度、码率和质量, 保存为编码参数profile
+    :param clip: 有代表性的视频, 为空时使用lavfi生成的测试视频
+    :param seconds: 截取的时长
+    :return: profile, 参考视频或所有参数都失败时返回None
+    """
+    work_dir = common.get_target_dir().joinpath('calibrate')
+    common.delete_then_create(work_dir)
+    w, h = 1280, 720
+    reference = work_dir.joinpath('reference.mkv')
+    if clip:
+        source = f'-ss 0 -t {seconds} -i "{clip}"'
+    else:
+        source = f'-f lavfi -i testsrc2=size={w}x{h}:rate=25:duration={seconds}'
+    # 无损的参考视频, 所有候选参数都从它编码, 并与它比较质量
+    _run(f'ffmpeg {source} -vf "crop=min(iw\\,ih*16/9):ih,scale={w}:{h}" -an -c:v libx264 -crf 0 '
+         f'-preset ultrafast -y "{reference}"')
+    # calibrate目录下的探测结果只保存在内存中, 不写入probe_index.json
+    reference_info = probe.get_catalog().get(reference)
+    if not reference_info:
+        logging.error(f"calibrate: 参考视频编码或探测失败: {reference}")
+        common.delete_file(work_dir)
+        return None
+    frame_count = reference_info['frame_count']
+
+    results = []
+    for preset in presets or PRESETS:
+        for crf in crfs or CRFS:
+            output = work_dir.joinpath(f'{preset}_{crf}.mp4')
+            start = time.time()
+            _run(f'ffmpeg -i "{reference}" -c:v libx264 -crf {crf} -preset {preset} -pix_fmt yuv420p -y "{output}"')
+            elapsed = time.time() - start
+            info = probe.get_catalog().get(output) if output.exists() else None
+            if not info:
+                logging.warning(f"calibrate: 编码或探测失败, 跳过preset={preset}, crf={crf}")
+                continue
+            stderr = _run(f'ffmpeg -i "{output}" -i "{reference}" -filter_complex '
+                          f'"[0:v]split[a0][a1];[1:v]split[b0][b1];[a0][b0]ssim;[a1][b1]psnr" -f null -')
+            ssim, psnr = SSIM_RE.search(stderr), PSNR_RE.search(stderr)
+            result = {
+                'preset': preset,
+                'crf': crf,
+                'fps': round(frame_count / elapsed, 2) if elapsed else 0,
+                'bit_rate': info['bit_rate'],
+                'ssim': float(ssim.group(1)) if ssim else 0,
+                'psnr': float(psnr.group(1)) if psnr else 0
+            }
+            logging.info(f"calibrate: {result}")
+            results.append(result)
+
+    if not results:
+        logging.error("calibrate: 所有编码参数都失败了, 不保存profile")
+        common.delete_file(work_dir)
+        return None
+    profile = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+        'clip': str(clip) if clip else 'lavfi testsrc2',
+        'cpu_count': os.cpu_count(),
+        'resolution': f'{w}x{h}',
+        'results': results
+    }
+    common.write_json_to_file(profile, common.get_encoder_profile_file())
+    common.delete_file(work_dir)
+    return profile
+
+
+def select(results: List[dict], target: str, min_fps: float, min_ssim: float) -> Optional[dict]:
+    """
+    按目标选择编码参数
+    - quality: 质量(SSIM)达标的参数中选编码最快的, 都不达标时选质量最好的
+    - throughput: 速度达标的参数中选码率最小的, 都不达标时选最快的
+    """
+    if not results:
+        return None
+    if target == 'quality':
+        candidates = [r for r in results if r['ssim'] >= min_ssim]
+        if not candidates:
+            return max(results, key=lambda r: r['ssim'])
+        return max(candidates, key=lambda r: (r['fps'], -r['bit_rate']))
+    if target == 'throughput':
+        candidates = [r for r in results if r['fps'] >= min_fps]
+        if not candidates:
+            return max(results, key=lambda r: r['fps'])
+        return min(candidates, key=lambda r: (r['bit_rate'], -r['fps']))
+    return None
+
+
+def measured_speed(preset: str, crf: int, fps: float = 25) -> Optional[float]:
+    """profile中该preset和crf测得的编码速度, 以相对实时的倍数表示, 没有测量结果时返回None"""
+    profile = common.read_json_file(common.get_encoder_profile_file())
+    for result in profile.get('results', []) if profile else []:
+        if result['preset'] == preset and result['crf'] == crf and result['fps']:
+            return result['fps'] / fps
+    return None
+
+
+def apply(config: dict):
+    """
+    按ENCODER_TARGET从profile中选择最终编码的preset/crf; 中间编码(stage)会被再次编码, 只要求质量达标时最快
+    没有配置目标、没有profile或使用了自定义ffmpeg参数时不做任何修改
+    """
+    target = common.get_encoder_target()
+    if not target or config.get('ffmpeg_options') or 'preset' not in config:
+        return
+    profile = common.read_json_file(common.get_encoder_profile_file())
+    if not profile:
+        logging.warning(f"ENCODER_TARGET={target}, 但没有找到编码参数profile, 请先执行calibrate")
+        return
+    results = profile.get('results', [])
+    chosen = select(results, target, common.get_encoder_min_fps(), common.get_encoder_min_ssim())
+    if chosen:
+        config['preset'], config['crf'] = chosen['preset'], chosen['crf']
+    if 'stage_preset' in config:
+        stage = select(results, 'quality', 0, common.get_encoder_min_ssim())
+        if stage:
+            config['stage_preset'], config['stage_crf'] = stage['preset'], stage['crf']
+    logging.info(f"按编码参数profile({profile['date']})选择: preset={config['preset']}, crf={config['crf']}, "
+                 f"stage_preset={config.get('stage_preset')}, stage_crf={config.get('stage_crf')}")
+
+
+def _run(cmd: str) -> str:
+    result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = result.stderr.decode('utf-8', errors='replace')
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {cmd}, {stderr[-1000:]}")
+    return stderr
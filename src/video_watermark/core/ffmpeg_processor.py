@@ -1,11 +1,19 @@
 import asyncio
 import logging
+import os
 import re
+import shutil
 from pathlib import Path
-from typing import Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 from .. import common
+from . import adaptive_limiter
+from . import cpu_partitioner
+from . import encoder_profile
+from . import probe
 from . import videoprocess
+from .audio_cache import AudioCache
+from .mezzanine import MezzanineCache
 from ..tool import shell_utils
 
 # This regex is designed to capture the key fields from an ffmpeg progress line.
@@ -16,6 +24,8 @@ FFMPEG_PROGRESS_RE = re.compile(
     r"bitrate=\s*(?P<bitrate>\S+)\s+"
     r"speed=\s*(?P<speed>\S+)"
 )
+# 视频流复制(-c copy / -c:v copy)的命令, 不经过编码
+STREAM_COPY_RE = re.compile(r"-c(?::v)?\s+copy\b")
 
 
 class FFmpegProcessor:
@@ -23,121 +33,578 @@ class FFmpegProcessor:
 
     def __init__(self, config: dict):
         self.config = config
-        # 限制加暗水印操作的并发为1
-        self._serial_semaphore = asyncio.Semaphore(1)
-        # 限制其他ffmpeg操作的并发为2
-        self._general_ffmpeg_semaphore = asyncio.Semaphore(common.get_ffmpeg_concurrency())
+        # 按本机测量的编码参数profile选择preset/crf
+        encoder_profile.apply(self.config)
+        # 限制加暗水印操作的并发, 默认为1, 每个(人, 视频)任务使用独立的临时目录
+        self._serial_semaphore = asyncio.Semaphore(common.get_invisible_concurrency())
+        # 限制其他ffmpeg操作的并发为2, 开启自适应并发时根据总吞吐自动调整
+        self._general_ffmpeg_semaphore = adaptive_limiter.get_limiter() or asyncio.Semaphore(
+            common.get_ffmpeg_concurrency())
         self.result_video_type = self.config.get('result_video_type')
+        self.mezzanine_cache = MezzanineCache()
+        self.audio_cache = AudioCache()
 
     async def compress_with_logo(self, video: Path, person: str, logo: str,
                                  add_invisible_watermark: bool = True) -> bool:
         """压缩视频并添加logo水印"""
-        cmd, is_serial = self._build_compress_command(video, person, logo, add_invisible_watermark)
+        mezzanine = await self._get_mezzanine(video)
+        cmd, is_serial = self._build_compress_command(video, person, logo, add_invisible_watermark, mezzanine)
         process_id = f'compress_{person}_{video.stem}'
-        if is_serial:
-            return await self._limited(self._serial_semaphore, self._run_ffmpeg(cmd, process_id=process_id))
-        else:
-            return await self._limited(self._general_ffmpeg_semaphore, self._run_ffmpeg(cmd, process_id=process_id))
+        semaphore = self._serial_semaphore if is_serial else self._general_ffmpeg_semaphore
+
+        # 长视频分段并行编码, 每个分段单独占用并发名额; 暗水印任务整个文件只占一个名额, 名额内各分段并行
+        output_file, options = self._get_compress_output(video, person, add_invisible_watermark)
+        w, h = self._get_logo_scale(video)
+        source = mezzanine or video
+        prescaled = self._is_prescaled(video, w, h, mezzanine)
 
-    async def extract_all_frames(self, person: str, video: Path, fps: int) -> bool:
+        def build_chunk_cmd(start: float, frames: Optional[int], chunk: Path) -> str:
+            logo_filter = self._build_logo_filter(w, h, prescaled=prescaled, time_offset=start)
+            return (f'ffmpeg -ss {start:.3f} -i "{source}" -i "{logo}" {self._frames_option(frames)} '
+                    f'-filter_complex "{logo_filter}" -an {options} -y "{chunk}"')
+
+        if is_serial:
+            async with self._serial_semaphore:
+                chunk_semaphore = asyncio.Semaphore(max(1, common.get_segment_parallel_chunks()))
+                success = await self._encode_segmented(source, output_file, process_id, chunk_semaphore,
+                                                       build_chunk_cmd)
+                if success is None:
+                    success = await self._run_ffmpeg(cmd, process_id=process_id)
+                return success
+        success = await self._encode_segmented(source, output_file, process_id, semaphore, build_chunk_cmd)
+        if success is not None:
+            return success
+        return await self._limited(semaphore, self._run_ffmpeg(cmd, process_id=process_id))
+
+    async def compress_with_logo_fanout(self, video: Path, person_logos: Dict[str, str]) -> bool:
+        """一次解码原视频, 同时为多个人压缩并添加logo水印"""
+        mezzanine = await self._get_mezzanine(video)
+        cmd, is_serial = self._build_fanout_command(video, person_logos, mezzanine)
+        process_id = f'compress_fanout_{video.stem}_{len(person_logos)}'
+        semaphore = self._serial_semaphore if is_serial else self._general_ffmpeg_semaphore
+        return await self._limited(semaphore, self._run_ffmpeg(cmd, process_id=process_id))
+
+    async def extract_all_frames(self, person: str, video: Path, fps: int, origin_dir: Path) -> bool:
         """提取视频所有帧"""
-        return await self._limited(self._serial_semaphore, self._extract_all_frames_impl(person, video, fps))
+        return await self._limited(self._serial_semaphore,
+                                   self._extract_all_frames_impl(person, video, fps, origin_dir))
+
+    async def get_audio_track(self, video: Path) -> Optional[Path]:
+        """
+        获取视频的音轨缓存, 同一个原视频的所有人共用, 缓存中没有时提取一次
+        :return: 音轨文件, 视频没有音频或提取失败时返回None
+        """
+        async with self.audio_cache.lock(video):
+            cached = await asyncio.to_thread(self.audio_cache.lookup, video)
+            if cached:
+                return cached
+            info = await asyncio.to_thread(probe.get_catalog().get, video)
+            if info is not None and not info['audio_codec']:
+                logging.info(f"视频没有音频: {video}")
+                return None
+            output = self.audio_cache.track_path(video)
+            if info and info['audio_codec'] == 'aac':
+                audio_options = '-c:a copy'
+            else:
+                audio_options = '-c:a aac -b:a 128k'
+            cmd = f'ffmpeg -i "{video.as_posix()}" -vn {audio_options} -y "{output.as_posix()}"'
+            success = await self._limited(self._general_ffmpeg_semaphore,
+                                          self._run_ffmpeg(cmd, process_id=f'extract_audio_{video.stem}'))
+            if not success:
+                logging.error(f"提取音频失败: {video}")
+                common.delete_file(output)
+                return None
+            return output
+
+    async def compose_video(self, person: str, origin_video: Path, fps: int, origin_dir: Path,
+                            audio_track: Optional[Path] = None, **kwargs) -> bool:
+        """合成最终视频, 音频直接复用音轨缓存"""
+        return await self._limited(self._serial_semaphore,
+                                   self._compose_video_impl(person, origin_video, fps, origin_dir, audio_track,
+                                                            **kwargs))
 
-    async def extract_audio(self, origin_dir: Path, video: Path) -> bool:
-        """提取视频音频"""
-        return await self._limited(self._serial_semaphore, self._extract_audio_impl(origin_dir, video))
+    async def extract_logo_sample_frames(self, video: Path, logo: str, frame_indexes, output_dir: Path) -> bool:
+        """提取加了logo之后的采样帧"""
+        mezzanine = await self._get_mezzanine(video)
+        return await self._limited(self._serial_semaphore,
+                                   self._extract_logo_sample_frames_impl(video, logo, frame_indexes, output_dir,
+                                                                         mezzanine))
 
-    async def compose_video(self, person: str, origin_video: Path, fps: int, **kwargs) -> bool:
-        """合成最终视频"""
+    async def compress_with_logo_and_frames(self, video: Path, person: str, logo: str,
+                                            frames: Dict[int, Path], keep_stage1: bool = False) -> bool:
+        """单次编码: 压缩 + logo + 替换暗水印帧"""
+        mezzanine = await self._get_mezzanine(video)
         return await self._limited(self._serial_semaphore,
-                                   self._compose_video_impl(person, origin_video, fps, **kwargs))
+                                   self._compress_with_logo_and_frames_impl(video, person, logo, frames, keep_stage1,
+                                                                            mezzanine))
 
     async def concate_to_mp4(self, d: Path, target_dir: Path, ffmpeg_options: str = '') -> str:
         """合并视频 + 降噪 + 压缩 + 格式为mp4"""
         return await self._limited(self._general_ffmpeg_semaphore,
                                    self._concate_to_mp4_impl(d, target_dir, ffmpeg_options))
 
+    async def encode_ab_variants(self, video: Path, pattern: Path, dir_a: Path, dir_b: Path, segment_seconds: int,
+                                 strength: float) -> bool:
+        """一次解码, 编码A/B两个带相反暗标记的版本, 并按固定时长在关键帧处切分为ts片段"""
+        return await self._limited(self._general_ffmpeg_semaphore,
+                                   self._encode_ab_variants_impl(video, pattern, dir_a, dir_b, segment_seconds,
+                                                                 strength))
+
+    async def encode_marked_head(self, video: Path, pattern: Path, bits: List[int], logo: str, output_dir: Path,
+                                 segment_seconds: int, strength: float) -> bool:
+        """
+        从原视频编码某个人开头len(bits)个片段: 按bits选择A/B暗标记并叠加logo, 一次编码完成,
+        logo按原视频时间移动, 片段边界和编码参数与A/B片段一致以便直接拼接
+        """
+        return await self._limited(self._general_ffmpeg_semaphore,
+                                   self._encode_marked_head_impl(video, pattern, bits, logo, output_dir,
+                                                                 segment_seconds, strength))
+
+    async def concat_segments(self, list_file: Path, output: Path, process_id: str) -> bool:
+        """按列表流复制拼接ts片段为最终视频, 不重新编码"""
+        cmd = (f'ffmpeg -f concat -safe 0 -i "{list_file.as_posix()}" -c copy -bsf:a aac_adtstoasc '
+               f'-movflags +faststart -y "{output}"')
+        return await self._limited(self._general_ffmpeg_semaphore, self._run_ffmpeg(cmd, process_id=process_id))
+
+    async def encode_course_fanout(self, list_file: Path, name: str, person_logos: Dict[str, str]) -> bool:
+        """从MTS拼接列表一次编码: 拼接 + 降噪 + crop/scale + 每个人的logo, 直接输出每个人的最终视频"""
+        cmd, is_serial = self._build_course_fanout_command(list_file, name, person_logos)
+        semaphore = self._serial_semaphore if is_serial else self._general_ffmpeg_semaphore
+        return await self._limited(semaphore, self._run_ffmpeg(cmd, process_id=f'course_{name}'))
+
+    async def encode_course_intermediate(self, list_file: Path, output: Path) -> bool:
+        """从MTS拼接列表一次编码出拼接 + 降噪 + crop/scale后的中间文件, 供暗水印流程使用"""
+        vf = self._scale_args(self.config['scale'])[0]
+        crf = common.get_mezzanine_crf()
+        preset = common.get_mezzanine_preset()
+        cmd = (f'ffmpeg -f concat -safe 0 -i "{list_file.as_posix()}" -vf "{vf}" '
+               f'-af afftdn -c:v libx264 -crf {crf} -preset {preset} -c:a aac -y "{output}"')
+        return await self._limited(self._general_ffmpeg_semaphore,
+                                   self._run_ffmpeg(cmd, process_id=f'course_intermediate_{output.stem}'))
+
     async def audio(self, video, target_dir):
         """提取音频"""
         return await self._limited(self._general_ffmpeg_semaphore, self._audio_impl(video, target_dir))
 
     async def scale(self, video: Path, target_dir: Path, scale=(1280, 720)):
         """视频scale, example: from 1080p -> 720p"""
+        if await asyncio.to_thread(self._meets_spec, video, *scale):
+            output = target_dir.joinpath(f"{video.stem}{self.result_video_type}")
+            return await self._passthrough(video, output, f'scale-{video.stem}')
         return await self._limited(self._general_ffmpeg_semaphore, self._scale_impl(video, target_dir, scale))
 
     async def _audio_impl(self, video, target_dir):
         aac_file = Path(target_dir).joinpath(Path(video).stem + ".m4a").as_posix()
         vd = Path(video).as_posix()
 
+        if await self._reuse_denoised_track(video, aac_file):
+            return True
+
         if common.is_audio_file(video):
             cmd = f'ffmpeg -i "{vd}" -af afftdn -c:a aac -b:a 96k -y "{aac_file}"'
         else:
-            cmd = f'ffmpeg -i "{vd}" -vn -c:a aac -b:a 96k -y "{aac_file}"'
+            info = await asyncio.to_thread(probe.get_catalog().get, video)
+            cmd = f'ffmpeg -i "{vd}" -vn {self._audio_options(info)} -y "{aac_file}"'
         await self._run_ffmpeg(cmd, process_id=f'audio-{video.stem}')
         if Path(aac_file).exists():
             logging.info(f"提取音频成功: {vd}")
             return True
         return False
 
+    async def _reuse_denoised_track(self, video, aac_file) -> bool:
+        """拼接时已经降噪过的音轨直接复用"""
+        track = await asyncio.to_thread(self.audio_cache.find_denoised_track, video)
+        if not track:
+            return False
+        shutil.copyfile(track, aac_file)
+        logging.info(f"复用拼接时的降噪音轨: {Path(video).as_posix()}")
+        return True
+
+    @staticmethod
+    def _audio_options(info: Optional[dict]) -> str:
+        """音频已经是aac时直接复制, 不再转码"""
+        return '-c:a copy' if info and info['audio_codec'] == 'aac' else '-c:a aac -b:a 96k'
+
+    async def preprocess(self, video: Path, audio_dir: Path, scale_dir: Path, scale=(1280, 720)) -> bool:
+        """一次解码原视频, 同时提取音频(m4a)和scale视频"""
+        return await self._limited(self._general_ffmpeg_semaphore,
+                                   self._preprocess_impl(video, audio_dir, scale_dir, scale))
+
+    async def _preprocess_impl(self, video: Path, audio_dir: Path, scale_dir: Path, scale) -> bool:
+        logging.info(f"开始预处理原视频, video: {video}")
+        aac_file = audio_dir.joinpath(f"{video.stem}.m4a")
+        output = scale_dir.joinpath(f"{video.stem}{self.result_video_type}")
+        vf, options = self._scale_args(scale)
+        video_output = f'-vf "{vf}" {options}'
+        if await asyncio.to_thread(self._meets_spec, video, *scale):
+            logging.info(f"快速路径: 视频流复制, video: {video}")
+            video_output = '-c copy'
+        # 音频与_audio_impl的选择一致: 复用拼接时的降噪音轨, aac直接复制, 没有音频时不输出m4a
+        info = await asyncio.to_thread(probe.get_catalog().get, video)
+        has_audio = info is None or bool(info['audio_codec'])
+        audio_output = ''
+        if has_audio and not await self._reuse_denoised_track(video, aac_file):
+            audio_output = f'-map 0:a? -vn {self._audio_options(info)} -y "{aac_file.as_posix()}" '
+        if not has_audio:
+            logging.info(f"视频没有音频, 只输出scale视频: {video}")
+        cmd = (f'ffmpeg -i "{video.as_posix()}" '
+               f'{audio_output}'
+               f'-map 0:v -map 0:a? {video_output} -y "{output.as_posix()}"')
+        success = await self._run_ffmpeg(cmd, process_id=f'preprocess-{video.stem}')
+        if success and (aac_file.exists() or not has_audio) and output.exists():
+            logging.info(f"预处理成功: {video}")
+            return True
+        logging.error(f"预处理失败: {video}")
+        return False
+
+    async def scale_segmented(self, video: Path, target_dir: Path, scale=(1280, 720)) -> bool:
+        """
+        视频scale, 长视频分段并行编码(每个分段单独占用并发名额), 不满足分段条件时按整段编码
+        """
+        output = target_dir.joinpath(f"{video.stem}{self.result_video_type}")
+        if await asyncio.to_thread(self._meets_spec, video, *scale):
+            return await self._passthrough(video, output, f'scale-{video.stem}')
+        vf, options = self._scale_args(scale)
+
+        def build_chunk_cmd(start: float, frames: Optional[int], chunk: Path) -> str:
+            return (f'ffmpeg -ss {start:.3f} -i "{video}" {self._frames_option(frames)} -vf "{vf}" -an {options} '
+                    f'-y "{chunk}"')
+
+        success = await self._encode_segmented(video, output, f'scale-{video.stem}', self._general_ffmpeg_semaphore,
+                                               build_chunk_cmd)
+        if success is not None:
+            return success
+        return await self.scale(video, target_dir, scale)
+
+    async def scale_renditions(self, video: Path, renditions: List[dict]) -> bool:
+        """
+        一次解码原视频, 输出多种分辨率
+        :param renditions: [{'name', 'width', 'height', 'crf', 'target_dir'}, ...]
+        """
+        return await self._limited(self._general_ffmpeg_semaphore, self._scale_renditions_impl(video, renditions))
+
+    async def _scale_renditions_impl(self, video: Path, renditions: List[dict]) -> bool:
+        logging.info(f"开始压缩原视频, video: {video}, renditions: {[r['name'] for r in renditions]}")
+        await probe.get_catalog().get_async(video)
+        outputs = []
+        encodes = []
+        for rendition in renditions:
+            output = rendition['target_dir'].joinpath(f"{video.stem}{self.result_video_type}")
+            if self._meets_spec(video, rendition['width'], rendition['height']):
+                # 已经满足该分辨率的参数, 流复制输出
+                logging.info(f"快速路径: 流复制, video: {video}, rendition: {rendition['name']}")
+                outputs.append(f'-map 0:v -map 0:a? -c copy -y "{output}"')
+            else:
+                encodes.append((rendition, output))
+
+        parts = []
+        if encodes:
+            split_labels = ''.join(f'[s{i}]' for i in range(len(encodes)))
+            parts.append(f'[0:v]crop=min(iw\\,ih*16/9):ih:(iw-min(iw\\,ih*16/9))/2:0,split={len(encodes)}{split_labels}')
+        ffmpeg_options = self.config.get('ffmpeg_options', '')
+        # FFMPEG_OPTIONS自带码率控制时各分辨率共用, 否则在其后追加每个分辨率自己的crf
+        shared_rate = bool(re.search(r'-(crf|b:v|q:v|qp|global_quality)\s', ffmpeg_options))
+        if encodes and shared_rate:
+            logging.info(f"FFMPEG_OPTIONS中已有码率控制参数, 所有分辨率共用, 忽略各分辨率的crf: {ffmpeg_options}")
+        for i, (rendition, output) in enumerate(encodes):
+            parts.append(f"[s{i}]scale={rendition['width']}:{rendition['height']}[v{i}]")
+            if not ffmpeg_options:
+                options = f"-c:a copy -crf {rendition['crf']} -preset {self.config['preset']}"
+            elif shared_rate:
+                options = ffmpeg_options
+            else:
+                options = f"{ffmpeg_options} -crf {rendition['crf']}"
+            outputs.append(f'-map "[v{i}]" -map 0:a? {options} -y "{output}"')
+        filter_complex = f'-filter_complex "{";".join(parts)}"' if parts else ''
+        cmd = f'ffmpeg -i "{video}" {filter_complex} {" ".join(outputs)}'
+        return await self._run_ffmpeg(cmd, process_id=f'scale-{video.stem}')
+
     async def _scale_impl(self, video, target_dir, scale):
         logging.info(f"开始压缩原视频, video: {video}")
         output = target_dir.joinpath(f"{video.stem}{self.result_video_type}").as_posix()
+        vf, options = self._scale_args(scale)
+        cmd = f'ffmpeg -i "{video}" -vf "{vf}" {options} -y "{output}"'
+        return await self._run_ffmpeg(cmd, process_id=f'scale-{video.stem}')
+
+    def _scale_args(self, scale) -> Tuple[str, str]:
+        """scale的滤镜和编码参数: 居中裁剪为16:9后缩放到目标分辨率"""
+        w, h = scale
+        vf = f'crop=min(iw\\,ih*16/9):ih:(iw-min(iw\\,ih*16/9))/2:0,scale={w}:{h}'
         ffmpeg_options = self.config.get('ffmpeg_options', '')
         if ffmpeg_options:
             options = ffmpeg_options
         else:
             options = f"-c:a copy -crf {self.config['crf']} -preset {self.config['preset']}"
-        cmd = f'ffmpeg -i "{video}" -vf "crop=min(iw\,ih*16/9):ih:(iw-min(iw\,ih*16/9))/2:0,scale=1280:720" {options} -y "{output}"'
-        return await self._run_ffmpeg(cmd, process_id=f'scale-{video.stem}')
+        return vf, options
 
-    def _build_compress_command(self, video: Path, person: str, logo: str, add_invisible_watermark: bool) -> Tuple[
-        str, bool]:
+    def _build_compress_command(self, video: Path, person: str, logo: str, add_invisible_watermark: bool,
+                                mezzanine: Optional[Path] = None) -> Tuple[str, bool]:
         """
         构建压缩并添加logo命令
         :param video: 视频文件
         :param person: 人物
         :param logo: logo图片
         :param add_invisible_watermark: 是否添加不可见水印
+        :param mezzanine: 已经crop/scale过的中间文件, 为None时直接读取原视频
         :return: cmd, 是否串行运行
         """
 
+        output_file, options = self._get_compress_output(video, person, add_invisible_watermark)
+        is_serial = add_invisible_watermark or self._get_plain_options()[1]
+        w, h = self._get_logo_scale(video)
+
+        logo_filter = self._build_logo_filter(w, h, prescaled=self._is_prescaled(video, w, h, mezzanine))
+        cmd = f'ffmpeg -i "{mezzanine or video}" -i "{logo}" -filter_complex "{logo_filter}" {options} -y "{output_file}"'
+        return cmd, is_serial
+
+    def _get_compress_output(self, video: Path, person: str, add_invisible_watermark: bool) -> Tuple[Path, str]:
+        """压缩并添加logo的输出文件和编码参数"""
         output_dir = common.get_person_video_stage_dir(person) if add_invisible_watermark else common.get_person_video_result_dir(person)
         output_file = output_dir.joinpath(f"{video.stem}{self.result_video_type}")
+        if add_invisible_watermark:
+            crf = self.config['stage_crf']
+            preset = self.config['stage_preset']
+            return output_file, f'-c:a copy -crf {crf} -preset {preset}'
+        return output_file, self._get_plain_options()[0]
 
-        scale = self.config['scale']
+    def _build_fanout_command(self, video: Path, person_logos: Dict[str, str],
+                              mezzanine: Optional[Path] = None) -> Tuple[str, bool]:
+        """
+        构建一次解码、多人输出的明水印命令: crop/scale一次, split后分别叠加每个人的logo
+        :param person_logos: 人物 -> logo图片
+        :return: cmd, 是否串行运行
+        """
+        w, h = self._get_logo_scale(video)
+        persons = list(person_logos.keys())
+        split_labels = ''.join(f'[s{i}]' for i in range(len(persons)))
+        prescaled = self._is_prescaled(video, w, h, mezzanine)
+        parts = [f"[0:v]{self._build_crop_scale(w, h, prescaled)},split={len(persons)}{split_labels}"]
+        for i in range(len(persons)):
+            parts.append(self._build_overlay(f'[s{i}]', f'[{i + 1}:v]', f'[o{i}]'))
+
+        options, is_serial = self._get_plain_options()
+        logo_inputs = ' '.join(f'-i "{person_logos[p]}"' for p in persons)
+        outputs = []
+        for i, person in enumerate(persons):
+            output_file = common.get_person_video_result_dir(person).joinpath(f"{video.stem}{self.result_video_type}")
+            outputs.append(f'-map "[o{i}]" -map 0:a? {options} -y "{output_file}"')
+        cmd = f'ffmpeg -i "{mezzanine or video}" {logo_inputs} -filter_complex "{";".join(parts)}" {" ".join(outputs)}'
+        return cmd, is_serial
+
+    def _build_course_fanout_command(self, list_file: Path, name: str,
+                                     person_logos: Dict[str, str]) -> Tuple[str, bool]:
+        """
+        构建从MTS拼接列表到每个人最终视频的滤镜图: 视频crop/scale一次后split叠加logo, 音频降噪一次后asplit;
+        crop/scale与scale.py相同(居中裁剪为16:9后缩放), 编码参数使用配置的crf/preset(原来scale这一次编码的参数),
+        不是明水印压缩的stage_preset, 这是代替 scale -> 压缩 两次编码的唯一一次编码
+        :return: cmd, 是否串行运行
+        """
+        persons = list(person_logos.keys())
+        count = len(persons)
+        split_labels = ''.join(f'[s{i}]' for i in range(count))
+        audio_labels = ''.join(f'[a{i}]' for i in range(count))
+        parts = [f"[0:v]{self._scale_args(self.config['scale'])[0]},split={count}{split_labels}"]
+        for i in range(count):
+            parts.append(self._build_overlay(f'[s{i}]', f'[{i + 1}:v]', f'[o{i}]'))
+        parts.append(f"[0:a]afftdn,asplit={count}{audio_labels}")
+
+        ffmpeg_options = self.config.get('ffmpeg_options', '')
+        if ffmpeg_options:
+            # 音频经过降噪滤镜, 不能直接复制
+            options, is_serial = re.sub(r'-c:a\s+copy', '', ffmpeg_options) + ' -c:a aac', False
+        else:
+            options, is_serial = f"-crf {self.config['crf']} -preset {self.config['preset']} -c:a aac", True
+        logo_inputs = ' '.join(f'-i "{person_logos[p]}"' for p in persons)
+        outputs = []
+        for i, person in enumerate(persons):
+            output_file = common.get_person_video_result_dir(person).joinpath(f"{name}{self.result_video_type}")
+            outputs.append(f'-map "[o{i}]" -map "[a{i}]" {options} -y "{output_file}"')
+        cmd = (f'ffmpeg -f concat -safe 0 -i "{list_file.as_posix()}" {logo_inputs} '
+               f'-filter_complex "{";".join(parts)}" {" ".join(outputs)}')
+        return cmd, is_serial
+
+    def _get_plain_options(self) -> Tuple[str, bool]:
+        """明水印视频的编码参数, 返回: options, 是否串行运行"""
+        ffmpeg_options = self.config.get('ffmpeg_options', '')
+        if ffmpeg_options:
+            return ffmpeg_options, False
+        crf = self.config['crf']
+        preset = self.config['stage_preset']
+        return f'-c:a copy -crf {crf} -preset {preset}', True
+
+    def _get_logo_scale(self, video: Path) -> Tuple[int, int]:
+        """加logo阶段的输出分辨率: 不超过原视频分辨率"""
+        w, h = self.config['scale']
+        vinfo = videoprocess.get_video_info(video)
+        return int(min(w, vinfo[0])), int(min(h, vinfo[1]))
+
+    def _build_logo_filter(self, w: int, h: int, out_label: str = '', prescaled: bool = False,
+                           time_offset: float = 0) -> str:
+        """
+        构建crop + scale + 移动logo的filter_complex, 输入0为视频, 输入1为logo图片
+        :param out_label: 输出标签, 例如'[v0]', 为空时直接作为输出流
+        :param prescaled: 输入0是否已经crop/scale过(mezzanine)
+        :param time_offset: 输入在原视频中的开始时间, 分段编码时保证logo位置连续
+        """
+        overlay = self._build_overlay('[v]', '[1:v]', out_label, time_offset)
+        return f"[0:v]{self._build_crop_scale(w, h, prescaled)}[v];{overlay}"
+
+    @staticmethod
+    def _is_prescaled(video: Path, w: int, h: int, mezzanine: Optional[Path] = None) -> bool:
+        """输入是mezzanine或者原视频已经是目标分辨率时, 不需要crop/scale"""
+        if mezzanine is not None:
+            return True
+        vinfo = videoprocess.get_video_info(video)
+        if int(vinfo[0]) == w and int(vinfo[1]) == h:
+            logging.info(f"快速路径: 原视频已经是{w}x{h}, 跳过crop/scale, video: {video}")
+            return True
+        return False
+
+    def _meets_spec(self, video: Path, w: int, h: int) -> bool:
+        """原视频已经满足目标参数(分辨率、h264、yuv420p、码率不超过上限)时, 重新编码不会有任何改变"""
+        if not common.is_use_passthrough():
+            return False
+        info = probe.get_catalog().get(video)
+        if not info:
+            return False
+        bit_rate = info['video_bit_rate'] or info['bit_rate']
+        return (info['width'] == w and info['height'] == h and info['video_codec'] == 'h264'
+                and info['pix_fmt'] == 'yuv420p' and 0 < bit_rate <= common.get_passthrough_max_bitrate() * 1000)
+
+    async def _passthrough(self, video: Path, output: Path, process_id: str) -> bool:
+        """
+        原视频已经满足目标参数: 容器相同时硬链接(跨文件系统时复制), 否则流复制remux
+        """
+        common.delete_file(output)
+        if video.suffix == output.suffix:
+            try:
+                os.link(video, output)
+                logging.info(f"快速路径: 硬链接, video: {video}, output: {output}")
+            except OSError:
+                shutil.copy2(video, output)
+                logging.info(f"快速路径: 复制, video: {video}, output: {output}")
+            return True
+        cmd = f'ffmpeg -i "{video}" -map 0 -c copy -movflags +faststart -y "{output}"'
+        logging.info(f"快速路径: 流复制remux, video: {video}, output: {output}")
+        return await self._limited(self._general_ffmpeg_semaphore, self._run_ffmpeg(cmd, process_id=process_id))
+
+    @staticmethod
+    def _build_crop_scale(w: int, h: int, prescaled: bool = False) -> str:
+        """crop + scale滤镜链, 输入已经是mezzanine时不需要再处理"""
+        return 'null' if prescaled else f'crop={w}:{h},scale={w}:{h}'
+
+    async def _get_mezzanine(self, video: Path) -> Optional[Path]:
+        """
+        获取原视频crop/scale后的mezzanine文件, 缓存中没有时生成
+        :return: mezzanine文件, 未开启或生成失败时返回None(直接读取原视频)
+        """
+        # 在线程中探测原视频, 之后构建命令时的同步查询直接命中缓存
+        await probe.get_catalog().get_async(video)
+        if not common.is_use_mezzanine():
+            return None
+        w, h = self._get_logo_scale(video)
+        vinfo = videoprocess.get_video_info(video)
+        if int(vinfo[0]) == w and int(vinfo[1]) == h:
+            logging.info(f"快速路径: 原视频已经是{w}x{h}, 不需要mezzanine, video: {video}")
+            return None
+        async with self.mezzanine_cache.lock(video, w, h):
+            cached = self.mezzanine_cache.lookup(video, w, h)
+            if cached:
+                return cached
+            output = self.mezzanine_cache.path_for(video, w, h)
+            crf = common.get_mezzanine_crf()
+            preset = common.get_mezzanine_preset()
+            cmd = (f'ffmpeg -i "{video}" -vf "crop={w}:{h},scale={w}:{h}" -c:v libx264 -crf {crf} -preset {preset} '
+                   f'-c:a copy -y "{output}"')
+            success = await self._limited(self._general_ffmpeg_semaphore,
+                                          self._run_ffmpeg(cmd, process_id=f'mezzanine_{video.stem}'))
+            if not success:
+                logging.error(f"生成mezzanine失败, 直接使用原视频: {video}")
+                common.delete_file(output)
+                return None
+            self.mezzanine_cache.add(video, w, h, output)
+            logging.info(f"生成mezzanine成功, video: {video}, mezzanine: {output}")
+            return output
+
+    def _build_overlay(self, main_label: str, logo_label: str, out_label: str = '', time_offset: float = 0) -> str:
+        """构建移动logo的overlay滤镜"""
         # 控制水印在水平方向上移动的速度，单位为像素 / 秒。增大该值意味着水印在每秒钟内水平移动的像素数增多，因此水印会移动得更快。
         horizontal_speed = self.config['horizontal_speed']
         # 控制水印在垂直方向上移动的速度
         vertical_speed = self.config['vertical_speed']
+        t = f'(t+{time_offset:.3f})' if time_offset else 't'
+        return (f"{main_label}{logo_label}overlay=x='if(gte(mod({t}*{horizontal_speed}, main_w), main_w - w), main_w - w, mod({t}*{horizontal_speed}, main_w))'"
+                f":y='if(gte(mod({t}*{vertical_speed}, main_h), main_h - h), main_h - h, mod({t}*{vertical_speed}, main_h - h))'"
+                f"{out_label}")
 
-        w, h = scale
-        vinfo = videoprocess.get_video_info(video)
-        w = min(w, vinfo[0])
-        h = min(h, vinfo[1])
+    async def _extract_logo_sample_frames_impl(self, video: Path, logo: str, frame_indexes, output_dir: Path,
+                                               mezzanine: Optional[Path] = None) -> bool:
+        """
+        用与最终编码相同的crop/scale/logo滤镜解码视频, 只输出采样帧为png, 文件名为帧号(从1开始)
+        """
+        indexes = sorted(frame_indexes)
+        w, h = self._get_logo_scale(video)
+        select = '+'.join(f'eq(n,{i - 1})' for i in indexes)
+        filter_complex = f"{self._build_logo_filter(w, h, '[o]', mezzanine is not None)};[o]select='{select}'"
+        cmd = (f'ffmpeg -i "{mezzanine or video}" -i "{logo}" -filter_complex "{filter_complex}" -vsync 0 '
+               f'-y "{output_dir.as_posix()}/sample_%d.png"')
+        success = await self._run_ffmpeg(cmd, process_id=f'extract_samples_{video.stem}')
+        if not success:
+            return False
 
-        if add_invisible_watermark:
-            crf = self.config['stage_crf']
-            preset = self.config['stage_preset']
-            options = f'-c:a copy -crf {crf} -preset {preset}'
-            is_serial = True
-        else:
-            ffmpeg_options = self.config.get('ffmpeg_options', '')
-            if ffmpeg_options:
-                options = ffmpeg_options
-                is_serial = False
-            else:
-                crf = self.config['crf']
-                preset = self.config['stage_preset']
-                options = f'-c:a copy -crf {crf} -preset {preset}'
-                is_serial = True
+        # select按帧顺序输出, 第k个文件对应第k小的帧号
+        samples = [output_dir.joinpath(f'sample_{k}.png') for k in range(1, len(indexes) + 1)]
+        if not all(f.exists() for f in samples):
+            logging.error(f"采样帧数量与帧号不一致, video: {video}, indexes: {indexes}")
+            return False
+        for index, f in zip(indexes, samples):
+            f.rename(output_dir.joinpath(f'{index}.png'))
+        return True
 
-        cmd = f'ffmpeg -i "{video}" -i "{logo}" -filter_complex "[0:v]crop={w}:{h},scale={w}:{h}[v];[v][1:v]overlay=x=\'if(gte(mod(t*{horizontal_speed}, main_w), main_w - w), main_w - w, mod(t*{horizontal_speed}, main_w))\':y=\'if(gte(mod(t*{vertical_speed}, main_h), main_h - h), main_h - h, mod(t*{vertical_speed}, main_h - h))\'" {options} -y "{output_file}"'
-        return cmd, is_serial
+    async def _compress_with_logo_and_frames_impl(self, video: Path, person: str, logo: str,
+                                                  frames: Dict[int, Path], keep_stage1: bool = False,
+                                                  mezzanine: Optional[Path] = None) -> bool:
+        """
+        一次编码完成crop/scale/logo并替换采样帧为加了暗水印的帧
+        :param frames: 帧号(从1开始) -> 加了暗水印的帧图片
+        :param keep_stage1: 是否同时输出只加logo的stage1视频
+        """
+        result_file = common.get_person_video_result_dir(person).joinpath(f'{video.stem}{self.result_video_type}')
+        common.delete_file(result_file)
+        w, h = self._get_logo_scale(video)
+        crf = self.config.get('crf', 18)
+        preset = self.config.get('preset', 'slow')
+
+        parts = [self._build_logo_filter(w, h, '[logo]', mezzanine is not None)]
+        stage_output = ''
+        if keep_stage1:
+            parts.append('[logo]split=2[stage][b0]')
+            stage_file = common.get_person_video_stage_dir(person).joinpath(f'{video.stem}{self.result_video_type}')
+            stage_output = (f'-map "[stage]" -map 0:a? -c:a copy -crf {self.config["stage_crf"]} '
+                            f'-preset {self.config["stage_preset"]} -y "{stage_file}" ')
+        else:
+            parts.append('[logo]null[b0]')
+
+        frame_inputs = []
+        for j, (index, frame) in enumerate(sorted(frames.items())):
+            frame_inputs.append(f'-i "{frame.as_posix()}"')
+            parts.append(f"[b{j}][{j + 2}:v]overlay=0:0:enable='eq(n,{index - 1})'[b{j + 1}]")
+
+        cmd = (f'ffmpeg -i "{mezzanine or video}" -i "{logo}" {" ".join(frame_inputs)} -filter_complex "{";".join(parts)}" '
+               f'{stage_output}'
+               f'-map "[b{len(frames)}]" -map 0:a? -c:v libx264 -crf {crf} -preset {preset} -pix_fmt yuv420p '
+               f'-c:a copy -y "{result_file}"')
+        success = await self._run_ffmpeg(cmd, process_id=f'single_encode_{person}_{video.stem}')
+        if success:
+            logging.info(f"单次编码合成暗水印视频成功, video: {video}, person: {person}")
+        else:
+            logging.error(f"单次编码合成暗水印视频失败, video: {video}, person: {person}")
+        return success
 
-    async def _extract_all_frames_impl(self, person: str, video: Path, fps: int) -> bool:
+    async def _extract_all_frames_impl(self, person: str, video: Path, fps: int, origin_dir: Path) -> bool:
         """提取视频所有帧的实现"""
-        origin_dir = common.get_person_origin_dir().as_posix()
         common.delete_then_create(origin_dir)
+        origin_dir = origin_dir.as_posix()
         cmd = f'ffmpeg -i "{video.as_posix()}" -vf "fps={fps}" {origin_dir}/%0d.png'
         process_id = f"extract_frames_{person}_{video.stem}"
         success = await self._run_ffmpeg(cmd, process_id=process_id)
@@ -147,30 +614,23 @@ class FFmpegProcessor:
             logging.error(f"提取原视频中所有帧执行失败, video: {video}, person: {person}")
         return success
 
-    async def _extract_audio_impl(self, origin_dir: Path, video: Path) -> bool:
-        """提取视频音频的实现"""
-        aac_file = origin_dir.joinpath(f'{video.stem}.aac')
-        common.delete_file(aac_file)
-        cmd = f'ffmpeg -i "{video.as_posix()}" -vn -c:a copy "{aac_file.as_posix()}"'
-        process_id = f"extract_audio_{video.stem}"
-        return await self._run_ffmpeg(cmd, process_id=process_id)
-
-    async def _compose_video_impl(self, person: str, origin_video: Path, fps: int, **kwargs) -> bool:
+    async def _compose_video_impl(self, person: str, origin_video: Path, fps: int, origin_dir: Path,
+                                  audio_track: Optional[Path] = None, **kwargs) -> bool:
         """合成最终视频的实现"""
 
         # -b:v {kbps}k -maxrate {maxrate}k -bufsize {bufsize}k
         # -c:v h264_videotoolbox -q:v 50 -profile:v high -level 19 -coder cabac  -allow_sw 1  for macos hardware
 
-        source_video_dir = common.get_person_origin_dir()
+        source_video_dir = origin_dir
         filename = origin_video.stem
         result_file = common.get_person_video_result_dir(person).joinpath(f'{filename}{self.result_video_type}')
-        aac_file = str(source_video_dir.joinpath(f'{filename}.aac'))
         # 先删除结果文件如果存在的话
         common.delete_file(result_file)
         # 构建编码选项
         crf = kwargs.get('crf', self.config.get('crf', 18))
         preset = kwargs.get('preset', self.config.get('preset', 'slow'))
-        cmd = f'ffmpeg -framerate {fps} -f image2 -start_number 1 -i "{source_video_dir}/%0d.png" -i "{aac_file}" -c:v libx264 -crf {crf} -preset {preset} -pix_fmt yuv420p -c:a copy -y "{result_file}"'
+        audio_input = f'-i "{audio_track}" -c:a copy' if audio_track else ''
+        cmd = f'ffmpeg -framerate {fps} -f image2 -start_number 1 -i "{source_video_dir}/%0d.png" {audio_input} -c:v libx264 -crf {crf} -preset {preset} -pix_fmt yuv420p -y "{result_file}"'
         process_id = f"compose_video_{person}_{filename}"
         success = await self._run_ffmpeg(cmd, process_id)
         if success:
@@ -187,14 +647,216 @@ class FFmpegProcessor:
         options = ffmpeg_options or '-c:v libx264 -crf 18 -preset slow'
         if common.is_keep_origin_quality():
             options = ''
-
-        cmd = f"ffmpeg -f concat -safe 0 -i '{mylist_file}' -c:a aac -af afftdn {options} -y '{result_video}'"
+        if (common.is_keep_origin_quality() or common.is_concat_stream_copy()) \
+                and await asyncio.to_thread(self._is_concat_copy_compatible, d.joinpath('mylist.txt')):
+            # 同一目录下的MTS片段编码参数一致, 视频直接流复制, 只对音频降噪后重新编码
+            logging.info(f"输入视频编码参数一致, 视频流复制拼接: {d}")
+            options = '-c:v copy'
+
+        # 单线程的afftdn和视频编码分为两个并行的进程, 最后流复制合并, 总耗时只取决于视频编码
+        audio_file = self.audio_cache.denoised_track_path(d.name)
+        video_file = target_dir.joinpath(f'.{d.name}.video.mp4')
+        video_cmd = f"ffmpeg -f concat -safe 0 -i '{mylist_file}' -an {options} -y '{video_file}'"
         process_id = f"concate_to_mp4_{d.name}"
-        success = await self._run_ffmpeg(cmd, process_id)
+        tasks = [self._run_ffmpeg(video_cmd, f'{process_id}_video')]
+        # 没有音频的片段不需要降噪, 只输出视频
+        has_audio = await asyncio.to_thread(self._concat_has_audio, d.joinpath('mylist.txt'))
+        if has_audio:
+            audio_cmd = shell_utils.low_priority(
+                f"ffmpeg -f concat -safe 0 -i '{mylist_file}' -vn -af afftdn -c:a aac -y '{audio_file}'")
+            tasks.append(self._run_ffmpeg(audio_cmd, f'{process_id}_audio'))
+        else:
+            logging.info(f"输入视频没有音频, 只拼接视频: {d}")
+            if audio_file.exists():
+                # 之前拼接留下的降噪音轨已经不属于这个结果
+                common.delete_file(audio_file)
+        success = all(await asyncio.gather(*tasks))
+        if success:
+            audio_input = f"-i '{audio_file}' -map 1:a?" if has_audio else ''
+            mux_cmd = (f"ffmpeg -i '{video_file}' {audio_input} -map 0:v -c copy -movflags +faststart "
+                       f"-y '{result_video}'")
+            success = await self._run_ffmpeg(mux_cmd, f'{process_id}_mux')
+        common.delete_file(video_file)
         if success:
             common.delete_file(mylist_file)
+        else:
+            common.delete_file(audio_file)
         return result_video if success else ''
 
+    @staticmethod
+    def _concat_files(list_file: Path) -> List[Path]:
+        return [list_file.parent.joinpath(line[len("file '"):-1])
+                for line in common.read_all_lines(list_file) if line.startswith("file '")]
+
+    @classmethod
+    def _concat_has_audio(cls, list_file: Path) -> bool:
+        """拼接结果的流与第一个视频一致, 探测失败时按有音频处理"""
+        files = cls._concat_files(list_file)
+        info = probe.get_catalog().get(files[0]) if files else None
+        return info is None or bool(info['audio_codec'])
+
+    @classmethod
+    def _is_concat_copy_compatible(cls, list_file: Path) -> bool:
+        """拼接列表中所有视频的编码格式、分辨率、帧率、像素格式和profile都一致时, 视频可以直接流复制"""
+        files = cls._concat_files(list_file)
+        if not files:
+            return False
+        keys = set()
+        for f in files:
+            info = probe.get_catalog().get(f)
+            if not info or not info['video_codec']:
+                return False
+            keys.add((info['video_codec'], info['width'], info['height'], info['frame_rate'], info['pix_fmt'],
+                      info['profile']))
+        return len(keys) == 1
+
+    async def _encode_segmented(self, video: Path, output: Path, process_id: str, semaphore: asyncio.Semaphore,
+                                build_chunk_cmd: Callable[[float, Optional[int], Path], str]) -> Optional[bool]:
+        """
+        分段并行编码: 在关键帧处把输入切为N段, 用相同参数并行编码后流复制拼接, 音频直接复制原视频
+        已完成的分段会保留, 重跑时从第一个缺失的分段继续
+        :param build_chunk_cmd: (开始时间, 帧数(最后一段为None), 分段文件) -> 只含视频的分段编码命令
+        :return: 不满足分段条件时返回None, 由调用方按整段编码
+        """
+        plan = await asyncio.to_thread(self._plan_segments, video)
+        if not plan:
+            return None
+
+        segment_dir = common.get_segment_dir(process_id)
+        plan_file = segment_dir.joinpath('plan.json')
+        stat = video.stat()
+        expected = {
+            'source': str(video.resolve()),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'signature': build_chunk_cmd(0, None, Path('chunk')),
+            'plan': plan
+        }
+        if common.read_json_file(plan_file) != expected:
+            common.delete_then_create(segment_dir)
+            common.write_json_to_file(expected, plan_file)
+
+        chunks = [segment_dir.joinpath(f'chunk_{i:03d}.mp4') for i in range(len(plan))]
+
+        async def encode_chunk(i: int, start: float, frames: Optional[int]) -> bool:
+            if chunks[i].exists():
+                logging.info(f"分段已完成, 跳过: {chunks[i]}")
+                return True
+            part = segment_dir.joinpath(f'chunk_{i:03d}.part.mp4')
+            cmd = build_chunk_cmd(start, frames, part)
+            success = await self._limited(semaphore, self._run_ffmpeg(cmd, process_id=f'{process_id}_part{i}'))
+            if success:
+                part.rename(chunks[i])
+            return success
+
+        logging.info(f"分段并行编码, video: {video}, segments: {len(plan)}")
+        results = await asyncio.gather(*[encode_chunk(i, start, frames) for i, (start, frames) in enumerate(plan)])
+        if not all(results):
+            logging.error(f"分段编码失败, 已完成的分段会在重跑时复用, video: {video}")
+            return False
+
+        list_file = segment_dir.joinpath('chunks.txt')
+        common.write_lines_to_file(list_file, [f"file '{chunk.resolve().as_posix()}'" for chunk in chunks])
+        cmd = (f'ffmpeg -f concat -safe 0 -i "{list_file.as_posix()}" -i "{video}" -map 0:v -map 1:a? '
+               f'-c:v copy -c:a copy -movflags +faststart -y "{output}"')
+        success = await self._limited(semaphore, self._run_ffmpeg(cmd, process_id=f'{process_id}_concat'))
+        if success:
+            common.delete_file(segment_dir)
+        return success
+
+    @staticmethod
+    def _plan_segments(video: Path) -> Optional[List[list]]:
+        """
+        按关键帧把视频切为N段
+        :return: [[开始时间, 帧数], ...], 最后一段帧数为None; 未开启或视频太短时返回None
+        """
+        chunks = common.get_segment_parallel_chunks()
+        if chunks < 2:
+            return None
+        info = probe.get_catalog().get(video, keyframes=True)
+        if not info or not info['fps'] or len(info['keyframes']) < 2:
+            return None
+        if info['duration'] < common.get_segment_parallel_min_duration():
+            return None
+
+        fps = info['fps']
+        first = info['keyframes'][0]
+        keyframes = [k - first for k in info['keyframes']]
+        boundaries = [0.0]
+        for i in range(1, chunks):
+            target = info['duration'] * i / chunks
+            keyframe = min(keyframes, key=lambda k: abs(k - target))
+            if keyframe > boundaries[-1]:
+                boundaries.append(keyframe)
+        if len(boundaries) < 2:
+            return None
+
+        plan = []
+        for i, start in enumerate(boundaries):
+            if i + 1 < len(boundaries):
+                frames = int(round(boundaries[i + 1] * fps)) - int(round(start * fps))
+            else:
+                frames = None
+            plan.append([round(start, 3), frames])
+        return plan
+
+    @staticmethod
+    def _frames_option(frames: Optional[int]) -> str:
+        return f'-frames:v {frames}' if frames else ''
+
+    def _segment_encode_options(self) -> str:
+        """A/B片段和每个人开头带logo的片段共用的编码参数"""
+        return (f"-c:v libx264 -crf {self.config.get('crf', 18)} -preset {self.config.get('preset', 'slow')} "
+                f"-pix_fmt yuv420p -c:a aac -b:a 128k")
+
+    @staticmethod
+    def _build_mark(video_label: str, pattern_label: str, sign: str, strength: float, out_label: str) -> str:
+        """
+        在亮度上叠加±strength幅度的扩频噪声图案(输入1), sign为+1是B版本, -1是A版本, 可以是按时间T变化的表达式;
+        图案是零均值的低频随机纹理, 人眼不可见, 整体的亮度/色阶调整也不能去除
+        """
+        gain = strength * 255 / 127
+        return (f"{video_label}{pattern_label}blend=c0_expr='clip(A+({sign})*(B-128)*{gain:.5f},0,255)'"
+                f":c1_expr=A:c2_expr=A:shortest=1{out_label}")
+
+    @staticmethod
+    def _segment_args(segment_seconds: int) -> str:
+        """所有版本在相同时间点强制关键帧, 保证片段边界一致"""
+        return (f'-force_key_frames "expr:gte(t,n_forced*{segment_seconds})" -f segment '
+                f'-segment_time {segment_seconds} -segment_format mpegts -reset_timestamps 1')
+
+    async def _encode_ab_variants_impl(self, video: Path, pattern: Path, dir_a: Path, dir_b: Path,
+                                       segment_seconds: int, strength: float) -> bool:
+        await probe.get_catalog().get_async(video)
+        w, h = self._get_logo_scale(video)
+        filter_complex = (f"[0:v]{self._build_crop_scale(w, h)},format=yuv420p,split=2[a][b];"
+                          f"[1:v]scale={w}:{h},format=yuv420p,split=2[pa][pb];"
+                          f"{self._build_mark('[a]', '[pa]', '-1', strength, '[va]')};"
+                          f"{self._build_mark('[b]', '[pb]', '1', strength, '[vb]')}")
+        segment = self._segment_args(segment_seconds)
+        options = self._segment_encode_options()
+        cmd = (f'ffmpeg -i "{video}" -loop 1 -i "{pattern}" -filter_complex "{filter_complex}" '
+               f'-map "[va]" -map 0:a? {options} {segment} -y "{dir_a.as_posix()}/seg_%05d.ts" '
+               f'-map "[vb]" -map 0:a? {options} {segment} -y "{dir_b.as_posix()}/seg_%05d.ts"')
+        return await self._run_ffmpeg(cmd, process_id=f'ab_variants_{video.stem}')
+
+    async def _encode_marked_head_impl(self, video: Path, pattern: Path, bits: List[int], logo: str,
+                                       output_dir: Path, segment_seconds: int, strength: float) -> bool:
+        await probe.get_catalog().get_async(video)
+        w, h = self._get_logo_scale(video)
+        # 第i个片段的时间范围内按bits[i]选择A(-1)或B(+1)
+        sign = str(2 * bits[-1] - 1)
+        for i in range(len(bits) - 2, -1, -1):
+            sign = f"if(lt(T,{(i + 1) * segment_seconds}),{2 * bits[i] - 1},{sign})"
+        filter_complex = (f"[0:v]{self._build_crop_scale(w, h)},format=yuv420p[v];"
+                          f"[1:v]scale={w}:{h},format=yuv420p[p];"
+                          f"{self._build_mark('[v]', '[p]', sign, strength, '[m]')};"
+                          f"{self._build_overlay('[m]', '[2:v]', '[o]')}")
+        cmd = (f'ffmpeg -i "{video}" -loop 1 -i "{pattern}" -i "{logo}" -filter_complex "{filter_complex}" '
+               f'-map "[o]" -map 0:a? -t {len(bits) * segment_seconds} {self._segment_encode_options()} '
+               f'{self._segment_args(segment_seconds)} -y "{output_dir.as_posix()}/seg_%05d.ts"')
+        return await self._run_ffmpeg(cmd, process_id=f'marked_head_{output_dir.parent.name}_{video.stem}')
+
     @staticmethod
     async def _limited(semaphore: asyncio.Semaphore, task):
         async with semaphore:
@@ -209,6 +871,25 @@ class FFmpegProcessor:
         def on_exception(e: Exception):
             logging.error(f"ffmpeg process error for ID {process_id}: {e}")
 
+        # 流复制的speed=比编码高几个数量级, 计入总吞吐会掩盖编码吞吐的变化, 只统计编码进程
+        limiter = None if STREAM_COPY_RE.search(cmd) else adaptive_limiter.get_limiter()
+
+        def on_output(line: str):
+            """把进度行中的speed=交给自适应限流器"""
+            match = FFMPEG_PROGRESS_RE.search(line)
+            if match and match.group('speed').endswith('x'):
+                try:
+                    limiter.record_speed(process_id, float(match.group('speed')[:-1]))
+                except ValueError:
+                    pass
+
+        # 在同时运行的ffmpeg进程之间平分CPU核心
+        partitioner = cpu_partitioner.get_partitioner() if common.is_cpu_partition() else None
+        job_id = None
+        if partitioner and cmd.startswith('ffmpeg '):
+            job_id = partitioner.acquire()
+            cmd = partitioner.apply(cmd, partitioner.threads())
+
         try:
             return_code, _, _ = await shell_utils.async_run(
                 cmd,
@@ -216,9 +897,16 @@ class FFmpegProcessor:
                 exception_callback=on_exception,
                 process_id=process_id,
                 use_dedicated_line=True,
-                progress_line_checker=is_ffmpeg_progress
+                progress_line_checker=is_ffmpeg_progress,
+                output_callbacks=[on_output] if limiter else None,
+                process_start_callback=(lambda pid: partitioner.started(job_id, pid)) if job_id is not None else None
             )
             return return_code == 0
         except Exception as e:
             logging.error(f"run ffmpeg failed: '{cmd}' {e}")
             return False
+        finally:
+            if job_id is not None:
+                partitioner.release(job_id)
+            if limiter:
+                limiter.finish(process_id)
@@ -0,0 +1,234 @@
+import logging
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from .. import common
+from . import videoprocess
+from .ffmpeg_processor import FFmpegProcessor
+
+
+# 暗标记方式, 变化后已有的A/B片段需要重新编码
+MARK_VERSION = 'spread-spectrum-v1'
+PATTERN_SEED = 20250801
+PATTERN_BLOCK = 16
+
+
+class ForensicProcessor:
+    """
+    A/B片段溯源水印
+
+    每个原视频按固定时长切分为关键帧对齐的片段, 每个片段只编码一次A、B两个版本,
+    A、B在亮度上分别减去、加上同一个低幅度的扩频噪声图案, 肉眼不可见, 整体亮度/色阶调整也不能去除;
+    每个人的视频按其编号的纠错码选择A或B片段, 通过流复制拼接得到, 不再重新编码
+    """
+
+    def __init__(self, config: dict, ffmpeg_processor: FFmpegProcessor):
+        self.config = config
+        self.ffmpeg_processor = ffmpeg_processor
+        self.segment_seconds = common.get_forensic_segment_seconds()
+        self.strength = common.get_forensic_variant_strength()
+        self.id_bits = common.get_forensic_id_bits()
+        self.result_video_type = config.get('result_video_type')
+
+    async def prepare_variants(self, video: Path) -> Optional[dict]:
+        """
+        编码原视频的A/B片段, 原视频和参数没有变化时复用已有片段
+        :return: manifest, 失败时返回None
+        """
+        variant_dir = common.get_forensic_video_dir(video.stem)
+        manifest_file = variant_dir.joinpath('manifest.json')
+        stat = video.stat()
+        expected = {
+            'source': str(video.resolve()),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'segment_seconds': self.segment_seconds,
+            'strength': self.strength,
+            'scale': list(self.config['scale']),
+            'mark': MARK_VERSION
+        }
+        manifest = common.read_json_file(manifest_file)
+        if manifest and all(manifest.get(k) == v for k, v in expected.items()):
+            logging.info(f"A/B片段已存在, 直接复用: {video}")
+            return manifest
+
+        dir_a, dir_b = variant_dir.joinpath('A'), variant_dir.joinpath('B')
+        common.delete_then_create(dir_a)
+        common.delete_then_create(dir_b)
+        pattern = write_pattern(variant_dir.joinpath('pattern.png'), *self.config['scale'])
+        success = await self.ffmpeg_processor.encode_ab_variants(video, pattern, dir_a, dir_b, self.segment_seconds,
+                                                                 self.strength)
+        segments_a = sorted(f.name for f in dir_a.glob('seg_*.ts'))
+        segments_b = sorted(f.name for f in dir_b.glob('seg_*.ts'))
+        if not success or not segments_a or segments_a != segments_b:
+            logging.error(f"A/B片段编码失败或片段不一致, video: {video}")
+            return None
+
+        manifest = dict(expected, segments=segments_a, date=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()))
+        common.write_json_to_file(manifest, manifest_file)
+        logging.info(f"A/B片段编码成功, video: {video}, segments: {len(segments_a)}")
+        return manifest
+
+    async def assemble(self, video: Path, person: str, manifest: dict, logo: str = None) -> bool:
+        """按人的编号选择A/B片段, 流复制拼接为该人的视频"""
+        try:
+            person_id = get_person_id(person, self.id_bits)
+            codeword = encode_id(person_id, self.id_bits)
+        except ValueError as e:
+            logging.error(f"无法生成溯源编码, video: {video}, person: {person}, {e}")
+            return False
+        pattern = [codeword[i % len(codeword)] for i in range(len(manifest['segments']))]
+
+        variant_dir = common.get_forensic_video_dir(video.stem)
+        scratch_dir = common.get_job_scratch_dir(person, video.stem)
+        common.delete_then_create(scratch_dir)
+        try:
+            # 只在开头少量片段中叠加logo: 从原视频一次编码暗标记和logo, 不对A/B片段二次编码
+            head = min(common.get_forensic_logo_segments(), len(manifest['segments'])) if logo else 0
+            if head and not await self.ffmpeg_processor.encode_marked_head(
+                    video, variant_dir.joinpath('pattern.png'), pattern[:head], logo, scratch_dir,
+                    manifest['segment_seconds'], manifest['strength']):
+                return False
+            if any(not scratch_dir.joinpath(name).exists() for name in manifest['segments'][:head]):
+                logging.error(f"开头带logo的片段与A/B片段不一致, video: {video}, person: {person}")
+                return False
+            lines = []
+            for i, (name, bit) in enumerate(zip(manifest['segments'], pattern)):
+                segment = scratch_dir.joinpath(name) if i < head else variant_dir.joinpath('B' if bit else 'A', name)
+                lines.append(f"file '{segment.resolve().as_posix()}'")
+            list_file = scratch_dir.joinpath('segments.txt')
+            common.write_lines_to_file(list_file, lines)
+
+            output = common.get_person_video_result_dir(person).joinpath(f'{video.stem}{self.result_video_type}')
+            success = await self.ffmpeg_processor.concat_segments(list_file, output,
+                                                                  process_id=f'assemble_{person}_{video.stem}')
+        finally:
+            common.delete_file(scratch_dir)
+
+        if success:
+            self._save_metadata(person, person_id, video, manifest, codeword)
+            logging.info(f"A/B片段拼接成功, video: {video}, person: {person}")
+        else:
+            logging.error(f"A/B片段拼接失败, video: {video}, person: {person}")
+        return success
+
+    def _save_metadata(self, person, person_id, video, manifest, codeword):
+        metadata = {
+            'algorithm': 'ab-segment',
+            'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+            'name': str(video),
+            'person_id': person_id,
+            'id_bits': self.id_bits,
+            'codeword': codeword,
+            'segment_seconds': manifest['segment_seconds'],
+            'segments': len(manifest['segments'])
+        }
+        metadata_dir = common.get_person_metadata_result_dir(person)
+        common.create_dir(metadata_dir)
+        common.write_json_to_file(metadata, metadata_dir.joinpath(f'{video.stem}.json'))
+
+
+def trace(suspect: Path, video_stem: str, id_bits: int = None) -> Optional[str]:
+    """
+    从可疑视频中读回A/B片段序列, 纠错解码得到人物
+    :param suspect: 可疑视频
+    :param video_stem: 对应的原视频文件名(不含扩展名)
+    :return: 人物, 无法识别时返回None
+    """
+    id_bits = id_bits or common.get_forensic_id_bits()
+    variant_dir = common.get_forensic_video_dir(video_stem)
+    manifest = common.read_json_file(variant_dir.joinpath('manifest.json'))
+    if not manifest:
+        logging.error(f"没有找到A/B片段, video: {video_stem}")
+        return None
+
+    segment_seconds = manifest['segment_seconds']
+    codeword_length = id_bits // 4 * 7
+    votes = [[] for _ in range(codeword_length)]
+    for i, name in enumerate(manifest['segments']):
+        frame = videoprocess.read_frame_at(suspect, i * segment_seconds + segment_seconds / 2)
+        frame_a = videoprocess.read_frame_at(variant_dir.joinpath('A', name), segment_seconds / 2)
+        frame_b = videoprocess.read_frame_at(variant_dir.joinpath('B', name), segment_seconds / 2)
+        if frame is None or frame_a is None or frame_b is None:
+            continue
+        frame = cv2.resize(frame, (frame_a.shape[1], frame_a.shape[0]))
+        votes[i % codeword_length].append(1 if _correlate(frame, frame_a, frame_b) > 0 else 0)
+
+    if any(not v for v in votes):
+        logging.error(f"可疑视频片段不足以还原完整编号, video: {video_stem}")
+        return None
+    bits = [1 if sum(v) * 2 > len(v) else 0 for v in votes]
+    person_id = decode_id(bits)
+    ids = common.read_json_file(common.get_forensic_ids_file())
+    person = next((p for p, pid in ids.items() if pid == person_id), None)
+    logging.info(f"溯源结果: person_id: {person_id}, person: {person}, bits: {bits}")
+    return person
+
+
+def _correlate(frame, frame_a, frame_b) -> float:
+    """可疑帧与A/B中间值的差和B-A(暗标记图案)的相关性, 大于0为B, 整体亮度偏移与零均值图案不相关"""
+    gray, gray_a, gray_b = (cv2.cvtColor(f, cv2.COLOR_BGR2GRAY).astype(np.float32) for f in (frame, frame_a, frame_b))
+    mark = gray_b - gray_a
+    return float(np.sum((gray - (gray_a + gray_b) / 2) * (mark - mark.mean())))
+
+
+def write_pattern(output: Path, width: int, height: int) -> Path:
+    """
+    生成扩频暗标记图案: 固定种子的±1随机块经过平滑, 灰度128为0, 低频的纹理经过压缩编码后依然保留
+    """
+    rng = np.random.RandomState(PATTERN_SEED)
+    blocks = rng.choice([-1.0, 1.0], size=(height // PATTERN_BLOCK + 1, width // PATTERN_BLOCK + 1))
+    pattern = cv2.resize(blocks.astype(np.float32), (width, height), interpolation=cv2.INTER_LINEAR)
+    pattern = cv2.GaussianBlur(pattern, (0, 0), PATTERN_BLOCK / 4)
+    pattern = pattern / max(float(np.abs(pattern).max()), 1e-6)
+    common.create_dir(output.parent)
+    cv2.imwrite(str(output), np.clip(128 + 127 * pattern, 0, 255).astype(np.uint8))
+    return output
+
+
+def get_person_id(person: str, id_bits: int) -> int:
+    """人物的溯源编号, 第一次使用时分配并保存, 编号超出id_bits能表示的范围时抛出ValueError"""
+    ids_file = common.get_forensic_ids_file()
+    ids = common.read_json_file(ids_file)
+    if person not in ids:
+        person_id = max(ids.values(), default=0) + 1
+        _check_id_range(person_id, id_bits)
+        ids[person] = person_id
+        common.create_dir(ids_file.parent)
+        common.write_json_to_file(ids, ids_file)
+    return ids[person]
+
+
+def encode_id(person_id: int, id_bits: int) -> List[int]:
+    """编号按4位一组做Hamming(7,4)编码, 每组可纠正1位错误"""
+    _check_id_range(person_id, id_bits)
+    bits = [(person_id >> (id_bits - 1 - i)) & 1 for i in range(id_bits)]
+    codeword = []
+    for i in range(0, id_bits, 4):
+        d1, d2, d3, d4 = bits[i:i + 4]
+        codeword += [d1 ^ d2 ^ d4, d1 ^ d3 ^ d4, d1, d2 ^ d3 ^ d4, d2, d3, d4]
+    return codeword
+
+
+def _check_id_range(person_id: int, id_bits: int):
+    """编号超过id_bits位时会被截断, 与其他人的编号冲突"""
+    if person_id >= 2 ** id_bits:
+        raise ValueError(f"person_id {person_id} exceeds FORENSIC_ID_BITS={id_bits}, "
+                         f"at most {2 ** id_bits - 1} persons, please increase FORENSIC_ID_BITS")
+
+
+def decode_id(codeword: List[int]) -> int:
+    """Hamming(7,4)解码, 返回编号"""
+    person_id = 0
+    for i in range(0, len(codeword), 7):
+        c = list(codeword[i:i + 7])
+        syndrome = (c[0] ^ c[2] ^ c[4] ^ c[6]) + 2 * (c[1] ^ c[2] ^ c[5] ^ c[6]) + 4 * (c[3] ^ c[4] ^ c[5] ^ c[6])
+        if syndrome:
+            c[syndrome - 1] ^= 1
+        for bit in (c[2], c[4], c[5], c[6]):
+            person_id = (person_id << 1) | bit
+    return person_id
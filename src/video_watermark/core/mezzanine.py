@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from .. import common
+
+
+class MezzanineCache:
+    """
+    原视频crop/scale之后的中间文件(mezzanine)缓存, 与人物无关, 所有人的加logo步骤共用
+
+    缓存key由原视频路径、大小、修改时间和scale参数组成, 原视频变化后旧的缓存自动失效;
+    缓存总大小超过上限时按最近使用时间(LRU)淘汰; 本次运行中用到过的mezzanine可能还有任务在排队或正在读取, 不淘汰
+    """
+
+    def __init__(self, cache_dir: Path = None, max_bytes: int = None):
+        self.cache_dir = Path(cache_dir or common.get_mezzanine_dir())
+        self.max_bytes = max_bytes if max_bytes is not None else common.get_mezzanine_cache_size()
+        self.index_file = self.cache_dir.joinpath('index.json')
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # 本次运行中返回过的mezzanine
+        self._in_use: Set[str] = set()
+
+    def lock(self, video: Path, w: int, h: int) -> asyncio.Lock:
+        """同一个mezzanine只生成一次"""
+        key = self._key(video, w, h)
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    def path_for(self, video: Path, w: int, h: int) -> Path:
+        """mezzanine文件路径"""
+        common.create_dir(self.cache_dir)
+        return self.cache_dir.joinpath(f'{video.stem}-{self._key(video, w, h)[:12]}.mkv')
+
+    def lookup(self, video: Path, w: int, h: int) -> Optional[Path]:
+        """查找有效的mezzanine文件, 并清理该原视频已失效的缓存"""
+        key = self._key(video, w, h)
+        index = self._read_index()
+        source = str(Path(video).resolve())
+        changed = False
+        for k in [k for k, entry in index.items()
+                  if entry['source'] == source and k != key and k not in self._in_use]:
+            logging.info(f"原视频已变化, 删除失效的mezzanine: {index[k]['file']}")
+            common.delete_file(index.pop(k)['file'])
+            changed = True
+
+        entry = index.get(key)
+        result = None
+        if entry:
+            if Path(entry['file']).exists():
+                entry['last_used'] = time.time()
+                result = Path(entry['file'])
+                self._in_use.add(key)
+            else:
+                index.pop(key)
+            changed = True
+        if changed:
+            self._write_index(index)
+        return result
+
+    def add(self, video: Path, w: int, h: int, file: Path):
+        """记录新生成的mezzanine, 超过容量时按LRU淘汰"""
+        stat = Path(video).stat()
+        index = self._read_index()
+        key = self._key(video, w, h)
+        index[key] = {
+            'source': str(Path(video).resolve()),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'scale': f'{w}x{h}',
+            'file': str(file),
+            'bytes': common.get_file_size(file),
+            'last_used': time.time()
+        }
+        self._in_use.add(key)
+        self._evict(index)
+        self._write_index(index)
+
+    def _evict(self, index: dict):
+        total = sum(entry['bytes'] for entry in index.values())
+        for k, entry in sorted(index.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if k in self._in_use:
+                continue
+            logging.info(f"mezzanine缓存超过上限, 淘汰: {entry['file']}")
+            common.delete_file(entry['file'])
+            total -= entry['bytes']
+            index.pop(k)
+        if total > self.max_bytes:
+            logging.info(f"本次运行中使用的mezzanine超过缓存上限, 下次运行时淘汰, 当前: {total / 1024 ** 3:.1f}GB")
+
+    @staticmethod
+    def _key(video: Path, w: int, h: int) -> str:
+        p = Path(video).resolve()
+        stat = p.stat()
+        raw = f'{p}|{stat.st_size}|{stat.st_mtime_ns}|{w}x{h}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _read_index(self) -> dict:
+        return common.read_json_file(self.index_file)
+
+    def _write_index(self, index: dict):
+        common.create_dir(self.cache_dir)
+        common.write_json_to_file(index, self.index_file)
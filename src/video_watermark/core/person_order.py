@@ -0,0 +1,59 @@
+import logging
+from typing import Dict, List
+
+from .. import common
+from . import encoder_profile
+from . import probe
+
+
+def order_persons(persons, all_videos, invisible_watermark_videos, config: dict) -> List[str]:
+    """
+    按PERSON_ORDER排列处理顺序:
+    - file: 名单.txt中的顺序
+    - priority: 名单.txt第三列的优先级, 数字小的先处理, 没有优先级的排在最后
+    - sjf: 剩余工作量(待编码时长 / 编码速度 + 待上传字节 / 上传速度)小的先处理, 尽早把分享链接发给更多的人
+    """
+    persons = list(persons)
+    order = common.get_person_order()
+    if order == 'priority':
+        priorities = common.get_person_priorities()
+        result = sorted(persons, key=lambda p: priorities.get(p, float('inf')))
+        logging.info(f"按优先级处理: {[(p, priorities.get(p)) for p in result]}")
+        return result
+    if order == 'sjf':
+        estimates = estimate_remaining_seconds(persons, all_videos, invisible_watermark_videos, config)
+        result = sorted(persons, key=lambda p: estimates[p])
+        logging.info(f"按剩余工作量从小到大处理: {[(p, round(estimates[p])) for p in result]}")
+        return result
+    return persons
+
+
+def estimate_remaining_seconds(persons, all_videos, invisible_watermark_videos, config: dict) -> Dict[str, float]:
+    """估算每个人剩余的编码和上传时间(秒)"""
+    invisible_set = set(invisible_watermark_videos)
+    # 暗水印视频要编码两次(压缩加logo, 合成), 单次编码模式下只编码一次
+    invisible_passes = 1 if common.is_single_encode_invisible() else 2
+    speed = encoder_profile.measured_speed(config.get('preset'), config.get('crf')) or 1.0
+    upload_speed = common.get_upload_speed() * 1024 * 1024
+    w, h = config.get('scale', (1280, 720))
+    estimates = {}
+    for person in persons:
+        encode_seconds = 0.0
+        upload_bytes = 0
+        for video in common.get_pending_to_process_videos(all_videos, person):
+            info = probe.get_catalog().get(video)
+            if not info:
+                continue
+            passes = invisible_passes if video in invisible_set else 1
+            encode_seconds += info['duration'] * passes / speed
+            # 输出大小按分辨率比例估算, 不超过原视频
+            pixels = info['width'] * info['height']
+            ratio = min(1.0, w * h / pixels) if pixels else 1.0
+            upload_bytes += info['size'] * ratio
+        if common.is_sync_to_baidu() and common.is_delete_after_upload_success():
+            # 上传成功后会删除, 结果目录中剩下的文件都还没有上传
+            result_dir = common.get_person_video_result_dir(person)
+            if result_dir.exists():
+                upload_bytes += sum(common.get_file_size(f) for f in common.get_files(result_dir, recursive=False))
+        estimates[person] = encode_seconds + upload_bytes / upload_speed
+    return estimates
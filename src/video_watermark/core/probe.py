@@ -0,0 +1,212 @@
+import asyncio
+import atexit
+import json
+import logging
+import subprocess
+import threading
+import time
+from fractions import Fraction
+from pathlib import Path
+from typing import List, Optional
+
+from .. import common
+
+PROBE_CMD = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams']
+KEYFRAME_CMD = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+                '-of', 'csv=p=0']
+# 索引文件最多每隔多少秒写一次, 进程退出时写入剩余的变化
+PERSIST_INTERVAL = 60
+# TARGET_DIR下的中间文件目录, 探测结果只保存在内存中, 不写入索引文件
+INTERMEDIATE_DIRS = ('stage1', 'scratch', 'calibrate', 'audio_cache', 'segments', 'course')
+
+
+class ProbeCatalog:
+    """
+    媒体文件探测结果目录: 宽高、精确帧率、帧数、时长、编码格式和关键帧位置
+
+    每个文件只用ffprobe探测一次, 结果按路径保存在sidecar索引文件中,
+    文件大小或修改时间变化后重新探测.
+    关键帧位置需要扫描整个文件, 只在分段编码需要时才探测;
+    中间文件(stage1、音轨缓存、calibrate等)的结果只保存在内存中, 索引文件只保存仍然存在的文件
+    """
+
+    def __init__(self, index_file: Path = None):
+        self.index_file = Path(index_file or common.get_probe_index_file())
+        self._index = None
+        self._transient = {}
+        self._dirty = False
+        self._last_persist = time.time()
+        self._lock = threading.Lock()
+        target_dir = common.get_target_dir().resolve()
+        self._intermediate_dirs = [target_dir.joinpath(d) for d in INTERMEDIATE_DIRS]
+
+    def get(self, video, keyframes: bool = False) -> Optional[dict]:
+        """
+        获取文件的探测结果, 缓存中没有时同步探测(会阻塞调用线程, 异步代码中请使用get_async), 探测失败返回None
+        :param keyframes: 是否需要关键帧位置, 需要时才扫描整个文件
+        """
+        key, size, mtime = self._file_key(video)
+        info = self._lookup(key, size, mtime)
+        if info is None:
+            info = self._store(key, size, mtime, self._parse(self._run(PROBE_CMD + [key])))
+        if info is not None and keyframes and 'keyframes' not in info:
+            info = self._store(key, size, mtime, dict(info, keyframes=self._parse_keyframes(
+                self._run(KEYFRAME_CMD + [key]))))
+        return info
+
+    async def get_async(self, video, keyframes: bool = False) -> Optional[dict]:
+        """在线程中探测, 不阻塞事件循环; 之后同一个文件的同步get直接命中缓存"""
+        return await asyncio.to_thread(self.get, video, keyframes)
+
+    async def probe_all(self, videos: List[Path], concurrency: int = None):
+        """启动时并发探测所有文件, 已经探测过且没有变化的文件直接跳过"""
+        semaphore = asyncio.Semaphore(concurrency or common.get_probe_concurrency())
+
+        async def probe_one(video):
+            key, size, mtime = self._file_key(video)
+            if self._lookup(key, size, mtime) is not None:
+                return
+            async with semaphore:
+                info_output = await self._run_async(PROBE_CMD + [key])
+            self._store(key, size, mtime, self._parse(info_output))
+
+        await asyncio.gather(*[probe_one(video) for video in videos])
+        self.flush()
+        logging.info(f"Probed {len(videos)} media files")
+
+    def flush(self):
+        """把还没有写入的探测结果写入索引文件"""
+        with self._lock:
+            if self._dirty:
+                self._persist()
+
+    def _lookup(self, key, size, mtime) -> Optional[dict]:
+        with self._lock:
+            entry = self._transient.get(key) or self._load().get(key)
+        if entry and entry.get('size') == size and entry.get('mtime') == mtime:
+            return entry
+        return None
+
+    def _store(self, key, size, mtime, info) -> Optional[dict]:
+        if info is None:
+            return None
+        info['size'] = size
+        info['mtime'] = mtime
+        with self._lock:
+            if self._is_intermediate(key):
+                self._transient[key] = info
+                return info
+            self._load()[key] = info
+            self._dirty = True
+            if time.time() - self._last_persist >= PERSIST_INTERVAL:
+                self._persist()
+        return info
+
+    def _is_intermediate(self, key: str) -> bool:
+        return any(d in Path(key).parents for d in self._intermediate_dirs)
+
+    def _load(self) -> dict:
+        if self._index is None:
+            self._index = common.read_json_file(self.index_file)
+        return self._index
+
+    def _persist(self):
+        # 已经删除的文件和中间文件不再保留
+        self._index = {k: v for k, v in self._load().items() if Path(k).exists() and not self._is_intermediate(k)}
+        common.create_dir(self.index_file.parent)
+        common.write_json_to_file(self._index, self.index_file)
+        self._dirty = False
+        self._last_persist = time.time()
+
+    @staticmethod
+    def _file_key(video):
+        p = Path(video).resolve()
+        stat = p.stat()
+        return str(p), stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _run(cmd) -> Optional[str]:
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            logging.warning("ffprobe not found, fallback to opencv")
+            return None
+        if result.returncode != 0:
+            logging.error(f"ffprobe failed: {cmd[-1]}, {result.stderr.decode('utf-8', errors='replace')}")
+            return None
+        return result.stdout.decode('utf-8', errors='replace')
+
+    @staticmethod
+    async def _run_async(cmd) -> Optional[str]:
+        try:
+            process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE)
+        except FileNotFoundError:
+            logging.warning("ffprobe not found, fallback to opencv")
+            return None
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            logging.error(f"ffprobe failed: {cmd[-1]}, {stderr.decode('utf-8', errors='replace')}")
+            return None
+        return stdout.decode('utf-8', errors='replace')
+
+    @staticmethod
+    def _parse_keyframes(keyframe_output: Optional[str]) -> List[float]:
+        keyframes = []
+        for line in (keyframe_output or '').splitlines():
+            parts = line.strip().split(',')
+            if len(parts) >= 2 and 'K' in parts[1] and parts[0] not in ('', 'N/A'):
+                keyframes.append(float(parts[0]))
+        return sorted(keyframes)
+
+    @staticmethod
+    def _parse(info_output: Optional[str]) -> Optional[dict]:
+        if not info_output:
+            return None
+        data = json.loads(info_output)
+        streams = data.get('streams', [])
+        fmt = data.get('format', {})
+        video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+        audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+
+        frame_rate = _valid_rate(video.get('avg_frame_rate')) or _valid_rate(video.get('r_frame_rate'))
+        fps = float(Fraction(frame_rate)) if frame_rate else 0.0
+        duration = float(fmt.get('duration') or video.get('duration') or 0)
+        frame_count = int(video.get('nb_frames') or 0) or int(round(duration * fps))
+
+        return {
+            'width': int(video.get('width') or 0),
+            'height': int(video.get('height') or 0),
+            'frame_rate': frame_rate,
+            'fps': fps,
+            'frame_count': frame_count,
+            'duration': duration,
+            'bit_rate': int(fmt.get('bit_rate') or 0),
+            'video_codec': video.get('codec_name'),
+            'video_bit_rate': int(video.get('bit_rate') or 0),
+            'pix_fmt': video.get('pix_fmt'),
+            'profile': video.get('profile'),
+            'audio_codec': audio.get('codec_name'),
+            'audio_bit_rate': int(audio.get('bit_rate') or 0),
+            'sample_rate': int(audio.get('sample_rate') or 0),
+            'channels': int(audio.get('channels') or 0)
+        }
+
+
+def _valid_rate(rate: Optional[str]) -> Optional[str]:
+    """过滤ffprobe中无效的帧率, 例如'0/0'"""
+    if not rate or rate.startswith('0/') or rate.endswith('/0'):
+        return None
+    return rate
+
+
+_catalog = None
+
+
+def get_catalog() -> ProbeCatalog:
+    """全局共享的探测目录"""
+    global _catalog
+    if _catalog is None:
+        _catalog = ProbeCatalog()
+        atexit.register(_catalog.flush)
+    return _catalog
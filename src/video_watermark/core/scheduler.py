@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class DagTask:
+    """DAG中的一个任务, 依赖的任务全部成功后才会在所属资源池中运行"""
+
+    def __init__(self, name: str, pool: str, func: Callable[[], Awaitable], deps: List['DagTask']):
+        self.name = name
+        self.pool = pool
+        self.func = func
+        self.deps = deps
+        self.state = 'pending'  # pending, running, done, failed, skipped
+        self.ready_at: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+
+class DagScheduler:
+    """
+    全局DAG任务调度器
+
+    每个任务属于一个资源池(例如 encode、embed、disk、network), 每个资源池有独立的并发上限;
+    任务在依赖全部成功后进入资源池排队(先到先得), 依赖失败的任务直接跳过。
+    所有(人, 视频)的任务一起调度, 各资源池不会因为按人或按阶段串行而空闲
+    """
+
+    def __init__(self, pool_limits: Dict[str, int]):
+        self.pool_limits = dict(pool_limits)
+        self._pools = {name: asyncio.Semaphore(max(1, limit)) for name, limit in pool_limits.items()}
+        self.tasks: List[DagTask] = []
+        self._started_at: Optional[float] = None
+
+    def add(self, name: str, pool: str, func: Callable[[], Awaitable], deps: List[DagTask] = None) -> DagTask:
+        """添加任务, func返回False或抛出异常时认为任务失败"""
+        if pool not in self._pools:
+            raise ValueError(f"unknown pool: {pool}, pools: {list(self._pools.keys())}")
+        task = DagTask(name, pool, func, list(deps or []))
+        self.tasks.append(task)
+        return task
+
+    async def run(self) -> bool:
+        """运行所有任务, 返回是否全部成功"""
+        self._started_at = time.time()
+        futures: Dict[DagTask, asyncio.Future] = {}
+
+        async def run_task(task: DagTask) -> bool:
+            dep_results = await asyncio.gather(*(futures[dep] for dep in task.deps))
+            if not all(dep_results):
+                task.state = 'skipped'
+                return False
+            task.ready_at = time.time()
+            async with self._pools[task.pool]:
+                task.state = 'running'
+                task.started_at = time.time()
+                try:
+                    success = await task.func() is not False
+                except Exception as e:
+                    logging.error(f"任务失败: {task.name}, {e}", exc_info=True)
+                    success = False
+                task.finished_at = time.time()
+            task.state = 'done' if success else 'failed'
+            return success
+
+        # 任务总是在依赖之后添加, 按添加顺序创建即可保证依赖的future已经存在
+        for task in self.tasks:
+            futures[task] = asyncio.ensure_future(run_task(task))
+        results = await asyncio.gather(*futures.values())
+        return all(results)
+
+    def critical_path(self) -> List[DagTask]:
+        """关键路径: 从最后完成的任务开始, 每次回溯到最晚完成的依赖"""
+        finished = [task for task in self.tasks if task.finished_at is not None]
+        if not finished:
+            return []
+        task = max(finished, key=lambda t: t.finished_at)
+        path = [task]
+        while task.deps:
+            task = max(task.deps, key=lambda t: t.finished_at or 0)
+            path.append(task)
+        return list(reversed(path))
+
+    def report(self):
+        """输出关键路径和各资源池的利用率"""
+        if self._started_at is None:
+            return
+        makespan = max((t.finished_at for t in self.tasks if t.finished_at), default=time.time()) - self._started_at
+        states = {}
+        for task in self.tasks:
+            states[task.state] = states.get(task.state, 0) + 1
+        logging.info(f"调度完成, 总耗时: {makespan:.1f}s, 任务: {states}")
+
+        for task in self.critical_path():
+            wait = task.started_at - task.ready_at if task.started_at and task.ready_at else 0
+            logging.info(f"关键路径: [{task.pool}] {task.name}, 排队: {wait:.1f}s, 运行: {task.duration:.1f}s")
+
+        for pool, limit in self.pool_limits.items():
+            busy = sum(task.duration for task in self.tasks if task.pool == pool)
+            utilisation = busy / (max(1, limit) * makespan) if makespan > 0 else 0
+            logging.info(f"资源池: {pool}, 并发上限: {limit}, 利用率: {utilisation:.0%}")
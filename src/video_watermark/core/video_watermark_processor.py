@@ -5,12 +5,18 @@ import shutil
 from pathlib import Path
 import logging
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 
 from .. import common
 from .. import core
 from .. import tool
 from . import pils
+from . import course_planner
+from . import forensic
+from . import person_order
+from . import probe
 from . import videoprocess
+from .scheduler import DagScheduler
 from .ffmpeg_processor import FFmpegProcessor
 
 
@@ -21,6 +27,11 @@ class VideoWatermarkProcessor:
         self.ffmpeg_processor = FFmpegProcessor(config)
         self.upload_semaphore = asyncio.Semaphore(3)
         self.upload_tasks = set()  # 存储所有上传任务
+        self.person_upload_tasks = {}  # person -> 该人还未完成的上传任务
+        self.upload_failed_persons = set()  # 有上传失败视频的人, 不标记为可分享
+        self._frame_pool = None  # 加暗水印的进程池, 整个运行期间复用
+        # 暗水印任务(压缩 -> 抽帧 -> 加暗水印 -> 合成 -> 清理)整体的并发, 同时存在的全帧临时目录不超过INVISIBLE_CONCURRENCY个
+        self._invisible_job_semaphore = asyncio.Semaphore(common.get_invisible_concurrency())
 
     async def process_all(self, origin_videos='', persons=None):
         """
@@ -35,10 +46,40 @@ class VideoWatermarkProcessor:
         if not all_videos:
             return
 
+        # 启动时并发探测所有原视频, 后续各阶段读取探测目录
+        await probe.get_catalog().probe_all(all_videos)
+
+        if common.is_forensic_mode():
+            await self._process_forensic(persons, all_videos)
+            return
+
         invisible_watermark_videos, plain_watermark_videos = self._partition(all_videos)
+        # 原视频内容或处理参数变化的结果重新生成, 改名的原视频直接使用已有结果
+        common.reconcile_person_videos(all_videos, persons, self.config, invisible_watermark_videos)
+        persons = person_order.order_persons(persons, all_videos, invisible_watermark_videos, self.config)
         logo_title_prefix = self.config['watermark_logo_text']
 
-        # 按顺序处理每个人
+        # 明水印视频一次解码多人输出
+        if common.get_fanout_batch_size() > 1 and plain_watermark_videos:
+            await self._process_plain_videos_fanout(persons, logo_title_prefix, plain_watermark_videos, all_videos)
+
+        try:
+            if common.is_use_dag_scheduler():
+                await self._process_with_scheduler(persons, logo_title_prefix, invisible_watermark_videos,
+                                                   plain_watermark_videos, all_videos)
+            elif common.get_process_order() == 'video':
+                await self._process_video_major(persons, logo_title_prefix, invisible_watermark_videos, all_videos)
+            else:
+                await self._process_persons(persons, logo_title_prefix, invisible_watermark_videos,
+                                            plain_watermark_videos, all_videos)
+        finally:
+            self._shutdown_frame_pool()
+            # 记录本次生成的结果的指纹
+            common.reconcile_person_videos(all_videos, persons, self.config, invisible_watermark_videos, record=True)
+
+    async def _process_persons(self, persons, logo_title_prefix, invisible_watermark_videos,
+                               plain_watermark_videos, all_videos):
+        """按顺序处理每个人, 并等待所有上传任务完成"""
         for person in persons:
             if common.is_finished(person):
                 logging.info(f"'{person}' is already processed")
@@ -78,9 +119,179 @@ class VideoWatermarkProcessor:
         logging.info(f"Finish to process {len(plain_watermark_videos)} plain videos for '{person}'")
 
         # 检查是否完成对person的处理
-        if common.is_done_for_person(all_videos, person):
-            common.finish(person)
-            logging.info(f"'Finished course videos: {course_name} for person: '{person}'")
+        self._finish_person(all_videos, person, course_name)
+
+    async def _process_video_major(self, persons, logo_title_prefix, invisible_watermark_videos, all_videos):
+        """
+        按视频处理: 一个原视频为所有人生成完之后再处理下一个, 原视频在此期间一直在page cache中,
+        每个原视频只需要从磁盘读取一次; 暗水印视频的各人任务经过process_single_video_async的任务级并发限制,
+        同时只有INVISIBLE_CONCURRENCY个人的全帧临时目录
+        """
+        course_name = common.get_current_course_name() or all_videos[0].parent.name
+        pending_persons = [person for person in persons if not common.is_finished(person)]
+        for person in pending_persons:
+            text = f'{logo_title_prefix}{person}'
+            self._initialize_directories(person)
+            self.generate_logo_and_qrcode(person, text, text)
+
+        invisible_set = set(invisible_watermark_videos)
+        for video in all_videos:
+            todo = [person for person in pending_persons if not common.is_already_processed(video, person)]
+            if not todo:
+                continue
+            logging.info(f"Begin to process '{video.name}' for {len(todo)} persons")
+            results = await asyncio.gather(*[
+                self.process_single_video_async(person, video, video in invisible_set, course_name) for person in todo
+            ], return_exceptions=True)
+            for person, result in zip(todo, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Error processing '{video.name}' for '{person}': {result}", exc_info=result)
+
+        for person in pending_persons:
+            self._finish_person(all_videos, person, course_name)
+
+        if self.upload_tasks:
+            logging.info(f"Waiting for {len(self.upload_tasks)} upload tasks to complete...")
+            await asyncio.gather(*self.upload_tasks, return_exceptions=True)
+            logging.info("All upload tasks completed")
+
+    async def process_new_video(self, video, persons, all_videos):
+        """
+        watch模式: 新视频写完后为所有人生成水印视频并上传, 不等下一次批量处理;
+        是否加暗水印按视频在all_videos中的位置决定, 与批量处理一致
+        """
+        course_name = common.get_current_course_name() or video.parent.name
+        index = next((i for i, v in enumerate(all_videos) if v.name == video.name), None)
+        if index is None:
+            # 扩展名不在处理范围内, 或者在列出目录之前已经被改名、删除
+            logging.warning(f"'{video.name}' is not in the video list of {video.parent}, skip it")
+            return
+        add_invisible_watermark = common.is_need_add_invisible_watermark(index)
+        invisible_videos = [video] if add_invisible_watermark else []
+        common.reconcile_person_videos([video], persons, self.config, invisible_videos)
+        todo = [person for person in persons if not common.is_already_processed(video, person)]
+        if not todo:
+            logging.info(f"'{video.name}' is already processed for all persons")
+            return
+        for person in todo:
+            self.prepare_person(person)
+
+        logging.info(f"Begin to process new video '{video.name}' for {len(todo)} persons")
+        results = await asyncio.gather(*[
+            self.process_single_video_async(person, video, add_invisible_watermark, course_name) for person in todo
+        ], return_exceptions=True)
+        for person, result in zip(todo, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error processing '{video.name}' for '{person}': {result}", exc_info=result)
+            self._finish_person(all_videos, person, course_name)
+        common.reconcile_person_videos([video], todo, self.config, invisible_videos, record=True)
+
+    async def _process_with_scheduler(self, persons, logo_title_prefix, invisible_watermark_videos,
+                                      plain_watermark_videos, all_videos):
+        """
+        所有(人, 视频)一起建模为DAG: compress -> sample/embed -> compose -> metadata -> upload,
+        按资源池(encode、embed、disk、network)调度, 不再按人、按阶段串行
+        """
+        course_name = common.get_current_course_name() or all_videos[0].parent.name
+        scheduler = DagScheduler(common.get_pool_limits())
+        pending_persons = [person for person in persons if not common.is_finished(person)]
+        invisible_set = set(invisible_watermark_videos)
+        for person in pending_persons:
+            text = f'{logo_title_prefix}{person}'
+            self._initialize_directories(person)
+            self.generate_logo_and_qrcode(person, text, text)
+            # 暗水印视频排在前面, 关键路径最长的任务先开始
+            for video in invisible_watermark_videos + plain_watermark_videos:
+                if not common.is_already_processed(video, person):
+                    self._add_video_tasks(scheduler, person, video, video in invisible_set, course_name)
+
+        logging.info(f"DAG scheduler: {len(scheduler.tasks)} tasks, pools: {scheduler.pool_limits}")
+        await scheduler.run()
+        scheduler.report()
+
+        for person in pending_persons:
+            self._finish_person(all_videos, person, course_name)
+
+        if self.upload_tasks:
+            await asyncio.gather(*self.upload_tasks, return_exceptions=True)
+
+    def _add_video_tasks(self, scheduler, person, video, add_invisible_watermark, course_name):
+        """添加一个(人, 视频)的任务链"""
+        logo = common.get_logo_watermark_image(person).as_posix()
+        filename_with_extension = f"{video.stem}{self.config['result_video_type']}"
+        name = f'{person}/{video.stem}'
+
+        def record():
+            common.add_video_to_person_detail(filename_with_extension, person)
+
+        async def upload():
+            await self.upload_result(course_name, filename_with_extension, person)
+
+        if add_invisible_watermark and common.is_single_encode_invisible():
+            async def single_encode():
+                if await self._process_with_single_encode_async(person, video, logo):
+                    record()
+                    return True
+                return False
+            last = scheduler.add(f'{name} single_encode', 'encode', single_encode)
+        elif add_invisible_watermark:
+            stage1_video = common.get_person_video_stage_dir(person).joinpath(filename_with_extension)
+            job = {}
+            slot = {'held': False}
+
+            def release_slot():
+                if slot['held']:
+                    slot['held'] = False
+                    self._invisible_job_semaphore.release()
+
+            async def guarded(func):
+                """暗水印阶段失败时清理该任务的临时目录"""
+                success = False
+                try:
+                    success = await func() is not False
+                    return success
+                finally:
+                    if not success:
+                        common.delete_file(common.get_job_scratch_dir(person, video.stem))
+                        release_slot()
+
+            async def compress():
+                return await self.ffmpeg_processor.compress_with_logo(video, person, logo, True)
+
+            async def sample_embed():
+                # 从抽帧到合成后清理临时目录一直占用暗水印并发名额, 全帧临时目录不会在compose之前堆积
+                await self._invisible_job_semaphore.acquire()
+                slot['held'] = True
+                await probe.get_catalog().get_async(stage1_video)
+                job.update(self._new_invisible_job(person, common.get_qrcode_image(person), stage1_video,
+                                                   video.stem))
+                return await self._invisible_sample_embed(job)
+
+            async def compose():
+                return await self._invisible_compose(job, crf=self.config['crf'], preset=self.config['preset'])
+
+            async def metadata():
+                try:
+                    self._invisible_save_metadata(job)
+                    record()
+                    common.delete_file(common.get_job_scratch_dir(person, video.stem))
+                    if not common.keep_stage1_file():
+                        common.delete_file(stage1_video)
+                finally:
+                    release_slot()
+
+            compress_task = scheduler.add(f'{name} compress', 'encode', compress)
+            embed_task = scheduler.add(f'{name} sample/embed', 'embed', lambda: guarded(sample_embed), [compress_task])
+            compose_task = scheduler.add(f'{name} compose', 'encode', lambda: guarded(compose), [embed_task])
+            last = scheduler.add(f'{name} metadata', 'disk', metadata, [compose_task])
+        else:
+            async def compress():
+                if await self.ffmpeg_processor.compress_with_logo(video, person, logo, False):
+                    record()
+                    return True
+                return False
+            last = scheduler.add(f'{name} compress', 'encode', compress)
+        scheduler.add(f'{name} upload', 'network', upload, [last])
 
     def _partition(self, videos):
         invisible_watermark_videos = []
@@ -93,19 +304,26 @@ class VideoWatermarkProcessor:
         return invisible_watermark_videos, plain_watermark_videos
 
     async def _process_person_invisible_watermark_videos(self, course_name, videos, person):
-        """处理暗水印视频（串行处理，每个视频处理完成后立即上传）"""
+        """处理暗水印视频（并发数由INVISIBLE_CONCURRENCY控制，每个视频处理完成后立即上传）"""
         pending_videos = common.get_pending_to_process_videos(videos, person)
         if not pending_videos:
             return
 
         processed = []
         try:
-            for video in pending_videos:
-                success, filename_with_extension = await self.process_single_video_async(
-                    person, video, True, course_name
-                )
-                if success:
-                    processed.append(video.name)
+            # 每个(人, 视频)任务使用独立的临时目录, 整个任务的并发由INVISIBLE_CONCURRENCY限制
+            tasks = [
+                asyncio.create_task(self.process_single_video_async(person, video, True, course_name))
+                for video in pending_videos
+            ]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, tuple) and len(result) == 2:
+                    success, filename_with_extension = result
+                    if success:
+                        processed.append(filename_with_extension)
+                elif isinstance(result, Exception):
+                    logging.error(f"处理暗水印视频时出错: {result}")
         finally:
             common.add_videos_to_person_detail(processed, person)
             logging.info(f"Finished processing {len(processed)} invisible videos for '{person}'")
@@ -142,36 +360,234 @@ class VideoWatermarkProcessor:
             common.add_videos_to_person_detail(processed, person)
             logging.info(f"Finished processing {len(processed)} plain videos for '{person}'")
 
+    async def _process_plain_videos_fanout(self, persons, logo_title_prefix, videos, all_videos):
+        """明水印视频按视频处理: 每个视频只解码一次, 每个ffmpeg进程输出K个人的视频"""
+        course_name = common.get_current_course_name() or all_videos[0].parent.name
+        pending_persons = [person for person in persons if not common.is_finished(person)]
+        for person in pending_persons:
+            text = f'{logo_title_prefix}{person}'
+            self._initialize_directories(person)
+            self.generate_logo_and_qrcode(person, text, text)
+
+        batch_size = common.get_fanout_batch_size()
+        tasks = []
+        for video in videos:
+            todo = [person for person in pending_persons if not common.is_already_processed(video, person)]
+            for i in range(0, len(todo), batch_size):
+                tasks.append(asyncio.create_task(
+                    self._process_fanout_batch(video, todo[i:i + batch_size], course_name)
+                ))
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error(f"明水印多人输出时出错: {result}")
+        logging.info(f"Finished fan-out processing {len(videos)} plain videos for {len(pending_persons)} persons")
+
+    async def _process_fanout_batch(self, video, persons, course_name):
+        """一个ffmpeg进程为一批人生成同一个明水印视频"""
+        person_logos = {person: common.get_logo_watermark_image(person).as_posix() for person in persons}
+        success = await self.ffmpeg_processor.compress_with_logo_fanout(video, person_logos)
+        if not success:
+            logging.error(f"明水印多人输出失败, video: {video}, persons: {persons}")
+            return False
+
+        filename_with_extension = f"{video.stem}{self.config['result_video_type']}"
+        for person in persons:
+            common.add_video_to_person_detail(filename_with_extension, person)
+            self._schedule_upload(course_name, filename_with_extension, person)
+        return True
+
+    async def _process_forensic(self, persons, all_videos):
+        """A/B片段溯源模式: 每个视频只编码一次A/B片段, 每个人的视频通过流复制拼接"""
+        course_name = common.get_current_course_name() or all_videos[0].parent.name
+        logo_title_prefix = self.config['watermark_logo_text']
+        forensic_processor = forensic.ForensicProcessor(self.config, self.ffmpeg_processor)
+        use_logo = common.get_forensic_logo_segments() > 0
+        pending_persons = [person for person in persons if not common.is_finished(person)]
+        for person in pending_persons:
+            self._initialize_directories(person)
+            if use_logo:
+                text = f'{logo_title_prefix}{person}'
+                self.generate_logo_and_qrcode(person, text, text)
+
+        for video in all_videos:
+            todo = [person for person in pending_persons if not common.is_already_processed(video, person)]
+            if not todo:
+                continue
+            manifest = await forensic_processor.prepare_variants(video)
+            if not manifest:
+                continue
+            tasks = [
+                asyncio.create_task(self._assemble_forensic_video(forensic_processor, video, person, manifest,
+                                                                  use_logo, course_name))
+                for person in todo
+            ]
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        for person in pending_persons:
+            self._finish_person(all_videos, person, course_name)
+
+        if self.upload_tasks:
+            logging.info(f"Waiting for {len(self.upload_tasks)} upload tasks to complete...")
+            await asyncio.gather(*self.upload_tasks, return_exceptions=True)
+            logging.info("All upload tasks completed")
+
+    async def _assemble_forensic_video(self, forensic_processor, video, person, manifest, use_logo, course_name):
+        logo = common.get_logo_watermark_image(person).as_posix() if use_logo else None
+        success = await forensic_processor.assemble(video, person, manifest, logo)
+        if success:
+            filename_with_extension = f"{video.stem}{self.config['result_video_type']}"
+            common.add_video_to_person_detail(filename_with_extension, person)
+            self._schedule_upload(course_name, filename_with_extension, person)
+        return success
+
+    async def process_course(self, episode_dirs, persons):
+        """
+        按编码计划从MTS原始片段直接生成每个人的视频, 代替 concate -> scale -> main 多次编码
+        """
+        logging.info(f"Processing course with {len(episode_dirs)} episodes for {len(persons)} people")
+        course_name = common.get_current_course_name() or episode_dirs[0].parent.name
+        logo_title_prefix = self.config['watermark_logo_text']
+        pending_persons = [person for person in persons if not common.is_finished(person)]
+        for person in pending_persons:
+            text = f'{logo_title_prefix}{person}'
+            self._initialize_directories(person)
+            self.generate_logo_and_qrcode(person, text, text)
+
+        plans = course_planner.plan_course(episode_dirs, pending_persons, self.config['result_video_type'])
+        try:
+            for plan in plans:
+                try:
+                    if plan['invisible']:
+                        await self._process_course_invisible_episode(plan, course_name)
+                    else:
+                        await self._process_course_plain_episode(plan, course_name)
+                except Exception as e:
+                    logging.error(f"处理 {plan['name']} 时出错: {e}", exc_info=True)
+        finally:
+            self._shutdown_frame_pool()
+
+        all_videos = [Path(f"{d.name}{self.config['result_video_type']}") for d in episode_dirs]
+        for person in pending_persons:
+            self._finish_person(all_videos, person, course_name)
+
+        if self.upload_tasks:
+            logging.info(f"Waiting for {len(self.upload_tasks)} upload tasks to complete...")
+            await asyncio.gather(*self.upload_tasks, return_exceptions=True)
+            logging.info("All upload tasks completed")
+
+    async def _process_course_plain_episode(self, plan, course_name):
+        """明水印集: 拼接、降噪、scale和logo在一个ffmpeg中完成, 每个进程输出一批人的视频"""
+        batch_size = common.get_fanout_batch_size()
+        persons = plan['persons']
+
+        async def process_batch(batch):
+            person_logos = {person: common.get_logo_watermark_image(person).as_posix() for person in batch}
+            success = await self.ffmpeg_processor.encode_course_fanout(plan['list_file'], plan['name'], person_logos)
+            if not success:
+                logging.error(f"编码失败, episode: {plan['name']}, persons: {batch}")
+                return
+            for person in batch:
+                common.add_video_to_person_detail(plan['video'].name, person)
+                self._schedule_upload(course_name, plan['video'].name, person)
+
+        await asyncio.gather(*[process_batch(persons[i:i + batch_size]) for i in range(0, len(persons), batch_size)])
+        common.delete_file(plan['list_file'])
+
+    async def _process_course_invisible_episode(self, plan, course_name):
+        """暗水印集: 先写一份拼接、降噪、scale后的中间文件, 再对每个人走暗水印流程, 全部成功后删除中间文件"""
+        intermediate_dir = common.get_course_intermediate_dir()
+        common.create_dir(intermediate_dir)
+        intermediate = intermediate_dir.joinpath(f"{plan['name']}.mkv")
+        if not intermediate.exists():
+            success = await self.ffmpeg_processor.encode_course_intermediate(plan['list_file'], intermediate)
+            if not success:
+                logging.error(f"生成中间文件失败, episode: {plan['name']}")
+                common.delete_file(intermediate)
+                return
+
+        results = await asyncio.gather(*[
+            self.process_single_video_async(person, intermediate, True, course_name) for person in plan['persons']
+        ], return_exceptions=True)
+        if all(isinstance(r, tuple) and r[0] for r in results):
+            common.delete_file(intermediate)
+            common.delete_file(plan['list_file'])
+
     async def process_single_video_async(self, person, video, add_invisible_watermark=False, course_name=None):
         """
-        处理单个视频文件并立即开始上传任务
+        处理单个视频文件并立即开始上传任务, 暗水印任务整体占用一个暗水印并发名额
         """
+        if not add_invisible_watermark:
+            return await self._process_single_video_impl(person, video, False, course_name)
+        async with self._invisible_job_semaphore:
+            return await self._process_single_video_impl(person, video, True, course_name)
+
+    async def _process_single_video_impl(self, person, video, add_invisible_watermark, course_name):
         # 1. 压缩原视频并添加logo水印图片
         logo = common.get_logo_watermark_image(person).as_posix()
         filename_with_extension = f"{video.stem}{self.config['result_video_type']}"
-        success = await self.ffmpeg_processor.compress_with_logo(video, person, logo, add_invisible_watermark)
-        if not success:
-            return success, None
-
-        stage1_video = None
-        if add_invisible_watermark:
-            stage1_video = common.get_person_video_stage_dir(person).joinpath(filename_with_extension)
-            success = await self._process_with_invisible_watermark_async(person, video.stem, stage1_video)
-        if stage1_video and not common.keep_stage1_file():
-            common.delete_file(stage1_video)
+        if add_invisible_watermark and common.is_single_encode_invisible():
+            # 单次编码: 压缩、logo、暗水印帧替换在同一个ffmpeg中完成
+            success = await self._process_with_single_encode_async(person, video, logo)
+        else:
+            success = await self.ffmpeg_processor.compress_with_logo(video, person, logo, add_invisible_watermark)
+            if not success:
+                return success, None
+
+            stage1_video = None
+            if add_invisible_watermark:
+                stage1_video = common.get_person_video_stage_dir(person).joinpath(filename_with_extension)
+                success = await self._process_with_invisible_watermark_async(person, video.stem, stage1_video)
+            if stage1_video and not common.keep_stage1_file():
+                common.delete_file(stage1_video)
 
         # 如果处理成功且需要上传，立即创建上传任务
         if success:
             common.add_video_to_person_detail(filename_with_extension, person)
             if course_name:
-                upload_task = asyncio.create_task(
-                    self._success_post(course_name, filename_with_extension, person)
-                )
-                self.upload_tasks.add(upload_task)
-                upload_task.add_done_callback(lambda t: self.upload_tasks.remove(t))
+                self._schedule_upload(course_name, filename_with_extension, person)
         return success, filename_with_extension
 
-    async def _success_post(self, course_name, filename_with_extension, person):
+    def _schedule_upload(self, course_name, filename_with_extension, person):
+        """创建上传任务, 在process_all结束前统一等待"""
+        upload_task = asyncio.create_task(
+            self.upload_result(course_name, filename_with_extension, person)
+        )
+        self.upload_tasks.add(upload_task)
+        upload_task.add_done_callback(lambda t: self.upload_tasks.remove(t))
+        person_tasks = self.person_upload_tasks.setdefault(person, set())
+        person_tasks.add(upload_task)
+        upload_task.add_done_callback(lambda t: person_tasks.discard(t))
+
+    def _finish_person(self, all_videos, person, course_name):
+        """
+        所有视频处理完成后标记完成, 该人的上传任务全部完成后再标记为可分享,
+        不用等其他人的视频处理完就可以分享
+        """
+        if not common.is_done_for_person(all_videos, person):
+            return
+        common.finish(person)
+        logging.info(f"'Finished course videos: {course_name} for person: '{person}'")
+        task = asyncio.create_task(self._mark_shareable(person))
+        self.upload_tasks.add(task)
+        task.add_done_callback(lambda t: self.upload_tasks.remove(t))
+
+    async def _mark_shareable(self, person):
+        pending = list(self.person_upload_tasks.pop(person, ()))
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if person in self.upload_failed_persons:
+            logging.info(f"'{person}'有视频上传失败, 暂不分享")
+            return
+        common.mark_shareable(person)
+        logging.info(f"'{person}'的视频已全部上传, 可以分享")
+        if common.is_share_on_ready() and common.is_sync_to_baidu():
+            from .. import share
+            await share.share_person(person)
+
+    async def upload_result(self, course_name, filename_with_extension, person) -> bool:
+        """上传人的结果视频, 上传失败时返回False并记录该人不可分享"""
         def upload_success_callback(local_path, remote_file):
             if common.is_delete_after_upload_success():
                 common.delete_file(local_path)
@@ -181,9 +597,20 @@ class VideoWatermarkProcessor:
             f = common.get_person_video_result_dir(person).joinpath(filename_with_extension).resolve()
             if f.exists():
                 remote_dir = f"{common.get_root_remote_dir()}/videos/{person}/{course_name}"
-                await tool.upload_file_with_limit(self.upload_semaphore, f, remote_dir, upload_success_callback=upload_success_callback)
+                success = await tool.upload_file_with_limit(self.upload_semaphore, f, remote_dir,
+                                                            upload_success_callback=upload_success_callback)
+                if not success:
+                    self.upload_failed_persons.add(person)
+                return success
             else:
                 logging.info(f"upload file not exists, file: '{f}'")
+        return True
+
+    def prepare_person(self, person):
+        """创建人的目录, 生成logo和二维码"""
+        text = f"{self.config['watermark_logo_text']}{person}"
+        self._initialize_directories(person)
+        self.generate_logo_and_qrcode(person, text, text)
 
     def _initialize_directories(self, person):
         """
@@ -193,7 +620,6 @@ class VideoWatermarkProcessor:
             common.get_qrcode_dir(),
             common.get_images_dir(),
             common.get_person_video_stage_dir(person),
-            common.get_person_origin_dir(),
             common.get_person_video_result_dir(person),
             common.get_person_metadata_result_dir(person)
         ]
@@ -253,60 +679,147 @@ class VideoWatermarkProcessor:
             preset=self.config['preset']
         )
 
-    async def process_video_async(self, person, watermark, video, filename, **kwargs):
-        """主处理函数"""
+    async def _process_with_single_encode_async(self, person, video, logo):
+        """单次编码的暗水印处理: 先按最终滤镜提取采样帧加暗水印, 再一次编码输出最终视频"""
         try:
-            # 获取视频元数据
             stats = os.stat(str(video))
+            await probe.get_catalog().get_async(video)
             video_info = videoprocess.get_video_info(video)
             frame_count, fps = video_info[2], video_info[3]
-            # resolution = f"{int(video_info[0])}x{int(video_info[1])}"
-
-            # 提取视频帧
-            await self.ffmpeg_processor.extract_all_frames(person, video, fps)
 
-            # 采样和处理帧
-            seed = self.generate_seed(kwargs.get('watermarkquality', 35))
-            samplelist = videoprocess.sampler(video, kwargs.get('sampletimes', 5), kwargs.get('peroid', 1))
-            watermark_shape = self._process_frames(video, samplelist, seed, watermark)
-
-            # 提取音频
-            await self.ffmpeg_processor.extract_audio(common.get_person_origin_dir(), video)
-
-            # 合成视频
-            await self.ffmpeg_processor.compose_video(person, video, fps, **kwargs)
+            seed = self.generate_seed(self.config['watermarkquality'])
+            samplelist = [i for i in videoprocess.sampler(video, 5, 1) if i < frame_count]
+            frame_output_dir = common.get_frame_output_dir(person, video.stem)
+            frame_processed_dir = common.get_frame_processed_dir(person, video.stem)
+            common.delete_then_create(frame_output_dir)
+            common.delete_then_create(frame_processed_dir)
+
+            success = await self.ffmpeg_processor.extract_logo_sample_frames(video, logo, samplelist, frame_output_dir)
+            if not success:
+                return False
+            watermark_shape = await self._embed_frames(frame_output_dir, frame_processed_dir,
+                                                       common.get_qrcode_image(person), seed)
+            frames = {int(f.stem): f for f in common.get_files(frame_processed_dir, recursive=False)}
+
+            success = await self.ffmpeg_processor.compress_with_logo_and_frames(
+                video, person, logo, frames, keep_stage1=common.keep_stage1_file())
+            if success:
+                self.save_metadata(person, video.stem, video, stats, frame_count, fps, samplelist, seed,
+                                   watermark_shape)
+            return success
+        except Exception as e:
+            logging.error(f"Single encode processing failed for {person}, {video}", exc_info=True)
+            return False
+        finally:
+            common.delete_file(common.get_job_scratch_dir(person, video.stem))
 
-            # 保存元数据
-            self.save_metadata(person, filename, video, stats, frame_count, fps, samplelist, seed, watermark_shape)
+    async def process_video_async(self, person, watermark, video, filename, **kwargs):
+        """主处理函数"""
+        try:
+            await probe.get_catalog().get_async(video)
+            job = self._new_invisible_job(person, watermark, video, filename, **kwargs)
+            await self._invisible_sample_embed(job)
+            if not await self._invisible_compose(job, **kwargs):
+                return False
+            self._invisible_save_metadata(job)
             return True
         except Exception as e:
             logging.error(f"Processing failed for {person}, {video}", exc_info=True)
             return False
+        finally:
+            common.delete_file(common.get_job_scratch_dir(person, filename))
+
+    def _new_invisible_job(self, person, watermark, video, filename, **kwargs):
+        """暗水印任务的上下文, 在各阶段之间传递, 调用前先用probe.get_catalog().get_async探测视频"""
+        # 获取视频元数据
+        video_info = videoprocess.get_video_info(video)
+        return {
+            'person': person,
+            'watermark': watermark,
+            'video': video,
+            'filename': filename,
+            'stats': os.stat(str(video)),
+            'frame_count': video_info[2],
+            'fps': video_info[3],
+            # 每个(人, 视频)任务独立的临时目录
+            'origin_dir': common.get_person_origin_dir(person, filename),
+            'seed': self.generate_seed(kwargs.get('watermarkquality', self.config.get('watermarkquality', 35))),
+            'samplelist': videoprocess.sampler(video, kwargs.get('sampletimes', 5), kwargs.get('peroid', 1))
+        }
 
-    def _process_frames(self, video, samplelist, seed, watermark):
+    async def _invisible_sample_embed(self, job) -> bool:
+        """提取视频帧, 采样帧加暗水印后替换"""
+        await self.ffmpeg_processor.extract_all_frames(job['person'], job['video'], job['fps'], job['origin_dir'])
+        job['watermark_shape'] = await self._process_frames(job['person'], job['filename'], job['video'],
+                                                            job['samplelist'], job['seed'], job['watermark'])
+        return True
+
+    async def _invisible_compose(self, job, **kwargs) -> bool:
+        """用替换后的帧和共用音轨合成视频"""
+        # 音轨每个原视频只提取一次, 所有人共用
+        audio_track = await self.ffmpeg_processor.get_audio_track(job['video'])
+        return await self.ffmpeg_processor.compose_video(job['person'], job['video'], job['fps'], job['origin_dir'],
+                                                         audio_track, **kwargs)
+
+    def _invisible_save_metadata(self, job):
+        self.save_metadata(job['person'], job['filename'], job['video'], job['stats'], job['frame_count'],
+                           job['fps'], job['samplelist'], job['seed'], job.get('watermark_shape'))
+
+    async def _process_frames(self, person, filename, video, samplelist, seed, watermark):
         """处理视频帧"""
-        frame_output_dir = common.get_frame_output_dir()
-        frame_processed_dir = common.get_frame_processed_dir()
+        frame_output_dir = common.get_frame_output_dir(person, filename)
+        frame_processed_dir = common.get_frame_processed_dir(person, filename)
         common.delete_then_create(frame_output_dir)
         common.delete_then_create(frame_processed_dir)
 
-        videoprocess.extract_frames(video, samplelist, frame_output_dir, filetype=".png")
+        await asyncio.to_thread(videoprocess.extract_frames, video, samplelist, frame_output_dir, filetype=".png")
 
-        origin_dir = common.get_person_origin_dir()
-        watermark_shape = None
+        watermark_shape = await self._embed_frames(frame_output_dir, frame_processed_dir, watermark, seed)
+        # 进行帧替换
+        origin_dir = common.get_person_origin_dir(person, filename)
+        for file in common.get_files(frame_processed_dir, recursive=False):
+            shutil.copy(file, origin_dir)
+        return watermark_shape
 
-        def process_frame(file: Path):
-            nonlocal watermark_shape
-            imlen = core.encodewatermark_image(frame_processed_dir, file, watermark, seed)
-            # 进行帧替换
-            shutil.copy(frame_processed_dir.joinpath(file.name), origin_dir)
-            if watermark_shape is None:
-                watermark_shape = imlen
-            return imlen
+    async def _embed_frames(self, frame_output_dir, frame_processed_dir, watermark, seed):
+        """
+        为frame_output_dir中的帧加暗水印, 结果写入frame_processed_dir, 返回水印尺寸
+        所有帧同时提交到进程池, 事件循环在等待期间继续处理ffmpeg和上传的输出
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._get_frame_pool()
+        files = common.get_files(frame_output_dir, recursive=False)
+        futures = [
+            loop.run_in_executor(pool, core.embed_frame, frame_processed_dir, file, watermark, seed)
+            for file in files
+        ]
+        results = await asyncio.gather(*futures, return_exceptions=True)
 
-        common.process_files(frame_output_dir, process_frame)
+        watermark_shape = None
+        for file, result in zip(files, results):
+            if isinstance(result, Exception):
+                logging.error(f"处理失败 {file}: {result}")
+            elif watermark_shape is None:
+                watermark_shape = result
         return watermark_shape
 
+    def _get_frame_pool(self):
+        """加暗水印的进程池, 第一次使用时创建"""
+        if self._frame_pool is None:
+            workers = common.get_frame_workers()
+            self._frame_pool = ProcessPoolExecutor(max_workers=workers)
+            logging.info(f"Created frame watermark process pool, workers: {workers}")
+        return self._frame_pool
+
+    def shutdown(self):
+        """关闭加暗水印的进程池, 不经过process_all的调用方(例如流水线)结束时调用"""
+        self._shutdown_frame_pool()
+
+    def _shutdown_frame_pool(self):
+        if self._frame_pool is not None:
+            self._frame_pool.shutdown(wait=True)
+            self._frame_pool = None
+
     def generate_seed(self, watermarkquality):
         """生成随机种子"""
         return [random.randint(1, 9999) for _ in range(2)] + [watermarkquality]
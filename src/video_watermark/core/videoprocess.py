@@ -1,6 +1,13 @@
+import subprocess
 from pathlib import Path
 import random
+from typing import Dict
+
 import cv2
+import numpy as np
+
+from ..common import environment
+from . import probe
 
 # frnm = 0
 
@@ -14,8 +21,7 @@ def sampler(video: Path, times=10, peroid=1):
     :return: 抽帧列表
     """
     framelist = []
-    videoc = cv2.VideoCapture(str(video.resolve()))
-    frame_count = int(videoc.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_count = get_video_info(video)[2]
     for i in range(int(times)):
         print("第", i + 1, "次采样处理")
         frame_number = random.randint(1, frame_count)
@@ -27,42 +33,115 @@ def sampler(video: Path, times=10, peroid=1):
     return list(set(framelist))
 
 
-def extract_frames(video_path, frame_indexes, output_path="/app/target/processframe", filetype=".jpg"):
+def extract_frames(video_path, frame_indexes, output_path="/app/target/processframe", filetype=".jpg", backend=None):
     """
     将视频处理后输出为图片
     :param video_path: 视频地址
     :param frame_indexes: 抽帧列表
     :param output_path: 输出路径
+    :param backend: 解码方式, opencv或ffmpeg, 为None时读取FRAME_EXTRACT_BACKEND配置
     :return:
     """
-    # 打开视频文件
-    video_capture = cv2.VideoCapture(str(Path(video_path).resolve()))
+    frames = read_frames(video_path, frame_indexes, backend)
+    for index, frame in frames.items():
+        # 保存当前帧为图片
+        output_file = f"{output_path}/{index}{filetype}"
+        cv2.imwrite(output_file, frame)
+        print(f"已保存帧位置 {index} 的图片为 {output_file}.")
+
 
-    # 获取视频总帧数
+def read_frames(video_path, frame_indexes, backend=None) -> Dict[int, np.ndarray]:
+    """
+    一次顺序解码读取指定的帧, 耗时只与视频长度有关, 与采样次数无关
+    :param video_path: 视频地址
+    :param frame_indexes: 抽帧列表, 帧号从1开始
+    :param backend: opencv(grab跳过, 命中时retrieve)或ffmpeg(一个select滤镜输出所有帧)
+    :return: 帧号 -> BGR图像
+    """
+    backend = backend or environment.get_frame_extract_backend()
+    if backend == 'ffmpeg':
+        return _read_frames_ffmpeg(video_path, frame_indexes)
+    return _read_frames_sequential(video_path, frame_indexes)
+
+
+def _read_frames_sequential(video_path, frame_indexes) -> Dict[int, np.ndarray]:
+    video_capture = cv2.VideoCapture(str(Path(video_path).resolve()))
     total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    indexes = _valid_indexes(frame_indexes, total_frames)
+
+    frames = {}
+    # 已经解码过的帧数
+    position = 0
+    for index in indexes:
+        # 第index帧之前的帧只grab不retrieve, 避免颜色转换和拷贝
+        while position < index - 1 and video_capture.grab():
+            position += 1
+        if position < index - 1 or not video_capture.grab():
+            print(f"帧位置 {index} 读取失败，跳过。")
+            break
+        position += 1
+        ret, frame = video_capture.retrieve()
+        if ret:
+            frames[index] = frame
+
+    video_capture.release()
+    return frames
 
-    # 遍历每个指定的帧位置
-    for index in frame_indexes:
+
+def _read_frames_ffmpeg(video_path, frame_indexes) -> Dict[int, np.ndarray]:
+    width, height, total_frames, _ = get_video_info(video_path)
+    width, height = int(width), int(height)
+    indexes = _valid_indexes(frame_indexes, total_frames)
+    if not indexes:
+        return {}
+
+    select = '+'.join(f'eq(n,{i - 1})' for i in indexes)
+    cmd = ['ffmpeg', '-v', 'error', '-i', str(Path(video_path).resolve()),
+           '-vf', f"select='{select}'", '-vsync', '0', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        print(f"ffmpeg抽帧失败: {result.stderr.decode('utf-8', errors='replace')}")
+        return {}
+
+    frame_size = width * height * 3
+    data = np.frombuffer(result.stdout, dtype=np.uint8)
+    count = min(len(indexes), len(data) // frame_size)
+    frames = data[:count * frame_size].reshape((count, height, width, 3))
+    # select按帧顺序输出, 第k帧对应第k小的帧号
+    return {index: frames[k].copy() for k, index in enumerate(indexes[:count])}
+
+
+def _valid_indexes(frame_indexes, total_frames):
+    indexes = []
+    for index in sorted(set(frame_indexes)):
         if index >= total_frames:
             print(f"帧位置 {index} 超过视频总帧数，跳过。")
             continue
+        indexes.append(index)
+    return indexes
 
-        # 设置当前帧位置
-        video_capture.set(cv2.CAP_PROP_POS_FRAMES, index - 1)
 
-        # 读取当前帧
-        ret, frame = video_capture.read()
-
-        # 保存当前帧为图片
-        output_file = f"{output_path}/{index}{filetype}"
-        cv2.imwrite(output_file, frame)
-        print(f"已保存帧位置 {index} 的图片为 {output_file}.")
-
-    # 关闭视频文件
+def read_frame_at(video_path, seconds):
+    """
+    读取指定时间点的一帧
+    :return: BGR图像, 读取失败返回None
+    """
+    video_capture = cv2.VideoCapture(str(Path(video_path).resolve()))
+    video_capture.set(cv2.CAP_PROP_POS_MSEC, seconds * 1000)
+    ret, frame = video_capture.read()
     video_capture.release()
+    return frame if ret else None
 
 
 def get_video_info(video):
+    """
+    获取视频信息, 优先读取探测目录(精确帧率), ffprobe不可用时回退到opencv
+    :return: [width, height, frame_count, fps]
+    """
+    info = probe.get_catalog().get(video)
+    if info and info['width'] and info['fps']:
+        return [info['width'], info['height'], info['frame_count'], info['fps']]
+
     videoc = cv2.VideoCapture(str(video))
     # 获取视频的宽度（单位：像素）
     width = videoc.get(cv2.CAP_PROP_FRAME_WIDTH)
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import shutil
+import time
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+INOTIFY_EVENTS = ['create', 'modify', 'close_write', 'moved_to']
+
+
+class FileWatcher:
+    """
+    监视目录中新增或写完的文件
+
+    有inotifywait(inotify-tools)时按inotify事件发现变化的文件, 否则定期对比文件的(大小, mtime)快照;
+    启动时已经存在的文件作为基线不会输出, 文件大小在stable_seconds内不再变化才认为已经写完
+    """
+
+    def __init__(self, dirs: List[Path], file_filter: Callable[[Path], bool], stable_seconds: int,
+                 poll_interval: int, use_inotify: bool = True):
+        self.dirs = [Path(d) for d in dirs]
+        self.file_filter = file_filter
+        self.stable_seconds = stable_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and shutil.which('inotifywait') is not None
+        self._snapshot: Dict[Path, Tuple[int, int]] = {}
+        self._dirty = set()
+        # path -> (大小, 大小开始保持不变的时间)
+        self._candidates: Dict[Path, Tuple[int, float]] = {}
+
+    async def watch(self) -> AsyncIterator[Path]:
+        """持续输出写完的新文件"""
+        self._snapshot = self._scan()
+        logging.info(f"开始监视目录: {[str(d) for d in self.dirs]}, "
+                     f"方式: {'inotify' if self.use_inotify else 'mtime poll'}, 已有文件: {len(self._snapshot)}")
+        process = await self._start_inotify() if self.use_inotify else None
+        reader = asyncio.create_task(self._read_inotify(process)) if process else None
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                if not process or process.returncode is not None:
+                    self._poll()
+                for path in self._check_stable():
+                    yield path
+        finally:
+            if reader:
+                reader.cancel()
+            if process and process.returncode is None:
+                process.terminate()
+
+    def has_pending(self, d: Path) -> bool:
+        """目录中是否还有没写完的文件"""
+        return any(f.parent == d for f in list(self._candidates) + list(self._dirty))
+
+    def _scan(self) -> Dict[Path, Tuple[int, int]]:
+        snapshot = {}
+        for d in self.dirs:
+            if not d.exists():
+                continue
+            for f in d.rglob('*'):
+                if self._accept(f):
+                    stat = f.stat()
+                    snapshot[f] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _poll(self):
+        snapshot = self._scan()
+        self._dirty.update(f for f, state in snapshot.items() if self._snapshot.get(f) != state)
+        self._snapshot = snapshot
+
+    def _accept(self, f: Path) -> bool:
+        try:
+            return f.is_file() and self.file_filter(f)
+        except OSError:
+            return False
+
+    def _check_stable(self) -> List[Path]:
+        """大小保持不变超过stable_seconds的文件"""
+        now = time.time()
+        for f in self._dirty:
+            self._candidates.setdefault(f, (-1, now))
+        self._dirty.clear()
+
+        ready = []
+        for f, (size, since) in list(self._candidates.items()):
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                self._candidates.pop(f)
+                continue
+            if stat.st_size != size:
+                self._candidates[f] = (stat.st_size, now)
+            elif now - since >= self.stable_seconds:
+                self._candidates.pop(f)
+                self._snapshot[f] = (stat.st_size, stat.st_mtime_ns)
+                ready.append(f)
+        return ready
+
+    async def _start_inotify(self) -> Optional[asyncio.subprocess.Process]:
+        dirs = [str(d) for d in self.dirs if d.exists()]
+        if not dirs:
+            return None
+        events = [arg for e in INOTIFY_EVENTS for arg in ('-e', e)]
+        try:
+            return await asyncio.create_subprocess_exec('inotifywait', '-m', '-r', '-q', *events,
+                                                        '--format', '%w%f', *dirs,
+                                                        stdout=asyncio.subprocess.PIPE)
+        except OSError as e:
+            logging.warning(f"inotifywait启动失败, 改为mtime poll: {e}")
+            return None
+
+    async def _read_inotify(self, process: asyncio.subprocess.Process):
+        async for line in process.stdout:
+            f = Path(line.decode('utf-8', errors='replace').rstrip('\n'))
+            if self._accept(f):
+                self._dirty.add(f)
+        logging.warning("inotifywait已退出, 改为mtime poll")
@@ -0,0 +1,47 @@
+import logging
+import asyncio
+
+from . import common
+from .core import VideoWatermarkProcessor
+from .core import course_planner
+
+
+def main():
+    """从MTS原始片段一次编码生成每个人的水印视频, 代替 concate -> scale -> main"""
+    common.init()
+    root = common.get_mts_video_root_dir()
+    if not root.exists():
+        logging.info(f'dir: {root} not exists')
+        return
+    episode_dirs = course_planner.find_episode_dirs(root)
+    if not episode_dirs:
+        logging.info(f"{root} 目录下没有需要处理的视频目录")
+        return
+
+    config = {
+        'watermark_logo_text': common.get_watermark_logo_text(),
+        'font_size': 24,
+        'bg_color': 'white',
+        'font_color': 'red',
+        'spacing': 4,
+        'padding': 5,
+        'align': 'center',
+        'watermarkquality': 35,
+        'scale': (1280, 720),
+        'stage_crf': 23,
+        'stage_preset': 'fast',
+        'crf': 17,
+        'preset': 'slow',
+        'horizontal_speed': 20,
+        'vertical_speed': 40,
+        'ffmpeg_options': common.get_ffmpeg_options(),
+        'result_video_type': common.get_result_video_type()
+    }
+    processor = VideoWatermarkProcessor(config)
+    persons = common.get_person_names()
+    asyncio.run(processor.process_course(episode_dirs, persons))
+    logging.info("All course videos processed successfully")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+from natsort import natsorted
+
+from . import common
+from . import concate
+from . import scale
+from . import share
+from .core import VideoWatermarkProcessor
+from .core import course_planner
+
+_END = object()
+
+
+def main():
+    """一个命令完成 concate -> scale -> main -> upload -> share, 每个视频完成一个阶段后立即进入下一个阶段"""
+    common.init()
+    config = {
+        'watermark_logo_text': common.get_watermark_logo_text(),
+        'font_size': 24,
+        'bg_color': 'white',
+        'font_color': 'red',
+        'spacing': 4,
+        'padding': 5,
+        'align': 'center',
+        'watermarkquality': 35,
+        'scale': (1280, 720),
+        'stage_crf': 23,
+        'stage_preset': 'fast',
+        'crf': 17,
+        'preset': 'slow',
+        'horizontal_speed': 20,
+        'vertical_speed': 40,
+        'ffmpeg_options': common.get_ffmpeg_options(),
+        'result_video_type': common.get_result_video_type()
+    }
+    processor = VideoWatermarkProcessor(config)
+    try:
+        asyncio.run(Pipeline(processor, common.get_person_names()).run())
+    finally:
+        processor.shutdown()
+
+
+class _Stage:
+    """流水线的一个阶段: 有界输入队列 + 固定数量的worker, 队列满时上游阶段等待"""
+
+    def __init__(self, name: str, func: Callable[[object], Awaitable], concurrency: int, queue_size: int):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue(queue_size)
+        self.count = 0
+
+    async def put(self, item):
+        await self.queue.put(item)
+
+    async def close(self):
+        """上游已经没有新的输入"""
+        await self.queue.put(_END)
+
+    async def run(self):
+        start = time.time()
+        await asyncio.gather(*[self._work() for _ in range(self.concurrency)])
+        logging.info(f"流水线阶段结束: {self.name}, 处理了{self.count}项, costs {time.time() - start:.2f} seconds")
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            if item is _END:
+                # 通知同一阶段的其他worker
+                await self.queue.put(_END)
+                return
+            try:
+                await self.func(item)
+                self.count += 1
+            except Exception as e:
+                logging.error(f"流水线阶段{self.name}处理出错, item: {item}, {e}", exc_info=True)
+
+
+class Pipeline:
+    """
+    用有界队列连接 concat -> scale / watermark -> upload -> share 各阶段:
+    第一集拼接完成后就开始为所有人加水印, 后面的集还在拼接; 每个人的视频生成后立即上传,
+    一个人的视频全部上传后立即分享, 总耗时接近最慢的一个阶段, 而不是所有阶段之和
+
+    scale的输出不被加水印使用, 所以拼接结果同时进入scale和watermark两个阶段;
+    队列只限制阶段之间的数量, watermark阶段内暗水印任务由processor的任务级并发限制, 全帧临时目录不超过INVISIBLE_CONCURRENCY个
+    """
+
+    def __init__(self, processor: VideoWatermarkProcessor, persons: List[str]):
+        self.processor = processor
+        self.all_persons = persons
+        self.persons: List[str] = []
+        self.video_dir = common.get_video_dir()
+        self.scale_dir = common.get_scale_dir()
+        self.course_name = common.get_current_course_name() or self.video_dir.name
+        self.all_videos: List[Path] = []
+        self.pending_uploads: Dict[str, int] = {}
+        self.done_persons = set()
+
+        limits = common.get_pipeline_concurrency()
+        queue_size = common.get_pipeline_queue_size()
+        self.concat_stage = _Stage('concat', self._concat, limits['concat'], queue_size)
+        self.scale_stage = _Stage('scale', self._scale, limits['scale'], queue_size)
+        self.watermark_stage = _Stage('watermark', self._watermark, limits['watermark'], queue_size)
+        self.upload_stage = _Stage('upload', self._upload, limits['upload'], queue_size)
+        self.share_stage = _Stage('share', self._share, limits['share'], queue_size)
+
+    async def run(self):
+        start = time.time()
+        common.create_dir(self.video_dir)
+        common.create_dir(self.scale_dir)
+        mts_root = common.get_mts_video_root_dir()
+        episode_dirs = course_planner.find_episode_dirs(mts_root) if mts_root.exists() else []
+        existing = common.get_videos(self.video_dir)
+        existing_names = {v.name for v in existing}
+        episode_dirs = [d for d in episode_dirs if f'{d.name}.mp4' not in existing_names]
+
+        # 是否加暗水印按视频在最终VIDEO_DIR中的位置决定, 拼接完成之前先按计划的文件名排序
+        planned = existing + [self.video_dir.joinpath(f'{d.name}.mp4') for d in episode_dirs]
+        self.all_videos = natsorted(planned, key=lambda x: x.name)
+        # 原视频内容或处理参数变化的结果重新生成, 改名的原视频直接使用已有结果
+        common.reconcile_person_videos(existing, self.all_persons, self.processor.config,
+                                       self._invisible_videos(existing))
+        self.persons = [person for person in self.all_persons if not common.is_finished(person)]
+        if not self.persons:
+            logging.info("所有人都已经处理完成")
+            return
+        logging.info(f"流水线开始: {len(episode_dirs)}集待拼接, {len(existing)}个已有视频, {len(self.persons)}人")
+        for person in self.persons:
+            self.processor.prepare_person(person)
+
+        async def feed_concat():
+            for d in episode_dirs:
+                await self.concat_stage.put(d)
+            await self.concat_stage.close()
+
+        async def feed_existing():
+            for video in existing:
+                await self._fan_out(video)
+
+        async def run_sources():
+            await asyncio.gather(self.concat_stage.run(), feed_existing())
+            await self.scale_stage.close()
+            await self.watermark_stage.close()
+
+        async def run_watermark():
+            await self.watermark_stage.run()
+            await self.upload_stage.close()
+
+        async def run_upload():
+            await self.upload_stage.run()
+            await self.share_stage.close()
+
+        await asyncio.gather(feed_concat(), run_sources(), self.scale_stage.run(), run_watermark(), run_upload(),
+                             self.share_stage.run())
+        # 记录本次生成的结果的指纹
+        common.reconcile_person_videos(self.all_videos, self.persons, self.processor.config,
+                                       self._invisible_videos(self.all_videos), record=True)
+        logging.info(f"流水线结束, costs {time.time() - start:.2f} seconds")
+
+    def _invisible_videos(self, videos):
+        names = [v.name for v in self.all_videos]
+        return [v for v in videos if common.is_need_add_invisible_watermark(names.index(v.name))]
+
+    async def _fan_out(self, video: Path):
+        await self.scale_stage.put(video)
+        await self.watermark_stage.put(video)
+
+    async def _concat(self, d: Path):
+        result = common.get_mts_video_target_dir().joinpath(f'{d.name}.mp4')
+        if result.exists():
+            logging.info(f"已经拼接过, 直接使用: {result}")
+        else:
+            if not concate.write_list_file(d):
+                return
+            result = await concate.process_directory(self.processor.ffmpeg_processor, d)
+            if not result or not Path(result).exists():
+                return
+        await self._fan_out(concate.publish(Path(result), self.video_dir))
+
+    async def _scale(self, video: Path):
+        await scale.scale_video(self.processor.ffmpeg_processor, video, self.scale_dir,
+                                self.processor.config['scale'])
+
+    async def _watermark(self, video: Path):
+        add_invisible_watermark = bool(self._invisible_videos([video]))
+        todo = [person for person in self.persons if not common.is_already_processed(video, person)]
+
+        async def process(person):
+            # 暗水印任务的并发由processor的任务级信号量限制, 每个人的视频生成后立即进入上传阶段
+            try:
+                success, filename_with_extension = await self.processor.process_single_video_async(
+                    person, video, add_invisible_watermark)
+            except Exception as e:
+                logging.error(f"Error processing '{video.name}' for '{person}': {e}", exc_info=True)
+                return
+            if success:
+                self.pending_uploads[person] = self.pending_uploads.get(person, 0) + 1
+                await self.upload_stage.put((person, filename_with_extension))
+
+        await asyncio.gather(*[process(person) for person in todo])
+        for person in self.persons:
+            await self._check_done(person)
+
+    async def _upload(self, item):
+        person, filename_with_extension = item
+        try:
+            await self.processor.upload_result(self.course_name, filename_with_extension, person)
+        finally:
+            self.pending_uploads[person] -= 1
+        await self._check_done(person)
+
+    async def _check_done(self, person):
+        """人的视频全部生成并上传后标记完成, 进入分享阶段"""
+        if (person in self.done_persons or self.pending_uploads.get(person)
+                or not common.is_done_for_person(self.all_videos, person)):
+            return
+        self.done_persons.add(person)
+        common.finish(person)
+        logging.info(f"'Finished course videos: {self.course_name} for person: '{person}'")
+        if person in self.processor.upload_failed_persons:
+            logging.info(f"'{person}'有视频上传失败, 暂不分享")
+            return
+        common.mark_shareable(person)
+        await self.share_stage.put(person)
+
+    async def _share(self, person):
+        if not common.is_sync_to_baidu():
+            return
+        await share.share_person(person)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+
+from . import audio
+from . import common
+from . import scale
+from .core.ffmpeg_processor import FFmpegProcessor
+
+
+def main():
+    asyncio.run(gen_preprocess())
+
+
+async def gen_preprocess():
+    """
+    一次解码原视频, 同时生成音频目录下的m4a和scale目录下的720p视频, 代替先后执行audio和scale
+    每种输出分别检查是否已经处理过, 只缺一种输出的视频只生成缺少的那一种
+    """
+    common.init()
+    # 初始化目录
+    target_audio_dir = common.get_audio_dir()
+    target_scale_dir = common.get_scale_dir()
+    common.create_dir(target_audio_dir)
+    common.create_dir(target_scale_dir)
+    video_dir = common.get_video_dir()
+    all = common.get_videos(video_dir)
+    if len(all) == 0:
+        logging.info(f"{video_dir} 目录下没有原视频文件,请检查VIDEO_DIR路径配置是否正确")
+        return
+
+    # 创建FFmpeg处理器, 参数与scale一致, 两个命令生成的结果共用同一份指纹
+    config = {
+        'scale': (1280, 720),
+        'crf': 17,
+        'preset': 'slow',
+        'ffmpeg_options': common.get_ffmpeg_options(),
+        'result_video_type': common.get_result_video_type()
+    }
+    ffmpeg_processor = FFmpegProcessor(config)
+
+    # 原视频内容和参数都没有变化的输出跳过, 改名的原视频直接使用已有结果
+    index = common.load_output_index()
+    need_audio = [v for v in all if not audio.is_extracted(v, target_audio_dir, index)]
+    common.save_output_index(index)
+    # 音频文件没有视频流, 不需要scale
+    need_scale = [v for v in all
+                  if not common.is_audio_file(v)
+                  and not scale.is_scaled(ffmpeg_processor, v, target_scale_dir, config['scale'])]
+    if len(need_audio) == 0 and len(need_scale) == 0:
+        logging.info(f"{video_dir} 目录下音视频已经处理过了")
+        return
+
+    # 配置了SCALE_RENDITIONS时scale按多分辨率单独输出, 不能与音频一次解码
+    renditions = common.get_scale_renditions()
+    tasks = []
+    for video in need_audio + [v for v in need_scale if v not in need_audio]:
+        if video in need_audio and video in need_scale and not renditions:
+            task = _preprocess(ffmpeg_processor, video, target_audio_dir, target_scale_dir, config['scale'])
+        elif video in need_audio:
+            task = _audio(ffmpeg_processor, video, target_audio_dir)
+        else:
+            task = scale.scale_video(ffmpeg_processor, video, target_scale_dir, config['scale'])
+        tasks.append(task)
+
+    # 等待所有任务完成
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    cnt = 0
+    for result in results:
+        if isinstance(result, bool) and result == True:
+            cnt += 1
+        elif isinstance(result, Exception):
+            logging.error(f"处理目录时出错: {result}")
+
+    logging.info(f"共预处理了{cnt}个音视频文件")
+
+
+async def _preprocess(ffmpeg_processor, video, target_audio_dir, target_scale_dir, scale_size) -> bool:
+    success = await ffmpeg_processor.preprocess(video, target_audio_dir, target_scale_dir, scale_size)
+    if success:
+        audio.record_outputs([video], target_audio_dir)
+        scale.record_outputs(ffmpeg_processor, [video], target_scale_dir, scale_size)
+    return success
+
+
+async def _audio(ffmpeg_processor, video, target_audio_dir) -> bool:
+    success = await ffmpeg_processor.audio(video, target_audio_dir)
+    if success:
+        audio.record_outputs([video], target_audio_dir)
+    return success
+
+
+if __name__ == '__main__':
+    main()
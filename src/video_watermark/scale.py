@@ -18,15 +18,6 @@ async def gen_scale():
     if len(all) == 0:
         logging.info(f"{video_dir} 目录下没有原视频文件,请检查VIDEO_DIR路径配置是否正确")
         return
-    all_map = common.to_map(all)
-    processed_map = common.to_map(common.get_videos(target_dir))
-    difference = set(all_map.keys()) - set(processed_map.keys())
-    if len(difference) == 0:
-        logging.info(f"{video_dir} 目录下音视频已经处理过了")
-        return
-    videos = []
-    for diff in difference:
-        videos.append(all_map[diff])
 
     # 创建FFmpeg处理器
     config = {
@@ -38,21 +29,104 @@ async def gen_scale():
     }
     ffmpeg_processor = FFmpegProcessor(config)
 
-    tasks = []
-    for video in videos:
-        task = ffmpeg_processor.scale(video, target_dir, config['scale'])
-        tasks.append(task)
+    renditions = common.get_scale_renditions()
+    if renditions:
+        tasks = gen_renditions_tasks(ffmpeg_processor, all, target_dir, config['scale'])
+    else:
+        tasks = gen_scale_tasks(ffmpeg_processor, all, target_dir, config['scale'])
+    if len(tasks) == 0:
+        logging.info(f"{video_dir} 目录下音视频已经处理过了")
+        return
 
     # 等待所有任务完成
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
     cnt = 0
     for result in results:
         if isinstance(result, bool) and result == True:
             cnt += 1
         elif isinstance(result, Exception):
             logging.error(f"处理时出错: {result}")
+    succeeded = [video for video, result in zip(tasks.keys(), results) if result is True]
+    record_outputs(ffmpeg_processor, succeeded, target_dir, config['scale'])
     logging.info(f"共提取了{cnt}个视频文件")
 
 
+def gen_scale_tasks(ffmpeg_processor, all, target_dir, scale):
+    """
+    只输出一种分辨率, 直接保存在scale目录下, 原视频内容和参数都没有变化的跳过
+    :return: {video: task}
+    """
+    index = common.load_output_index()
+    _, output_dir, config = _targets(ffmpeg_processor, target_dir, scale)[0]
+    pending = [v for v in all if not common.check_output(v, _output(output_dir, v), config, index=index)]
+    common.save_output_index(index)
+    return {v: ffmpeg_processor.scale_segmented(v, target_dir, scale) for v in pending}
+
+
+async def scale_video(ffmpeg_processor, video, target_dir, scale) -> bool:
+    """处理单个新视频, 配置了SCALE_RENDITIONS时输出所有分辨率, 原视频内容和参数都没有变化的跳过"""
+    if is_scaled(ffmpeg_processor, video, target_dir, scale):
+        return True
+    if common.get_scale_renditions():
+        todo = [dict(rendition, target_dir=output_dir)
+                for rendition, output_dir, _ in _targets(ffmpeg_processor, target_dir, scale)]
+        success = await ffmpeg_processor.scale_renditions(video, todo)
+    else:
+        success = await ffmpeg_processor.scale_segmented(video, target_dir, scale)
+    if success:
+        record_outputs(ffmpeg_processor, [video], target_dir, scale)
+    return success
+
+
+def is_scaled(ffmpeg_processor, video, target_dir, scale) -> bool:
+    """单个视频是否已经按当前参数输出了所有需要的分辨率"""
+    return all(common.check_output(video, _output(output_dir, video), config)
+               for _, output_dir, config in _targets(ffmpeg_processor, target_dir, scale))
+
+
+def gen_renditions_tasks(ffmpeg_processor, all, target_dir, scale):
+    """
+    输出多种分辨率, 每种分辨率保存在scale目录下各自的子目录中并分别检查原视频内容和参数是否变化,
+    同一个原视频需要重新生成的分辨率在一个ffmpeg中一次解码输出
+    :return: {video: task}
+    """
+    index = common.load_output_index()
+    pending = {}
+    for rendition, output_dir, config in _targets(ffmpeg_processor, target_dir, scale):
+        for video in all:
+            if not common.check_output(video, _output(output_dir, video), config, index=index):
+                pending.setdefault(video, []).append(dict(rendition, target_dir=output_dir))
+    common.save_output_index(index)
+    return {video: ffmpeg_processor.scale_renditions(video, todo) for video, todo in pending.items()}
+
+
+def record_outputs(ffmpeg_processor, videos, target_dir, scale):
+    """记录本次成功生成的结果的指纹, 下次运行时参数或原视频变化才重新生成"""
+    index = common.load_output_index()
+    for _, output_dir, config in _targets(ffmpeg_processor, target_dir, scale):
+        for video in videos:
+            if _output(output_dir, video).exists():
+                common.record_output(video, _output(output_dir, video), config, index=index)
+    common.save_output_index(index)
+
+
+def _targets(ffmpeg_processor, target_dir, scale):
+    """每种输出分辨率的(rendition, 输出目录, 生效的参数), 没有配置SCALE_RENDITIONS时只有一种"""
+    renditions = common.get_scale_renditions()
+    config = dict(ffmpeg_processor.config, **common.scale_settings())
+    if not renditions:
+        return [(None, target_dir, dict(config, scale=scale))]
+    result = []
+    for rendition in renditions:
+        rendition_dir = target_dir.joinpath(rendition['name'])
+        common.create_dir(rendition_dir)
+        result.append((rendition, rendition_dir, dict(config, rendition=rendition)))
+    return result
+
+
+def _output(output_dir, video):
+    return output_dir.joinpath(f'{video.stem}{common.get_result_video_type()}')
+
+
 if __name__ == '__main__':
     main()
@@ -61,6 +61,16 @@ async def batch_share(person_contact_mappings: Dict[str, str]):
             _do_send_wechat(person, contact_name, share_link)
 
 
+async def share_person(person):
+    """某个人的视频全部上传完成后立即生成分享链接并发送, 不等其他人(SHARE_ON_READY=1)"""
+    contact_name = common.get_person_name_mappings().get(person)
+    if _get_person_sent_mappings().get(person) is True:
+        logging.info(f'已成功发送过分享链接，跳过, person: {person}, contact_name: {contact_name}')
+        return
+    share_link = (await gen_share_links([person])).get(person)
+    _do_send_wechat(person, contact_name, share_link)
+
+
 async def gen_share_links(persons):
     validity_period = common.get_validity_period()
     res = {}
@@ -8,7 +8,7 @@ from natsort import natsorted
 
 from ..common import file_operations
 from ..common import environment
-from ..tool import async_run
+from ..tool import async_run, low_priority
 
 # 百度网盘上传工具命令
 BAIDUPCS = "BaiduPCS-Go"
@@ -101,7 +101,7 @@ async def upload_file(local_path: Path, remote_dir, overwrite=False, upload_succ
         options = '--policy overwrite' if overwrite else ''
         upload_cmd = f'{BAIDUPCS} upload "{local_path}" "{remote_dir}" --norapid {options}'
         return_code, stdout, _ = await async_run(
-            upload_cmd,
+            low_priority(upload_cmd),
             timeout=environment.get_upload_timeout(),
             output_timeout=30,  # 30s idle timeout
             timeout_callback=on_timeout,
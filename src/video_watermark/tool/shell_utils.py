@@ -1,6 +1,8 @@
 import asyncio
 import logging
+import os
 import shlex
+import shutil
 import subprocess
 import sys
 import time
@@ -37,7 +39,8 @@ async def async_run(cmd: str,
                     print_cmd=True,
                     process_id: Optional[str] = None,  # 新增参数
                     use_dedicated_line: bool = False,
-                    progress_line_checker: Optional[Callable[[str], bool]] = None  # 新增参数
+                    progress_line_checker: Optional[Callable[[str], bool]] = None,  # 新增参数
+                    process_start_callback: Optional[Callable[[int], Union[None, Awaitable[None]]]] = None
                     ) -> Tuple[Optional[int], Optional[str], Optional[str]]:
     """
     Execute a shell command asynchronously with comprehensive monitoring and callback support.
@@ -65,6 +68,7 @@ async def async_run(cmd: str,
         :param process_id (Optional[str]): Unique identifier for the process, used for progress tracking
         :param use_dedicated_line (bool): Enable dedicated line display mode for progress updates (default: False)
         :param progress_line_checker (Optional[Callable[[str], bool]]): Function to identify progress lines for dedicated display
+        :param process_start_callback: Callback with the pid right after the process is started
 
     :Returns:
         Tuple of (return_code, stdout, stderr) where stdout/stderr are None if not captured
@@ -196,6 +200,8 @@ async def async_run(cmd: str,
             limit=limit
         )
 
+        await execute_callback(process_start_callback, process.pid)
+
         # 生成进程ID用于多行显示
         if not process_id:
             process_id = f"pid:{process.pid}"
@@ -301,6 +307,17 @@ async def execute_callback(
         logging.warning(f"Callback execution failed: {e}\n{traceback.format_exc()}")
 
 
+def low_priority(cmd: str) -> str:
+    """以较低的CPU和IO优先级运行后台命令(上传、音频降噪等), 系统不支持时原样返回"""
+    if os.name != 'posix':
+        return cmd
+    if shutil.which('ionice'):
+        cmd = f'ionice -c 2 -n 7 {cmd}'
+    if shutil.which('nice'):
+        cmd = f'nice -n 10 {cmd}'
+    return cmd
+
+
 def run(cmd):
     logging.info(f"begin to run command: {cmd}")
     # if is_windows():
@@ -0,0 +1,30 @@
+import logging
+import sys
+from pathlib import Path
+
+from . import common
+from .core import forensic
+
+
+def main():
+    """
+    从可疑视频中读回A/B片段序列, 找到泄露的人
+    usage: python -m video_watermark.trace <可疑视频> <原视频文件名(不含扩展名)>
+    """
+    common.init()
+    if len(sys.argv) < 3:
+        logging.info("usage: python -m video_watermark.trace <suspect_video> <source_video_stem>")
+        return
+    suspect = Path(sys.argv[1])
+    if not suspect.exists():
+        logging.info(f"可疑视频不存在: {suspect}")
+        return
+    person = forensic.trace(suspect, sys.argv[2])
+    if person:
+        logging.info(f"可疑视频属于: {person}")
+    else:
+        logging.info(f"无法从可疑视频中识别出人物: {suspect}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Set
+
+from . import common
+from . import concate
+from . import scale
+from .core import VideoWatermarkProcessor
+from .core.watcher import FileWatcher
+
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mkv', '.wmv', '.mov', '.m4v'}
+
+
+def main():
+    common.init()
+    asyncio.run(watch())
+
+
+async def watch():
+    """
+    常驻运行, 监视MTS_VIDEO_DIR和VIDEO_DIR:
+    - MTS_VIDEO_DIR中一个目录的片段都写完后拼接, 结果放入VIDEO_DIR
+    - VIDEO_DIR中新的视频写完后scale, 并为所有人加水印、上传
+    启动时已经存在的文件不处理, 请先用批量命令处理
+    """
+    config = {
+        'watermark_logo_text': common.get_watermark_logo_text(),
+        'font_size': 24,
+        'bg_color': 'white',
+        'font_color': 'red',
+        'spacing': 4,
+        'padding': 5,
+        'align': 'center',
+        'watermarkquality': 35,
+        'scale': (1280, 720),
+        'stage_crf': 23,
+        'stage_preset': 'fast',
+        'crf': 17,
+        'preset': 'slow',
+        'horizontal_speed': 20,
+        'vertical_speed': 40,
+        'ffmpeg_options': common.get_ffmpeg_options(),
+        'result_video_type': common.get_result_video_type()
+    }
+    processor = VideoWatermarkProcessor(config)
+    mts_root = common.get_mts_video_root_dir().resolve()
+    mts_target = common.get_mts_video_target_dir().resolve()
+    video_dir = common.get_video_dir().resolve()
+    common.create_dir(video_dir)
+    stable_seconds = common.get_watch_stable_seconds()
+
+    def file_filter(f: Path) -> bool:
+        if f.name.startswith('.') or f.name.startswith('output'):
+            return False
+        if video_dir in f.parents:
+            return f.suffix in VIDEO_EXTENSIONS
+        return mts_target not in f.parents and f.suffix == common.get_video_format()
+
+    watcher = FileWatcher([mts_root, video_dir], file_filter, stable_seconds, common.get_watch_poll_interval(),
+                          common.is_watch_use_inotify())
+    video_queue = asyncio.Queue()
+    worker = asyncio.create_task(_process_videos(processor, video_queue, video_dir))
+    episode_tasks: Dict[Path, asyncio.Task] = {}
+    # 正在拼接的目录不能取消, 拼接期间又有新片段的目录记为dirty, 拼接完成后重新拼接
+    concatenating: Set[Path] = set()
+    dirty: Set[Path] = set()
+    try:
+        async for f in watcher.watch():
+            if video_dir in f.parents:
+                logging.info(f"发现新视频: {f}")
+                await video_queue.put(f)
+                continue
+            # 同一个目录的片段陆续写完, 最后一个片段之后没有新片段才拼接
+            d = f.parent
+            if d in episode_tasks and not episode_tasks[d].done():
+                if d in concatenating:
+                    dirty.add(d)
+                    continue
+                episode_tasks[d].cancel()
+            episode_tasks[d] = asyncio.create_task(
+                _concat_when_idle(processor, watcher, d, video_dir, stable_seconds, concatenating, dirty))
+    finally:
+        worker.cancel()
+
+
+async def _concat_when_idle(processor, watcher, d: Path, video_dir: Path, stable_seconds: int,
+                            concatenating: Set[Path], dirty: Set[Path]):
+    """
+    目录中没有还在写入的片段后拼接, 拼接结果放入VIDEO_DIR后由watcher继续处理
+    只有等待阶段可以被取消, 拼接开始后不再取消(否则会留下不完整的输出), 拼接期间目录有新片段时拼接完成后重新拼接
+    """
+    while True:
+        while True:
+            await asyncio.sleep(stable_seconds)
+            if not watcher.has_pending(d):
+                break
+        concatenating.add(d)
+        try:
+            await _concat(processor, d, video_dir)
+        finally:
+            concatenating.discard(d)
+        if d not in dirty:
+            return
+        dirty.discard(d)
+        logging.info(f"拼接期间目录有新片段, 重新拼接: {d}")
+
+
+async def _concat(processor, d: Path, video_dir: Path):
+    if not concate.write_list_file(d):
+        return
+    try:
+        result = await concate.process_directory(processor.ffmpeg_processor, d)
+    except Exception as e:
+        logging.error(f"拼接失败, dir: {d}, {e}", exc_info=True)
+        return
+    if result and Path(result).exists():
+        concate.publish(Path(result), video_dir)
+
+
+async def _process_videos(processor, video_queue: asyncio.Queue, video_dir: Path):
+    """新视频逐个处理: scale和加水印同时进行, 水印视频生成后立即上传"""
+    scale_dir = common.get_scale_dir()
+    common.create_dir(scale_dir)
+    while True:
+        video = await video_queue.get()
+        try:
+            all_videos = common.get_videos(video_dir)
+            persons = common.get_person_names()
+            results = await asyncio.gather(
+                scale.scale_video(processor.ffmpeg_processor, video, scale_dir, processor.config['scale']),
+                processor.process_new_video(video, persons, all_videos),
+                return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logging.error(f"处理新视频出错, video: {video}, {result}", exc_info=result)
+            logging.info(f"新视频处理完成: {video}")
+        finally:
+            video_queue.task_done()
+
+
+if __name__ == '__main__':
+    main()